@@ -1,15 +1,28 @@
 #!/usr/bin/env python3
 # -*- coding: utf-8 -*-
 import os
+import gzip
+import json
 import time
+import asyncio
+import hashlib
+import threading
 import subprocess
-from typing import Dict, Any
-from fastapi import FastAPI, HTTPException, Header, Depends
+from typing import Dict, Any, Optional
+from fastapi import FastAPI, HTTPException, Header, Depends, Request, Response
 from pydantic import BaseModel
 import yaml
 
 import haproxy as hx
 import haproxy_cfg as hcfg
+from drain import DrainLog
+from sampler import StatSampler, SamplerError
+from telemetry import TelemetryPusher
+
+try:  # zstd — опционально (pip install zstandard)
+    import zstandard
+except Exception:  # pragma: no cover
+    zstandard = None
 
 BASE = os.path.dirname(__file__)
 CFG_PATH_YAML = os.path.join(BASE, "config.yaml")
@@ -27,14 +40,68 @@ SYNC_CFG_RELOAD = bool(CONFIG.get("sync_cfg_reload", False))
 
 os.makedirs(BASE_DIR, exist_ok=True)
 
+# Быстрый drain (drain.* в config.yaml): через grace_sec после drain фиксируется,
+# сколько сессий осталось. `shutdown sessions server` рвёт ВСЕ сессии сервера, включая
+# активные запросы (HAProxy не умеет закрыть только простаивающие keep-alive), поэтому
+# он включается только явно: drain.hard_kill или hard_kill в запросе. Иначе — ждём scur=0
+# до таймаута
+DRAIN_CFG: Dict[str, Any] = CONFIG.get("drain") or {}
+DRAIN_GRACE: Optional[float] = float(DRAIN_CFG["grace_sec"]) if DRAIN_CFG.get("grace_sec") is not None else None
+DRAIN_HARD_KILL = bool(DRAIN_CFG.get("hard_kill", False))
+DRAIN_LOG = DrainLog(os.path.join(BASE_DIR, "drain_times.jsonl"), keep=int(DRAIN_CFG.get("keep", 50)))
+# (backend, server) -> время перевода в drain, от него считаются grace и замер
+_DRAIN_STARTED: Dict[tuple, float] = {}
+
+# Slow start при /enable (ramp.* в config.yaml): первая ступень веса ставится сразу,
+# дальше вес поднимает bin/weight_ramp.py по заявке в signals/weight_ramp.
+# Без живого weight_ramp (heartbeat старше heartbeat_max_age_sec) рампа не начинается —
+# сразу 100%; если заявку не забрали за pickup_sec — агент сам возвращает 100%,
+# чтобы нода не осталась навсегда на первой ступени
+RAMP_CFG: Dict[str, Any] = CONFIG.get("ramp") or {}
+RAMP_DIR = RAMP_CFG.get("dir") or os.path.join(BASE_DIR, "signals", "weight_ramp")
+RAMP_HEARTBEAT_MAX_AGE = float(RAMP_CFG.get("heartbeat_max_age_sec", 60))
+RAMP_PICKUP_SEC = float(RAMP_CFG.get("pickup_sec", 60))
+
 app = FastAPI(title="JBoss Controller Agent (35072)")
 
+# Локальный сэмплер show stat + push телеметрии мастеру (telemetry.* в config.yaml)
+TELEMETRY_CFG: Dict[str, Any] = CONFIG.get("telemetry") or {}
+SAMPLER = StatSampler(RUNTIME_SOCK, interval_sec=float(TELEMETRY_CFG.get("sample_interval_sec", 2)),
+                      fast_interval_sec=float(TELEMETRY_CFG.get("fast_interval_sec", 0.25)),
+                      probe_timeout_sec=float(TELEMETRY_CFG.get("probe_timeout_sec", 5)))
+PUSHER: Optional[TelemetryPusher] = None
+
+@app.on_event("startup")
+def _telemetry_start():
+    global PUSHER
+    SAMPLER.add_probe("jboss_health", jboss_health_ok)
+    SAMPLER.start()
+    push_url = TELEMETRY_CFG.get("push_url")
+    agent_url = TELEMETRY_CFG.get("agent_url")
+    if push_url and not agent_url:
+        # мастер сопоставляет телеметрию по agent_base_url из своего config.yaml —
+        # угаданный по hostname адрес с ним не совпадёт, и данные лягут мимо нод
+        print("[telemetry] push_url задан без agent_url (как agent_base_url в master/config.yaml) — push выключен")
+    elif push_url:
+        PUSHER = TelemetryPusher(
+            SAMPLER, push_url,
+            agent_url=agent_url,
+            token=lambda: INTER_TOKEN,
+            fields=TELEMETRY_CFG.get("fields"),
+            push_interval_sec=float(TELEMETRY_CFG.get("push_interval_sec", 2)),
+            full_every=int(TELEMETRY_CFG.get("full_every", 30)),
+            heartbeat_sec=float(TELEMETRY_CFG.get("heartbeat_sec", 10)),
+        )
+        PUSHER.start()
+
 def check_xauth(x_auth_token: str = Header(default="")):
     if INTER_TOKEN and x_auth_token != INTER_TOKEN:
         raise HTTPException(401, "Unauthorized")
 
 class WaitReq(BaseModel):
     timeout_sec: int = 300
+    grace_sec: Optional[float] = None   # только wait-empty: переопределяет drain.grace_sec
+    hard_kill: Optional[bool] = None    # только wait-empty: переопределяет drain.hard_kill
 
 class RestartReq(BaseModel):
     service: str
@@ -77,24 +144,126 @@ def jboss_health_ok() -> bool:
 @app.get("/health")
 def health():
     # health оставляем открытым
-    return {"status": "ok", "base_dir": BASE_DIR}
+    out: Dict[str, Any] = {"status": "ok", "base_dir": BASE_DIR,
+                           "sampler": {"seq": SAMPLER.seq, "ts": SAMPLER.ts, "error": SAMPLER.error}}
+    if PUSHER is not None:
+        out["telemetry"] = PUSHER.stats()
+    return out
+
+# Сжимать ответы /haproxy/stat крупнее этого размера, байт
+STAT_COMPRESS_MIN = int(CONFIG.get("stat_compress_min_bytes", 1024))
+# Готовые тела ответов: (seq, backend, server, fields) -> (etag, json-bytes)
+_STAT_CACHE: Dict[tuple, tuple] = {}
+# seq сэмплера начинается с 0 при каждом старте — без boot id мастер с закэшированным
+# If-None-Match получил бы 304 на другую таблицу
+BOOT_ID = os.urandom(4).hex()
+
+def _csv_set(v: Optional[str]) -> frozenset:
+    return frozenset(x.strip() for x in (v or "").split(",") if x.strip())
+
+def _pick_encoding(accept: str) -> str:
+    acc = {x.split(";")[0].strip().lower() for x in (accept or "").split(",")}
+    if "zstd" in acc and zstandard is not None:
+        return "zstd"
+    if "gzip" in acc:
+        return "gzip"
+    return ""
 
 @app.get("/haproxy/stat", dependencies=[Depends(check_xauth)])
-def haproxy_stat():
-    csv = hx.show_stat_csv(RUNTIME_SOCK)
-    table = hx.parse_stat(csv)  # dict[(backend,server)] = row
-    nested: Dict[str, Dict[str, Dict[str, str]]] = {}
-    for (bk, srv), row in table.items():
-        nested.setdefault(bk, {})[srv] = row
-    return {"data": nested}
+def haproxy_stat(request: Request, backend: Optional[str] = None, server: Optional[str] = None,
+                 fields: Optional[str] = None):
+    """
+    ?backend=a,b&server=x,y — фильтры, ?fields=status,scur,hrsp_5xx — проекция колонок.
+    Снапшот берётся у локального сэмплера; ETag = boot id + seq снапшота + параметры,
+    If-None-Match с тем же ETag → 304. Тело сжимается (zstd/gzip по Accept-Encoding).
+    Ошибка show stat или снапшот старше трёх интервалов → 503 (а не старая таблица с 200).
+    """
+    bks, srvs, flds = _csv_set(backend), _csv_set(server), _csv_set(fields)
+    seq, ts, table = SAMPLER.snapshot(max_age_sec=SAMPLER.interval * 2)
+    if SAMPLER.error or time.time() - ts > SAMPLER.interval * 3:
+        raise HTTPException(503, f"haproxy stat unavailable: {SAMPLER.error or 'snapshot too old'}")
+    key = (seq, bks, srvs, flds)
+    cached = _STAT_CACHE.get(key)
+    if cached is None:
+        nested: Dict[str, Dict[str, Dict[str, str]]] = {}
+        for (bk, srv), row in table.items():
+            if (bks and bk not in bks) or (srvs and srv not in srvs):
+                continue
+            nested.setdefault(bk, {})[srv] = {f: row.get(f, "") for f in flds} if flds else row
+        body = json.dumps({"data": nested, "seq": seq}, ensure_ascii=False, separators=(",", ":")).encode("utf-8")
+        tag = hashlib.sha1(repr(sorted(bks)).encode() + repr(sorted(srvs)).encode() + repr(sorted(flds)).encode()).hexdigest()[:12]
+        cached = (f'"{BOOT_ID}-{seq}-{tag}"', body)
+        for k in [k for k in list(_STAT_CACHE) if k[0] != seq]:
+            _STAT_CACHE.pop(k, None)
+        _STAT_CACHE[key] = cached
+    etag, body = cached
+
+    if etag in [x.strip() for x in (request.headers.get("if-none-match") or "").split(",")]:
+        return Response(status_code=304, headers={"ETag": etag})
+    headers = {"ETag": etag, "Vary": "Accept-Encoding"}
+    enc = _pick_encoding(request.headers.get("accept-encoding", "")) if len(body) >= STAT_COMPRESS_MIN else ""
+    if enc == "zstd":
+        body = zstandard.ZstdCompressor(level=3).compress(body)
+    elif enc == "gzip":
+        body = gzip.compress(body, compresslevel=5)
+    if enc:
+        headers["Content-Encoding"] = enc
+    return Response(content=body, media_type="application/json", headers=headers)
 
 @app.post("/node/{backend}/{server}/drain", dependencies=[Depends(check_xauth)])
 def node_drain(backend: str, server: str):
     out = hx.set_state(RUNTIME_SOCK, backend, server, "drain")
+    _DRAIN_STARTED[(backend, server)] = time.time()
     return {"ok": True, "out": out}
 
+def _ramp_worker_alive() -> bool:
+    try:
+        return time.time() - os.path.getmtime(os.path.join(RAMP_DIR, "heartbeat")) <= RAMP_HEARTBEAT_MAX_AGE
+    except OSError:
+        return False
+
+def _ramp_pickup_check(backend: str, server: str, path: str, ts: float) -> None:
+    # заявка всё ещё лежит — weight_ramp её не забрал: снять и вернуть полный вес
+    try:
+        with open(path, "r", encoding="utf-8") as f:
+            if json.load(f).get("ts") != ts:
+                return  # уже более новая заявка, у неё свой таймер
+        os.unlink(path)
+    except (OSError, ValueError):
+        return
+    try:
+        hx.set_weight_pct(RUNTIME_SOCK, backend, server, 100)
+    except Exception as e:
+        print(f"[ramp] {backend}/{server}: restore 100% failed: {e}")
+
+def _request_ramp(backend: str, server: str) -> str:
+    steps = [int(x) for x in RAMP_CFG.get("steps") or [5, 10, 25, 50, 75, 100]]
+    hx.set_weight_pct(RUNTIME_SOCK, backend, server, steps[0])
+    os.makedirs(RAMP_DIR, exist_ok=True)
+    path = os.path.join(RAMP_DIR, f"ramp_{backend}_{server}.json")
+    ts = time.time()
+    rq: Dict[str, Any] = {"backend": backend, "server": server, "source": "agent", "ts": ts, "steps": steps}
+    if RAMP_CFG.get("duration_sec"):
+        rq["duration_sec"] = int(RAMP_CFG["duration_sec"])
+    with open(path + ".tmp", "w", encoding="utf-8") as f:
+        json.dump(rq, f)
+    os.replace(path + ".tmp", path)
+    t = threading.Timer(RAMP_PICKUP_SEC, _ramp_pickup_check, (backend, server, path, ts))
+    t.daemon = True
+    t.start()
+    return path
+
 @app.post("/node/{backend}/{server}/enable", dependencies=[Depends(check_xauth)])
-def node_enable(backend: str, server: str):
+def node_enable(backend: str, server: str, ramp: Optional[bool] = None):
+    # ramp=1 (или ramp.enabled в конфиге) — вернуть в ротацию с малым весом и поднимать ступенями
+    use_ramp = bool(RAMP_CFG.get("enabled", False)) if ramp is None else ramp
+    ramp_req, ramp_skipped = None, None
+    if use_ramp and not _ramp_worker_alive():
+        # некому поднимать вес — без рампы, и снять ступень от прошлой несостоявшейся
+        ramp_skipped = "weight_ramp heartbeat is stale"
+        hx.set_weight_pct(RUNTIME_SOCK, backend, server, 100)
+    elif use_ramp:
+        ramp_req = _request_ramp(backend, server)
     out = hx.set_state(RUNTIME_SOCK, backend, server, "ready")
     if SYNC_CFG_RELOAD:
         text = hcfg.read_file(HAPROXY_CFG)
@@ -102,22 +271,59 @@ def node_enable(backend: str, server: str):
         if text2 != text:
             hcfg.write_atomic(HAPROXY_CFG, text2)
             hcfg.validate_and_reload(HAPROXY_CFG)
-    return {"ok": True, "out": out}
+    res: Dict[str, Any] = {"ok": True, "out": out, "ramp": ramp_req}
+    if ramp_skipped:
+        res["ramp_skipped"] = ramp_skipped
+    return res
 
 @app.post("/node/{backend}/{server}/wait-empty", dependencies=[Depends(check_xauth)])
-def wait_empty(backend: str, server: str, req: WaitReq):
-    deadline = time.time() + req.timeout_sec
-    last = -1
-    while time.time() < deadline:
-        csv = hx.show_stat_csv(RUNTIME_SOCK)
-        table = hx.parse_stat(csv)
-        row = table.get((backend, server)) or {}
+async def wait_empty(backend: str, server: str, req: WaitReq):
+    """
+    Ждать, пока на сервере не останется сессий и очереди (scur=0, qcur=0).
+    async-ожидание на общем сэмплере: пока есть ожидающие, он опрашивает
+    HAProxy с коротким периодом, ответ — на первом пустом сэмпле.
+    С grace_sec: если через grace_sec после drain сервер не опустел — число оставшихся
+    сессий попадает в DrainLog (scur_at_grace), а при hard_kill выполняется
+    `shutdown sessions server` (обрывает и активные запросы) и дожидаемся нуля.
+    Время drain пишется в DrainLog.
+    """
+    def empty(s: StatSampler):
+        row = s.table.get((backend, server)) or {}
         scur = int((row.get("scur") or "0") or "0")
-        last = scur
-        if scur == 0:
-            return {"ok": True, "last_scur": last}
-        time.sleep(2)
-    raise HTTPException(408, f"Timeout waiting empty. last_scur={last}")
+        qcur = int((row.get("qcur") or "0") or "0")
+        return scur == 0 and qcur == 0, scur
+    now = time.time()
+    t0 = _DRAIN_STARTED.pop((backend, server), now)
+    deadline = now + req.timeout_sec
+    grace = req.grace_sec if req.grace_sec is not None else DRAIN_GRACE
+    hard_kill = req.hard_kill if req.hard_kill is not None else DRAIN_HARD_KILL
+    mode, at_grace = "natural", None
+
+    try:
+        if grace is not None:
+            # хотя бы пара сэмплов до shutdown, даже если grace уже истёк
+            left = max(SAMPLER.fast_interval * 2, min(t0 + grace, deadline) - time.time())
+            ok, last = await SAMPLER.wait_for(empty, left)
+            if not ok and time.time() < deadline:
+                at_grace = last
+                if hard_kill:
+                    mode = "shutdown"
+                    await asyncio.to_thread(hx.shutdown_sessions, RUNTIME_SOCK, backend, server)
+                ok, last = await SAMPLER.wait_for(empty, max(0.0, deadline - time.time()))
+        else:
+            ok, last = await SAMPLER.wait_for(empty, req.timeout_sec)
+    except SamplerError as e:
+        raise HTTPException(503, f"haproxy stat unavailable: {e}")
+
+    rec = DRAIN_LOG.record(backend, server, time.time() - t0, mode if ok else "timeout", at_grace, grace)
+    if ok:
+        return {"ok": True, "last_scur": last, "drain_sec": rec["drain_sec"], "mode": mode}
+    raise HTTPException(408, f"Timeout waiting empty. last_scur={-1 if last is None else last}")
+
+@app.get("/drain/stats", dependencies=[Depends(check_xauth)])
+def drain_stats():
+    # замеры drain по серверам: p50/p95/max — для подбора drain.grace_sec
+    return {"grace_sec": DRAIN_GRACE, "hard_kill": DRAIN_HARD_KILL, "servers": DRAIN_LOG.stats()}
 
 @app.post("/haproxy/reload", dependencies=[Depends(check_xauth)])
 def haproxy_reload():
@@ -139,12 +345,13 @@ def do_jboss_restart(req: RestartReq):
     return {"ok": True, "out": out}
 
 @app.post("/jboss/wait-health", dependencies=[Depends(check_xauth)])
-def wait_health(req: WaitReq):
-    deadline = time.time() + req.timeout_sec
-    while time.time() < deadline:
-        if jboss_health_ok():
-            return {"ok": True}
-        time.sleep(2)
+async def wait_health(req: WaitReq):
+    # проба jboss_health выполняется сэмплером один раз на тик для всех ожидающих
+    ok, _ = await SAMPLER.wait_for(
+        lambda s: (bool(s.probe_results.get("jboss_health", (0, False))[1]), None),
+        req.timeout_sec, probes=("jboss_health",), need_stat=False)
+    if ok:
+        return {"ok": True}
     raise HTTPException(408, "Timeout waiting JBoss health")
 
 # Приём нового межсервисного токена (мастер шлёт по "старому" X-Auth-Token)
@@ -0,0 +1,54 @@
+import json
+import os
+import threading
+import time
+from collections import deque
+from typing import Dict, Any, Deque, Optional
+
+class DrainLog:
+    """
+    Замеры времени вывода сервера из нагрузки (wait-empty).
+
+    Каждая запись дописывается в JSONL (base_dir/drain_times.jsonl) и держится
+    в памяти (последние keep на сервер) — по p50/p95 подбирают drain.grace_sec.
+    mode: natural — опустел сам (scur_at_grace — сколько сессий оставалось к grace);
+    shutdown — после grace добили `shutdown sessions` (drain.hard_kill);
+    timeout — не опустел за timeout_sec.
+    """
+    def __init__(self, path: str, keep: int = 50):
+        self.path = path
+        self.keep = max(1, int(keep))
+        self.by_server: Dict[str, Deque[Dict[str, Any]]] = {}
+        self._lock = threading.Lock()
+
+    def record(self, backend: str, server: str, drain_sec: float, mode: str,
+               scur_at_grace: Optional[int] = None, grace_sec: Optional[float] = None) -> Dict[str, Any]:
+        rec = {"ts": round(time.time(), 3), "backend": backend, "server": server,
+               "drain_sec": round(drain_sec, 3), "mode": mode,
+               "grace_sec": grace_sec, "scur_at_grace": scur_at_grace}
+        with self._lock:
+            self.by_server.setdefault(f"{backend}/{server}", deque(maxlen=self.keep)).append(rec)
+            try:
+                os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+                with open(self.path, "a", encoding="utf-8") as f:
+                    f.write(json.dumps(rec, ensure_ascii=False) + "\n")
+            except Exception:
+                pass  # замер — не повод ронять drain
+        return rec
+
+    @staticmethod
+    def _pct(vals, q: float) -> float:
+        s = sorted(vals)
+        return s[min(len(s) - 1, int(q * len(s)))] if s else 0.0
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            out = {}
+            for key, recs in self.by_server.items():
+                vals = [r["drain_sec"] for r in recs]
+                modes: Dict[str, int] = {}
+                for r in recs:
+                    modes[r["mode"]] = modes.get(r["mode"], 0) + 1
+                out[key] = {"count": len(vals), "p50": self._pct(vals, 0.5), "p95": self._pct(vals, 0.95),
+                            "max": max(vals), "last": recs[-1], "modes": modes}
+            return out
@@ -50,3 +50,12 @@ def parse_stat(csv_text: str):
 def set_state(path: str, backend: str, server: str, state: str) -> str:
     # state: ready | drain | maint
     return cmd(path, f"set server {backend}/{server} state {state}")
+
+def set_weight_pct(path: str, backend: str, server: str, pct: int) -> str:
+    # процент от исходного веса из конфига (slow start)
+    return cmd(path, f"set weight {backend}/{server} {max(0, min(100, int(pct)))}%")
+
+def shutdown_sessions(path: str, backend: str, server: str) -> str:
+    # закрыть ВСЕ текущие сессии сервера — и простаивающие keep-alive/WebSocket, и активные
+    # запросы (клиент получит обрыв); только по явному drain.hard_kill
+    return cmd(path, f"shutdown sessions server {backend}/{server}")
@@ -0,0 +1,182 @@
+import asyncio
+import threading
+import time
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import Dict, Any, Callable, Iterable, Optional, Tuple
+
+import haproxy as hx
+
+class SamplerError(RuntimeError):
+    """show stat упал после начала ожидания — wait_for завершается сразу, а не по таймауту."""
+
+class StatSampler:
+    """
+    Локальный сэмплер HAProxy `show stat` для агента.
+
+    Один фоновый поток раз в interval_sec снимает таблицу и хранит последний
+    снапшот. seq растёт только когда таблица реально изменилась — по нему
+    потребители (push телеметрии, ETag, ожидания) понимают, что есть новое.
+
+    Async-ожидания (wait_for) подписываются на каждый сэмпл; пока есть хоть
+    один ожидающий, сэмплер работает с коротким периодом fast_interval_sec.
+    Дополнительные пробы (например, health JBoss) регистрируются через
+    add_probe и запускаются на тике только пока их кто-то ждёт — в отдельном
+    пуле, чтобы медленная проба не задерживала show stat. Проба дольше
+    probe_timeout_sec считается неуспешной; пока она не вернулась, новая
+    не запускается.
+    """
+    def __init__(self, sock_path: str, interval_sec: float = 2.0, fast_interval_sec: float = 0.25,
+                 probe_timeout_sec: float = 5.0):
+        self.sock_path = sock_path
+        self.interval = max(0.1, float(interval_sec))
+        self.fast_interval = max(0.05, min(self.interval, float(fast_interval_sec)))
+        self.table: Dict[Tuple[str, str], Dict[str, str]] = {}
+        self.seq = 0
+        self.ts = 0.0
+        self.error = ""
+        self.error_ts = 0.0
+        self.probe_timeout = max(0.1, float(probe_timeout_sec))
+        self.probes: Dict[str, Callable[[], Any]] = {}
+        self.probe_results: Dict[str, Tuple[float, Any]] = {}
+        self._probe_demand: Dict[str, int] = {}
+        self._probe_running: Dict[str, Tuple[float, Future]] = {}
+        self._probe_pool = ThreadPoolExecutor(max_workers=4, thread_name_prefix="sampler-probe")
+        self._subs: set = set()
+        self._cond = threading.Condition()
+        self._wake = threading.Event()
+        self._stop = threading.Event()
+        self._thr: Optional[threading.Thread] = None
+
+    def start(self):
+        if self._thr:
+            return
+        self._thr = threading.Thread(target=self._loop, name="stat-sampler", daemon=True)
+        self._thr.start()
+
+    def stop(self):
+        self._stop.set()
+        self._wake.set()
+        self._probe_pool.shutdown(wait=False)
+
+    def add_probe(self, name: str, fn: Callable[[], Any]):
+        self.probes[name] = fn
+
+    def _loop(self):
+        while not self._stop.is_set():
+            self.sample_once()
+            self._wake.wait(self.fast_interval if self._subs else self.interval)
+            self._wake.clear()
+
+    def sample_once(self) -> int:
+        t_read = time.time()  # время снапшота = момент чтения, а не окончания
+        try:
+            table = hx.parse_stat(hx.show_stat_csv(self.sock_path))
+            err = ""
+        except Exception as e:
+            table, err = None, f"{type(e).__name__}: {e}"
+        self._run_probes(t_read)
+        with self._cond:
+            self.error = err
+            if err:
+                self.error_ts = t_read
+            if table is not None:
+                if table != self.table:
+                    self.table = table
+                    self.seq += 1
+                self.ts = t_read
+            self._cond.notify_all()
+        self._notify()
+        return self.seq
+
+    def _notify(self):
+        with self._cond:
+            subs = list(self._subs)
+        for loop, ev in subs:
+            try:
+                loop.call_soon_threadsafe(ev.set)
+            except RuntimeError:
+                pass  # цикл ожидающего уже закрыт
+
+    def _run_probes(self, now: float):
+        for name in [n for n, c in list(self._probe_demand.items()) if c > 0]:
+            running = self._probe_running.get(name)
+            if running is not None:
+                started, fut = running
+                if not fut.done():
+                    if now - started > self.probe_timeout and self.probe_results.get(name, (0.0,))[0] < started:
+                        self.probe_results[name] = (started, None)  # зависла — неуспех, ждущие не висят
+                        self._notify()
+                    continue
+            fut = self._probe_pool.submit(self.probes[name])
+            self._probe_running[name] = (now, fut)
+            fut.add_done_callback(lambda f, n=name, t=now: self._probe_done(n, t, f))
+
+    def _probe_done(self, name: str, started: float, fut: Future):
+        try:
+            res = fut.result()
+        except Exception:
+            res = None
+        if time.time() - started <= self.probe_timeout:
+            self.probe_results[name] = (started, res)
+            self._notify()
+
+    def snapshot(self, max_age_sec: float = 0) -> Tuple[int, float, Dict[Tuple[str, str], Dict[str, str]]]:
+        """(seq, ts, table). Если снапшот старше max_age_sec (или его нет) — снять синхронно."""
+        if not self.ts or (max_age_sec and time.time() - self.ts > max_age_sec):
+            self.sample_once()
+        with self._cond:
+            return self.seq, self.ts, self.table
+
+    def wait_newer(self, seq: int, timeout: float) -> int:
+        """Ждать seq > заданного не дольше timeout; вернуть текущий seq."""
+        deadline = time.time() + timeout
+        with self._cond:
+            while self.seq <= seq and not self._stop.is_set():
+                left = deadline - time.time()
+                if left <= 0:
+                    break
+                self._cond.wait(left)
+            return self.seq
+
+    async def wait_for(self, pred: Callable[["StatSampler"], Tuple[bool, Any]], timeout: float,
+                       probes: Iterable[str] = (), need_stat: bool = True) -> Tuple[bool, Any]:
+        """
+        Ждать, пока pred(self) вернёт (True, value), не дольше timeout секунд.
+        Проверяются только сэмплы, снятые после начала ожидания. Не занимает
+        потоков: сэмплер будит ожидающего через его event loop.
+        need_stat=False — ждём только пробы, show stat не нужен. Иначе ошибка
+        show stat после начала ожидания → SamplerError сразу.
+        """
+        loop = asyncio.get_running_loop()
+        ev = asyncio.Event()
+        sub = (loop, ev)
+        probes = list(probes)
+        started = time.time()
+        with self._cond:
+            self._subs.add(sub)
+            for p in probes:
+                self._probe_demand[p] = self._probe_demand.get(p, 0) + 1
+        self._wake.set()  # сразу свежий сэмпл и короткий период
+        deadline = loop.time() + max(0.0, float(timeout))
+        last: Any = None
+        try:
+            while True:
+                if need_stat and self.error and self.error_ts >= started:
+                    raise SamplerError(self.error)
+                if (not need_stat or self.ts >= started) and all(self.probe_results.get(p, (0.0, None))[0] >= started for p in probes):
+                    ok, last = pred(self)
+                    if ok:
+                        return True, last
+                left = deadline - loop.time()
+                if left <= 0:
+                    return False, last
+                ev.clear()
+                try:
+                    await asyncio.wait_for(ev.wait(), left)
+                except asyncio.TimeoutError:
+                    pass
+        finally:
+            with self._cond:
+                self._subs.discard(sub)
+                for p in probes:
+                    self._probe_demand[p] = max(0, self._probe_demand.get(p, 1) - 1)
@@ -0,0 +1,115 @@
+import threading
+import time
+from typing import Dict, Any, Callable, List, Optional
+
+import httpx
+
+from sampler import StatSampler
+
+# Компактный набор колонок show stat, который нужен мастеру (RuleEngine и UI)
+DEFAULT_FIELDS = [
+    "status", "weight", "scur", "qcur", "smax", "rate",
+    "hrsp_2xx", "hrsp_4xx", "hrsp_5xx", "eresp", "econ",
+    "chkfail", "qtime", "ctime", "rtime", "ttime",
+]
+
+class TelemetryPusher:
+    """
+    Push телеметрии агент → мастер батчами POST /telemetry/push.
+
+    Сообщение: {"agent", "seq", "full", "ts", "sample_ts", "error",
+                "rows": {"backend/server": {поле: значение}}, "removed": [...]}
+    - sample_ts — когда снята таблица, error — ошибка последнего show stat: мастер по ним
+      (а не по времени приёма) понимает, что таблица устарела, хотя heartbeat идёт
+    - в дельте только изменившиеся поля изменившихся серверов
+    - каждое full_every-е сообщение, первое после старта и после любой ошибки
+      или ответа {"resync": true} — полный снапшот
+    - без изменений раз в heartbeat_sec уходит пустая дельта (мастер видит, что агент жив);
+      смена error уходит сразу
+    """
+    def __init__(self, sampler: StatSampler, push_url: str, agent_url: str,
+                 token: Callable[[], str], fields: Optional[List[str]] = None,
+                 push_interval_sec: float = 2.0, full_every: int = 30, heartbeat_sec: float = 10.0):
+        self.sampler = sampler
+        self.push_url = push_url
+        self.agent_url = agent_url
+        self.token = token
+        self.fields = list(fields or DEFAULT_FIELDS)
+        self.push_interval = max(0.2, float(push_interval_sec))
+        self.full_every = max(1, int(full_every))
+        self.heartbeat = max(self.push_interval, float(heartbeat_sec))
+        self.seq = 0
+        self.sent = 0
+        self.errors = 0
+        self.last_error = ""
+        self._last_rows: Dict[str, Dict[str, str]] = {}
+        self._last_sent_error = ""
+        self._need_full = True
+        self._last_push = 0.0
+        self._stop = threading.Event()
+        self._thr: Optional[threading.Thread] = None
+
+    def start(self):
+        if self._thr:
+            return
+        self._thr = threading.Thread(target=self._loop, name="telemetry-push", daemon=True)
+        self._thr.start()
+
+    def stop(self):
+        self._stop.set()
+
+    def _compact(self, table) -> Dict[str, Dict[str, str]]:
+        return {f"{bk}/{srv}": {f: row.get(f, "") for f in self.fields} for (bk, srv), row in table.items()}
+
+    def build_message(self, rows: Dict[str, Dict[str, str]], full: bool,
+                      sample_ts: float = 0.0, error: str = "") -> Optional[Dict[str, Any]]:
+        if full:
+            delta, removed = rows, []
+        else:
+            delta = {}
+            for key, cur in rows.items():
+                prev = self._last_rows.get(key) or {}
+                ch = {f: v for f, v in cur.items() if prev.get(f) != v}
+                if ch:
+                    delta[key] = ch
+            removed = [k for k in self._last_rows if k not in rows]
+            if (not delta and not removed and error == self._last_sent_error
+                    and time.time() - self._last_push < self.heartbeat):
+                return None
+        return {"agent": self.agent_url, "seq": self.seq + 1, "full": full, "ts": time.time(),
+                "sample_ts": sample_ts, "error": error, "rows": delta, "removed": removed}
+
+    def _loop(self):
+        seen = -1
+        with httpx.Client(timeout=5, verify=False) as client:
+            while not self._stop.is_set():
+                seen = self.sampler.wait_newer(seen, self.heartbeat)
+                # батч: не чаще push_interval, изменения за паузу уйдут одной дельтой
+                gap = self._last_push + self.push_interval - time.time()
+                if gap > 0 and self._stop.wait(gap):
+                    break
+                _seq, sample_ts, table = self.sampler.snapshot()
+                rows = self._compact(table)
+                full = self._need_full or (self.seq + 1) % self.full_every == 0
+                msg = self.build_message(rows, full, sample_ts, self.sampler.error)
+                if msg is not None:
+                    try:
+                        tok = self.token()
+                        r = client.post(self.push_url, json=msg, headers={"X-Auth-Token": tok} if tok else {})
+                        r.raise_for_status()
+                        self.seq = msg["seq"]
+                        self._last_rows = rows
+                        self._last_sent_error = msg["error"]
+                        self._last_push = time.time()
+                        self._need_full = bool((r.json() or {}).get("resync"))
+                        self.sent += 1
+                    except Exception as e:
+                        # мастер мог пропустить дельту — следующим шлём полный снапшот
+                        self.errors += 1
+                        self.last_error = f"{type(e).__name__}: {e}"[:200]
+                        self._need_full = True
+                        self._stop.wait(self.push_interval)
+
+    def stats(self) -> Dict[str, Any]:
+        return {"push_url": self.push_url, "seq": self.seq, "sent": self.sent,
+                "errors": self.errors, "last_error": self.last_error}
@@ -0,0 +1,320 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+anomaly_detector.py — потоковое обнаружение аномалий по серверам бэкенда (Py3.11).
+
+Фиксированные пороги (policy_auto_drain --thr-5xx, rules.hrsp_5xx_threshold)
+по сырым счётчикам срабатывают поздно на нагруженных серверах и рано на
+малонагруженных. Детектор на каждом новом сэмпле коллектора (metrics/last.json):
+  1) из кумулятивных счётчиков считает за интервал долю 5xx (err) и берёт rtime;
+  2) сравнивает сервер с собственной базой — EWMA среднего/дисперсии и
+     потоковый p95 (P²) — и с соседями по бэкенду: для err — биномиальный
+     z-score против общей доли ошибок соседей (учитывает объём трафика),
+     для rtime — отклонение от медианы соседей в MAD; собственная аномалия
+     rtime засчитывается, только если rtime выше своего p95 (хвост латентности
+     тяжёлый — выброс над средним ещё не деградация);
+  3) confidence = сигмоида от min(z_self, z_peer) − --z-thr, растёт с числом
+     подряд аномальных сэмплов; аномальные точки в базу не попадают;
+  4) пишет сигналы signals/anomaly/<backend>_<server>.json
+     (action=drain при confidence >= --drain-conf по err, иначе notify)
+     и события в signals/events; с --act кладёт drain в haproxy_ops
+     (не больше --max-drained серверов бэкенда одновременно);
+  5) выведенный сервер через --drained-ttl-sec возвращается на проверку: enable
+     (с --ramp — через weight_ramp) и наблюдение ещё --drained-ttl-sec; снова
+     drain-сигнал — повторный drain с удлинённой паузой (× число попыток),
+     тишина — сервер считается восстановившимся.
+Состояние — report/<HOST>/anomaly_state.json.
+"""
+from __future__ import annotations
+
+import argparse
+import json
+import math
+import statistics
+import time
+from pathlib import Path
+from typing import Any, Dict, List, Optional
+
+from lock_utils import with_flock
+from path_utils import REPORT_DIR, SIGNALS_DIR, LOGS_DIR, metrics_root, haproxy_ops_dirs
+from weight_ramp import emit_event, enqueue_op, request_ramp, to_int
+
+STATE_FILE  = REPORT_DIR / "anomaly_state.json"
+SIGNAL_DIR  = SIGNALS_DIR / "anomaly"
+HRSP = ("hrsp_1xx", "hrsp_2xx", "hrsp_3xx", "hrsp_4xx", "hrsp_5xx", "hrsp_other")
+
+def sigmoid(x: float) -> float:
+    return 1.0 / (1.0 + math.exp(-x))
+
+# ---------- потоковые статистики ----------
+class Ewma:
+    """EWMA среднего и дисперсии (West/Finch); состояние — dict для JSON."""
+    @staticmethod
+    def update(st: Dict[str, float], x: float, alpha: float) -> None:
+        if "n" not in st:
+            st.update(n=1, mean=x, var=0.0)
+            return
+        d = x - st["mean"]
+        st["mean"] += alpha * d
+        st["var"] = (1 - alpha) * (st["var"] + alpha * d * d)
+        st["n"] += 1
+
+    @staticmethod
+    def z(st: Dict[str, float], x: float, floor: float) -> float:
+        if st.get("n", 0) < 2:
+            return 0.0
+        return (x - st["mean"]) / max(math.sqrt(st["var"]), floor)
+
+class P2Quantile:
+    """Потоковый квантиль P² (Jain & Chlamtac): 5 маркеров, O(1) память."""
+    @staticmethod
+    def update(st: Dict[str, Any], x: float, p: float) -> None:
+        q: List[float] = st.setdefault("q", [])
+        if len(q) < 5:
+            q.append(x); q.sort()
+            if len(q) == 5:
+                st["n"] = [0, 1, 2, 3, 4]
+                st["np"] = [0, 2 * p, 4 * p, 2 + 2 * p, 4]
+            return
+        n, np_ = st["n"], st["np"]
+        if x < q[0]:
+            q[0] = x; k = 0
+        elif x >= q[4]:
+            q[4] = x; k = 3
+        else:
+            k = next(i for i in range(4) if q[i] <= x < q[i + 1])
+        for i in range(k + 1, 5):
+            n[i] += 1
+        for i, dn in enumerate((0, p / 2, p, (1 + p) / 2, 1)):
+            np_[i] += dn
+        for i in (1, 2, 3):
+            d = np_[i] - n[i]
+            if (d >= 1 and n[i + 1] - n[i] > 1) or (d <= -1 and n[i - 1] - n[i] < -1):
+                s = 1 if d > 0 else -1
+                qp = q[i] + s / (n[i + 1] - n[i - 1]) * (
+                    (n[i] - n[i - 1] + s) * (q[i + 1] - q[i]) / (n[i + 1] - n[i]) +
+                    (n[i + 1] - n[i] - s) * (q[i] - q[i - 1]) / (n[i] - n[i - 1]))
+                if not q[i - 1] < qp < q[i + 1]:
+                    qp = q[i] + s * (q[i + s] - q[i]) / (n[i + s] - n[i])
+                q[i] = qp
+                n[i] += s
+
+    @staticmethod
+    def value(st: Dict[str, Any]) -> Optional[float]:
+        q = st.get("q") or []
+        if not q:
+            return None
+        return q[2] if len(q) == 5 else q[len(q) // 2]
+
+# ---------- детектор ----------
+class Detector:
+    def __init__(self, args: argparse.Namespace):
+        self.args = args
+        self.state_path = Path(args.state)
+        self.signal_dir = Path(args.signal_dir)
+        self.qdir = Path(args.ops_queue)
+        self.log_path = Path(args.log_dir) / "anomaly_detector.log"
+        try:
+            self.state: Dict[str, Any] = json.loads(self.state_path.read_text(encoding="utf-8"))
+        except Exception:
+            self.state = {}
+        self.state.setdefault("series", {})
+        drained = self.state.setdefault("drained", {})
+        for k, v in list(drained.items()):
+            if not isinstance(v, dict):  # старый формат: key -> ts
+                drained[k] = {"phase": "drained", "ts": v, "attempts": 1}
+
+    def log(self, line: str) -> None:
+        self.log_path.parent.mkdir(parents=True, exist_ok=True)
+        with self.log_path.open("a", encoding="utf-8") as f:
+            f.write(time.strftime("[%Y-%m-%d %H:%M:%S] ") + line + "\n")
+
+    def save(self) -> None:
+        self.state_path.parent.mkdir(parents=True, exist_ok=True)
+        tmp = self.state_path.with_suffix(".tmp")
+        tmp.write_text(json.dumps(self.state, ensure_ascii=False), encoding="utf-8")
+        tmp.replace(self.state_path)
+
+    def _sample(self) -> Optional[Dict[str, Dict[str, str]]]:
+        last = metrics_root() / "last.json"
+        try:
+            mtime = last.stat().st_mtime
+            if mtime == self.state.get("last_mtime"):
+                return None  # этот сэмпл уже обработан
+            rows = json.loads(last.read_text(encoding="utf-8")).get("rows") or []
+        except Exception:
+            return None
+        self.state["last_mtime"] = mtime
+        return {f'{r.get("pxname","")}/{r.get("svname","")}': r for r in rows}
+
+    def tick(self) -> List[Dict[str, Any]]:
+        a = self.args
+        rows = self._sample()
+        if rows is None:
+            return []
+        series = self.state["series"]
+        # 1) значения за интервал
+        obs: Dict[str, Dict[str, float]] = {}
+        for key, row in rows.items():
+            if (row.get("status") or "").upper() != "UP":
+                continue
+            s = series.setdefault(key, {"err": {}, "rtime": {}, "p95": {}, "streak": 0})
+            tot, e5 = sum(to_int(row.get(h)) for h in HRSP), to_int(row.get("hrsp_5xx"))
+            prev = s.get("cnt")
+            s["cnt"] = [tot, e5]
+            if prev is None or tot < prev[0] or e5 < prev[1]:
+                continue  # первый сэмпл или сброс счётчиков (reload)
+            n, e = tot - prev[0], e5 - prev[1]
+            obs[key] = {"n": n, "e": e, "err": e / n if n else 0.0, "rtime": float(to_int(row.get("rtime")))}
+
+        # 2) сравнение с базой и соседями
+        out: List[Dict[str, Any]] = []
+        by_be: Dict[str, List[str]] = {}
+        for key in obs:
+            by_be.setdefault(key.split("/", 1)[0], []).append(key)
+        for be, keys in by_be.items():
+            for key in keys:
+                o, s = obs[key], series[key]
+                peers = [obs[k] for k in keys if k != key]
+                # err против соседей: биномиальный z по объединённой доле ошибок
+                zp_err = 0.0
+                pn = sum(p["n"] for p in peers)
+                if pn and o["n"] >= a.min_requests:
+                    # у соседей 0% или 100% ошибок — дисперсия не должна обнулиться
+                    pr = min(max(sum(p["e"] for p in peers) / pn, 1e-4), 1 - 1e-4)
+                    zp_err = (o["e"] - o["n"] * pr) / math.sqrt(o["n"] * pr * (1 - pr))
+                # rtime против соседей: отклонение от медианы в MAD
+                zp_rt = 0.0
+                prt = [p["rtime"] for p in peers if p["rtime"] > 0]
+                if len(prt) >= 2 and o["rtime"] > 0:
+                    med = statistics.median(prt)
+                    mad = statistics.median(abs(x - med) for x in prt) * 1.4826
+                    zp_rt = (o["rtime"] - med) / max(mad, a.rtime_floor_ms)
+                zs_err = Ewma.z(s["err"], o["err"], a.err_floor) if o["n"] >= a.min_requests else 0.0
+                zs_rt = Ewma.z(s["rtime"], o["rtime"], a.rtime_floor_ms)
+                p95 = P2Quantile.value(s["p95"]) if len(s["p95"].get("q") or []) == 5 else None
+                if p95 is not None and o["rtime"] <= p95:
+                    zs_rt = 0.0  # в пределах своего p95 — не аномалия
+
+                found = []
+                for metric, zs, zp in (("err", zs_err, zp_err), ("rtime", zs_rt, zp_rt)):
+                    z = min(zs, zp) if peers else zs * 0.7  # без соседей — меньше доверия
+                    if z > a.z_thr:
+                        found.append((metric, z, zs, zp))
+                if found:
+                    s["streak"] += 1
+                    metric, z, zs, zp = max(found, key=lambda f: f[1])
+                    conf = 1 - (1 - sigmoid(z - a.z_thr)) ** s["streak"]
+                    action = "drain" if metric == "err" and conf >= a.drain_conf else "notify"
+                    sig = {"ts": time.time(), "backend": be, "server": key.split("/", 1)[1], "action": action,
+                           "metric": metric, "confidence": round(conf, 3), "z_self": round(zs, 2),
+                           "z_peer": round(zp, 2), "streak": s["streak"], "value": round(o[metric], 4),
+                           "baseline": round(s[metric].get("mean", 0.0), 4), "p95": P2Quantile.value(s["p95"]),
+                           "requests": o["n"]}
+                    out.append(sig)
+                    self._signal(sig)
+                else:
+                    s["streak"] = 0
+                    # база учится только на нормальных точках
+                    if o["n"] >= a.min_requests:
+                        Ewma.update(s["err"], o["err"], a.alpha)
+                    Ewma.update(s["rtime"], o["rtime"], a.alpha)
+                    P2Quantile.update(s["p95"], o["rtime"], 0.95)
+        self.save()
+        return out
+
+    def _signal(self, sig: Dict[str, Any]) -> None:
+        key = f'{sig["backend"]}/{sig["server"]}'
+        self.signal_dir.mkdir(parents=True, exist_ok=True)
+        p = self.signal_dir / f'{sig["backend"]}_{sig["server"]}.json'
+        tmp = p.with_suffix(".tmp")
+        tmp.write_text(json.dumps(sig, ensure_ascii=False), encoding="utf-8")
+        tmp.replace(p)
+        self.log(f'{key}: {sig["action"]} {sig["metric"]}={sig["value"]} conf={sig["confidence"]} '
+                 f'z_self={sig["z_self"]} z_peer={sig["z_peer"]} streak={sig["streak"]}')
+        emit_event(f'anomaly: {sig["action"]} {key} {sig["metric"]} conf={sig["confidence"]}',
+                   severity="warn" if sig["action"] == "drain" else "info", node=sig["server"], source="anomaly")
+        if sig["action"] == "drain" and self.args.act:
+            drained = self.state["drained"]
+            ent = drained.get(key)
+            if ent is not None and ent["phase"] == "drained":
+                return
+            if ent is None:
+                on_be = [k for k, e in drained.items() if k.startswith(sig["backend"] + "/") and e["phase"] == "drained"]
+                if len(on_be) >= self.args.max_drained:
+                    return
+            # новый drain или повторный после проверки (probing) — пауза растёт с попытками
+            attempts = ent["attempts"] + 1 if ent else 1
+            drained[key] = {"phase": "drained", "ts": sig["ts"], "attempts": attempts}
+            enqueue_op(self.qdir, "drain", sig["backend"], sig["server"],
+                       f'anomaly {sig["metric"]} conf={sig["confidence"]} attempt={attempts}')
+
+    def recover(self) -> None:
+        """Выведенные серверы: по истечении паузы — enable на проверку, после тихой проверки — забыть."""
+        a, now, changed = self.args, time.time(), False
+        drained = self.state["drained"]
+        for key, ent in list(drained.items()):
+            be, srv = key.split("/", 1)
+            if ent["phase"] == "drained" and now - ent["ts"] >= a.drained_ttl_sec * ent["attempts"]:
+                if a.ramp:
+                    request_ramp(be, srv, "anomaly")
+                enqueue_op(self.qdir, "enable", be, srv, f'anomaly: recheck attempt={ent["attempts"]}')
+                ent.update(phase="probing", ts=now)
+                s = self.state["series"].get(key)
+                if s is not None:
+                    # серия аномалий до drain и счётчики за время простоя к проверке не относятся
+                    s["streak"] = 0
+                    s.pop("cnt", None)
+                self.log(f"{key}: enable for recheck{' (ramp)' if a.ramp else ''} attempt={ent['attempts']}")
+                emit_event(f"anomaly: recheck {key}", node=srv, source="anomaly")
+                changed = True
+            elif ent["phase"] == "probing" and now - ent["ts"] >= a.drained_ttl_sec:
+                del drained[key]
+                self.log(f"{key}: recovered")
+                emit_event(f"anomaly: recovered {key}", node=srv, source="anomaly")
+                changed = True
+        if changed:
+            self.save()
+
+def main(argv=None) -> int:
+    q, _, _, _ = haproxy_ops_dirs()
+    ap = argparse.ArgumentParser(description="Streaming anomaly detector (Py3.11)")
+    ap.add_argument("--state", default=str(STATE_FILE))
+    ap.add_argument("--signal-dir", default=str(SIGNAL_DIR))
+    ap.add_argument("--ops-queue", default=str(q))
+    ap.add_argument("--log-dir", default=str(LOGS_DIR))
+    ap.add_argument("--alpha", type=float, default=0.1, help="коэффициент EWMA базы")
+    ap.add_argument("--z-thr", type=float, default=3.0)
+    ap.add_argument("--drain-conf", type=float, default=0.9)
+    ap.add_argument("--min-requests", type=int, default=20, help="меньше запросов за интервал — err не оцениваем")
+    ap.add_argument("--err-floor", type=float, default=0.005, help="минимальное σ доли ошибок")
+    ap.add_argument("--rtime-floor-ms", type=float, default=10.0, help="минимальное σ/MAD rtime")
+    ap.add_argument("--act", action="store_true", help="класть drain в haproxy_ops")
+    ap.add_argument("--max-drained", type=int, default=1, help="серверов бэкенда, выведенных детектором")
+    ap.add_argument("--drained-ttl-sec", type=float, default=600.0,
+                    help="пауза до enable на проверку (× число попыток) и длительность проверки")
+    ap.add_argument("--ramp", action="store_true", help="enable на проверку через weight_ramp (вес ступенями)")
+    ap.add_argument("--loop", action="store_true")
+    ap.add_argument("--interval", type=float, default=5.0)
+    args = ap.parse_args(argv)
+
+    try:
+        with with_flock(LOGS_DIR / "locks" / "anomaly_detector.lock", timeout_sec=1.0):
+            det = Detector(args)
+            while True:
+                try:
+                    if args.act:
+                        det.recover()
+                    det.tick()
+                except Exception as e:
+                    det.log(f"tick error: {e}")
+                if not args.loop:
+                    break
+                time.sleep(args.interval)
+    except TimeoutError:
+        print("anomaly_detector: another instance is running")
+        return 1
+    return 0
+
+if __name__ == "__main__":
+    raise SystemExit(main())
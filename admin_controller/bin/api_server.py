@@ -16,12 +16,31 @@ GET  /metrics                      -> Prometheus plaintext
 GET  /checks/disk                  -> диски (warn>=90, crit>=100 по умолчанию)
 GET  /checks/services              -> systemd-сервисы
 GET  /checks/ports                 -> TCP-порты
-GET  /checks/jboss                 -> деплои JBoss (jboss-cli по умолчанию /u01/jboss/bin/jboss-cli.sh)
+GET  /checks/jboss                 -> деплои JBoss (HTTP management API JBOSS_CONTROLLER; запасной — jboss-cli /u01/jboss/bin/jboss-cli.sh)
 GET  /checks/system                -> память/CPU + топ процессов
+     /checks/*: локальный результат — из фонового планировщика (controller/health_sampler.py,
+     интервалы HEALTH_INTERVALS="disk=60,services=15,ports=15,jboss=60,system=10"),
+     с полями age_sec/stale; ?fresh=1 — пересчитать сейчас; --no-sampler — считать на каждый запрос
 
 POST /haproxy/toggle       body: {"action":"drain|disable|enable","backend":"...","server":"..."} или {"action":"...","server":"backend/server"}
+POST /haproxy/toggle/batch body: {"items":[{"action":...,"backend":...,"server":...}, ...]}
+                           -> один план по одному снимку stats; per-item status applied|deferred|rejected|error
 POST /queue/retry          body: {} | пусто
 
+РЕЖИМЫ:
+  по умолчанию ThreadingHTTPServer (поток на запрос);
+  --async (или API_ASYNC=1): asyncio-сервер на stdlib — соединения и /checks/* с
+  подпроцессами (systemctl, jboss-cli, ps) обслуживаются в event loop через asyncio-подпроцессы
+  с таймаутом (CHECK_TIMEOUT_SEC), остальные маршруты — тем же Handler в пуле из --threads потоков.
+  Маршруты, auth, rate-limit и метрики общие.
+  --workers N (или API_WORKERS): pre-fork — N процессов (каждый в выбранном режиме) на одном
+  порту через SO_REUSEPORT, JSON-сериализация больших ответов не упирается в одно ядро (GIL).
+  Master перезапускает упавших воркеров и держит общее состояние (controller/shared_state.py):
+  rate-limit по IP, nonce HMAC и ключи идемпотентности — N воркеров ведут себя как один.
+  Счётчики /metrics каждый воркер сбрасывает в run/api_<port>/metrics/worker-<i>.json
+  (раз в METRICS_FLUSH_SEC и при scrape); /metrics суммирует файлы всех воркеров.
+  Кэш /checks/* у каждого воркера свой.
+
 AUTH:
   - X-Auth-Token: <TOGGLE_SECRET>  (или ?secret=... в query)
   - ИЛИ X-Signature: v=1;ts=...;nonce=...;sig=<hmac>  (см. controller/auth.py)
@@ -29,7 +48,9 @@ AUTH:
 """
 
 from __future__ import annotations
-import argparse, json, os, time, csv, re, subprocess, hashlib, threading
+import argparse, asyncio, json, os, time, csv, re, subprocess, hashlib, threading, io, signal
+import http.client
+from concurrent.futures import ThreadPoolExecutor
 from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
 from urllib.parse import urlparse, parse_qs, unquote
 from pathlib import Path
@@ -38,9 +59,13 @@ from datetime import datetime
 import time as _time
 
 # health-checks (локальные и агрегация)
+from controller.health_sampler import HealthSampler, parse_intervals
+from controller.shared_state import LocalState, StateServer, StateClient, StateFull, get_state, set_state
 from controller.health_checks import (
     check_disk, check_services, check_ports,
-    check_jboss_deploys, check_system_load
+    check_jboss_deploys, check_system_load,
+    check_services_async, check_ports_async,
+    check_jboss_deploys_async, check_system_load_async, prime_system_load,
 )
 
 # единая база /tmp/pattern_controller
@@ -73,6 +98,12 @@ AUTH_FAIL_LOG = LOG_DIR / "api_auth_fail.log"
 SAFE_NAME = re.compile(r"^[A-Za-z0-9._:-]+$")
 SAFE_ACTIONS = {"drain", "disable", "enable"}
 MAX_BODY = int(os.environ.get("MAX_BODY_BYTES", "1048576"))  # 1 MiB
+BATCH_MAX_ITEMS = int(os.environ.get("BATCH_MAX_ITEMS", "200"))
+
+# asyncio-режим
+CHECK_TIMEOUT_SEC = float(os.environ.get("CHECK_TIMEOUT_SEC", "10"))
+KEEPALIVE_SEC = float(os.environ.get("KEEPALIVE_SEC", "15"))
+MAX_HEADER_BYTES = 65536
 
 # параметры безопасности (можно переопределить env)
 MIN_ACTIVE_NODES = int(os.environ.get("MIN_ACTIVE_NODES", "4"))
@@ -87,6 +118,11 @@ HTTP_REQ_TOTAL: dict[tuple[str,str,int], int] = {}
 # ключ: (method, path_template) -> {"sum": float, "count": int, "buckets": {le: count}}
 HTTP_REQ_TIME: dict[tuple[str,str], dict] = {}
 
+# pre-fork: номер воркера и каталог файлов его счётчиков (None — один процесс)
+WORKER_ID: int | None = None
+METRICS_DIR: Path | None = None
+METRICS_FLUSH_SEC = float(os.environ.get("METRICS_FLUSH_SEC", "1"))
+
 def _path_template(raw_path: str) -> str:
     """Нормализация путей, чтобы не раздувать кардинальность."""
     try:
@@ -111,6 +147,63 @@ def _observe_request(method: str, raw_path: str, code: int, elapsed_sec: float):
             if elapsed_sec <= le:
                 h["buckets"][le] += 1
 
+def _metrics_snapshot() -> dict:
+    with _REQ_LOCK:
+        return {
+            "pc": dict(PC_METR),
+            "total": [[m, p, c, v] for (m, p, c), v in HTTP_REQ_TOTAL.items()],
+            "time": [[m, p, h["sum"], h["count"], [h["buckets"][le] for le in HIST_BUCKETS]]
+                     for (m, p), h in HTTP_REQ_TIME.items()],
+        }
+
+def _metrics_apply(snap: dict, pc: dict, total: dict, timing: dict):
+    """Прибавить снимок воркера к pc/total/timing (структуры как у PC_METR/HTTP_REQ_*)."""
+    for k, v in (snap.get("pc") or {}).items():
+        pc[k] = pc.get(k, 0) + v
+    for m, p, c, v in snap.get("total") or []:
+        total[(m, p, int(c))] = total.get((m, p, int(c)), 0) + v
+    for m, p, sm, cnt, buckets in snap.get("time") or []:
+        h = timing.setdefault((m, p), {"sum": 0.0, "count": 0, "buckets": {le: 0 for le in HIST_BUCKETS}})
+        h["sum"] += sm
+        h["count"] += cnt
+        for le, b in zip(HIST_BUCKETS, buckets):
+            h["buckets"][le] += b
+
+def _metrics_flush(last: str | None = None) -> str:
+    """Записать счётчики воркера в METRICS_DIR/worker-<i>.json (temp+rename), если изменились."""
+    data = json.dumps(_metrics_snapshot())
+    if data != last and METRICS_DIR is not None:
+        path = METRICS_DIR / f"worker-{WORKER_ID}.json"
+        tmp = path.with_suffix(f".tmp{os.getpid()}")
+        tmp.write_text(data, encoding="utf-8")
+        os.replace(tmp, path)
+    return data
+
+def _metrics_flush_loop():
+    last = None
+    while True:
+        _time.sleep(METRICS_FLUSH_SEC)
+        try:
+            last = _metrics_flush(last)
+        except Exception:
+            pass
+
+def _metrics_view() -> tuple[dict, dict, dict]:
+    """(pc, total, timing) для /metrics: свои счётчики или сумма по файлам всех воркеров."""
+    pc: dict = {k: 0 for k in PC_METR}
+    total: dict = {}
+    timing: dict = {}
+    if METRICS_DIR is None:
+        _metrics_apply(_metrics_snapshot(), pc, total, timing)
+        return pc, total, timing
+    _metrics_flush()
+    for f in sorted(METRICS_DIR.glob("worker-*.json")):
+        try:
+            _metrics_apply(json.loads(f.read_text(encoding="utf-8")), pc, total, timing)
+        except Exception:
+            pass
+    return pc, total, timing
+
 def ts_now() -> str:
     return datetime.now().strftime("%Y-%m-%d %H:%M:%S")
 
@@ -195,26 +288,70 @@ def _haproxy_state(socket_path: str, backend_filter: str | None = None):
                      "admin": admin, "oper": oper, "weight": weight, "check": check})
     return rows
 
+# ---------- локальные проверки /checks/* ----------
+# маршрут -> файл агрегата узла в report/<node>/health/
+CHECK_FILES = {
+    "/checks/disk": "disk.json",
+    "/checks/services": "services.json",
+    "/checks/ports": "ports.json",
+    "/checks/jboss": "jboss.json",
+    "/checks/system": "system.json",
+}
+
+HEALTH_INTERVALS = {"/checks/disk": 60.0, "/checks/services": 15.0, "/checks/ports": 15.0,
+                    "/checks/jboss": 60.0, "/checks/system": 10.0}
+SAMPLER: HealthSampler | None = None
+
+def _start_sampler(cache_dir: Path | None = None, leader: bool = True) -> HealthSampler:
+    """cache_dir — pre-fork: проверки гоняет только leader (воркер 0), остальные читают его файлы."""
+    global SAMPLER
+    spec = parse_intervals(os.environ.get("HEALTH_INTERVALS", ""),
+                           {k.rsplit("/", 1)[-1]: v for k, v in HEALTH_INTERVALS.items()})
+    jobs = {path: ((lambda p=path: _local_check(p)), spec[path.rsplit("/", 1)[-1]]) for path in CHECK_FILES}
+    if leader:
+        prime_system_load()  # первый system — загрузка за окно, а не средние с загрузки; sleep здесь, не в запросе
+    # весь проход — как самая медленная проверка
+    SAMPLER = HealthSampler(jobs, workers=len(jobs), cache_dir=cache_dir, leader=leader).start()
+    return SAMPLER
+
+def _local_check(path: str, use_async: bool = False):
+    """Локальная часть /checks/*: dict или (use_async) корутина для проверок с подпроцессами/сетью."""
+    if path == "/checks/disk":
+        warn = float(os.environ.get("DISK_WARN", "90"))
+        crit = float(os.environ.get("DISK_CRIT", "100"))
+        mounts = [x for x in (os.environ.get("DISK_MOUNTS","").split(",")) if x.strip()]
+        return check_disk(mounts or None, warn_pct=warn, crit_pct=crit)
+    if path == "/checks/services":
+        services = [x for x in (os.environ.get("SERVICES","haproxy,admin-controller,pattern-ui").split(",")) if x.strip()]
+        return (check_services_async if use_async else check_services)(services)
+    if path == "/checks/ports":
+        targets = [x for x in (os.environ.get("PORTS","127.0.0.1:35073,127.0.0.1:35009").split(",")) if x.strip()]
+        return (check_ports_async if use_async else check_ports)(targets, timeout_sec=1.0)
+    if path == "/checks/jboss":
+        cli = os.environ.get("JBOSS_CLI", "/u01/jboss/bin/jboss-cli.sh")  # дефолт
+        ctrl = os.environ.get("JBOSS_CONTROLLER", "127.0.0.1:9990")
+        user = os.environ.get("JBOSS_USER")
+        pwd  = os.environ.get("JBOSS_PASS")
+        flt  = [x for x in (os.environ.get("JBOSS_DEPLOYS","").split(",")) if x.strip()]
+        # management API (JBOSS_MGMT) проверка пробует сама; jboss-cli нужен только как запасной путь
+        fn = check_jboss_deploys_async if use_async else check_jboss_deploys
+        return fn(cli, controller=ctrl, user=user, password=pwd, deployments_filter=(flt or None))
+    if path == "/checks/system":
+        return check_system_load_async() if use_async else check_system_load()
+    raise KeyError(path)
+
 # ---------- идемпотентность и rate-limit ----------
-IDEMP_STORE: dict[str, tuple[float, dict]] = {}
+# состояние — controller/shared_state.py: ограниченные хранилища с TTL (timing wheel, STATE_MAX_KEYS);
+# rate-limit — token bucket с LRU-вытеснением, ключи идемпотентности не вытесняются (переполнение —
+# StateFull → 503); в --workers N общее для всех воркеров (у master'а)
 def _idempotent_ok(key: str, ttl_sec=60):
-    now = time.time()
-    # чистим протухшие
-    for k,(t,_) in list(IDEMP_STORE.items()):
-        if now - t > ttl_sec:
-            IDEMP_STORE.pop(k, None)
-    if key in IDEMP_STORE:
-        return False, IDEMP_STORE[key][1]
-    IDEMP_STORE[key] = (now, {"ok": True, "cached": True})
+    cached = get_state().put_if_absent("idem:" + key, ttl_sec, {"ok": True, "cached": True})
+    if cached is not None:
+        return False, cached
     return True, None
 
-RL: dict[str, list[float]] = {}
 def _rate_limited(ip: str, limit=RL_LIMIT, window=RL_WINDOW) -> bool:
-    now = time.time()
-    arr = [t for t in RL.get(ip, []) if now - t < window]
-    arr.append(now)
-    RL[ip] = arr
-    return len(arr) > limit
+    return get_state().rate_hit("rl:" + ip, limit, window)
 
 # ---------- аудит ----------
 AUDIT_LOG = LOG_DIR / "api_audit.ndjson"
@@ -246,6 +383,20 @@ def _call_safe_toggle(action: str, backend: str, server: str) -> dict:
             return {"ok": False, "mode": "subprocess", "stderr": r.stderr.decode("utf-8", "ignore")}
         return {"ok": True, "mode": "subprocess"}
 
+def _call_safe_toggle_many(items: list[tuple[str, str, str]]) -> dict:
+    """Пачка через safe_toggle_many; без импорта — по одному через subprocess (без общего плана)."""
+    try:
+        from controller.safe_haproxy_toggle import safe_toggle_many
+    except Exception:
+        results = []
+        for action, backend, server in items:
+            res = _call_safe_toggle(action, backend, server)
+            results.append({"action": action, "backend": backend, "server": server,
+                            "status": "applied" if res.get("ok") else "error",
+                            **({} if res.get("ok") else {"reason": res.get("stderr", "")})})
+        return {"ok": True, "mode": "subprocess", "results": results}
+    return {"ok": True, "mode": "import", "results": safe_toggle_many(items, min_floor=MIN_ACTIVE_NODES)}
+
 def _call_retry() -> dict:
     try:
         from controller.safe_haproxy_toggle import retry_deferred_once
@@ -262,6 +413,9 @@ def _call_retry() -> dict:
 
 class Handler(BaseHTTPRequestHandler):
     report_root: Path = Path(os.environ.get("REPORT_DIR", str(REPORT_ROOT_DEFAULT)))
+    # asyncio-режим: локальный результат /checks/* посчитан заранее, запрос уже авторизован
+    _prefetched: dict | None = None
+    _authed: bool = False
 
     # перехватываем код статуса для метрик
     def send_response(self, code, message=None):
@@ -309,6 +463,8 @@ class Handler(BaseHTTPRequestHandler):
         return self.rfile.read(n) if n else b""
 
     def _auth(self, method: str, body: bytes) -> bool:
+        if self._authed:
+            return True
         # /health можно открыть без auth (если не включён REQUIRE_AUTH_HEALTH)
         if self.path.split("?")[0] == "/health" and not REQUIRE_AUTH_HEALTH:
             return True
@@ -325,6 +481,10 @@ class Handler(BaseHTTPRequestHandler):
             _log_auth_fail(self.client_address[0], self.path, str(e))
             self._bad(403, f"forbidden: {e}")
             return False
+        except StateFull as e:
+            # nonce не на что сохранить — без защиты от повтора запрос не пускаем
+            self._bad(503, f"replay store full: {e}")
+            return False
 
     def log_message(self, fmt, *args):
         return  # тише
@@ -409,64 +569,18 @@ class Handler(BaseHTTPRequestHandler):
                 except Exception as e:
                     return self._bad(500, f"haproxy state error: {e}")
 
-            # --- Новые агрегирующие проверки --- #
-            if path == "/checks/disk":
-                warn = float(os.environ.get("DISK_WARN", "90"))
-                crit = float(os.environ.get("DISK_CRIT", "100"))
-                mounts = [x for x in (os.environ.get("DISK_MOUNTS","").split(",")) if x.strip()]
-                local = check_disk(mounts or None, warn_pct=warn, crit_pct=crit)
-                by_node = {"__entrypoint__": local}
-                for name, ndir in nodes.items():
-                    p = ndir / "health" / "disk.json"
-                    if p.exists():
-                        try: by_node[name] = json.loads(p.read_text(encoding="utf-8"))
-                        except Exception: by_node[name] = {"error":"bad json"}
-                return self._send_json({"by_node": by_node})
-
-            if path == "/checks/services":
-                services = [x for x in (os.environ.get("SERVICES","haproxy,admin-controller,pattern-ui").split(",")) if x.strip()]
-                local = check_services(services)
-                by_node = {"__entrypoint__": local}
-                for name, ndir in nodes.items():
-                    p = ndir / "health" / "services.json"
-                    if p.exists():
-                        try: by_node[name] = json.loads(p.read_text(encoding="utf-8"))
-                        except Exception: by_node[name] = {"error":"bad json"}
-                return self._send_json({"by_node": by_node})
-
-            if path == "/checks/ports":
-                targets = [x for x in (os.environ.get("PORTS","127.0.0.1:35073,127.0.0.1:35009").split(",")) if x.strip()]
-                local = check_ports(targets, timeout_sec=1.0)
-                by_node = {"__entrypoint__": local}
-                for name, ndir in nodes.items():
-                    p = ndir / "health" / "ports.json"
-                    if p.exists():
-                        try: by_node[name] = json.loads(p.read_text(encoding="utf-8"))
-                        except Exception: by_node[name] = {"error":"bad json"}
-                return self._send_json({"by_node": by_node})
-
-            if path == "/checks/jboss":
-                cli = os.environ.get("JBOSS_CLI", "/u01/jboss/bin/jboss-cli.sh")  # дефолт
-                ctrl = os.environ.get("JBOSS_CONTROLLER", "127.0.0.1:9990")
-                user = os.environ.get("JBOSS_USER")
-                pwd  = os.environ.get("JBOSS_PASS")
-                flt  = [x for x in (os.environ.get("JBOSS_DEPLOYS","").split(",")) if x.strip()]
-                local = ({"ts":"","ok":False,"error":f"cli not found: {cli}","items":[]}
-                         if not os.path.exists(cli)
-                         else check_jboss_deploys(cli, controller=ctrl, user=user, password=pwd, deployments_filter=(flt or None)))
-                by_node = {"__entrypoint__": local}
-                for name, ndir in nodes.items():
-                    p = ndir / "health" / "jboss.json"
-                    if p.exists():
-                        try: by_node[name] = json.loads(p.read_text(encoding="utf-8"))
-                        except Exception: by_node[name] = {"error":"bad json"}
-                return self._send_json({"by_node": by_node})
-
-            if path == "/checks/system":
-                local = check_system_load()
+            # --- Агрегирующие проверки: локальная + сохранённые health/*.json узлов --- #
+            if path in CHECK_FILES:
+                if self._prefetched is not None:
+                    local = self._prefetched
+                elif SAMPLER is not None:
+                    fresh = qs.get("fresh", ["0"])[0] == "1"
+                    local = SAMPLER.refresh(path) if fresh else SAMPLER.get(path)
+                else:
+                    local = _local_check(path)
                 by_node = {"__entrypoint__": local}
                 for name, ndir in nodes.items():
-                    p = ndir / "health" / "system.json"
+                    p = ndir / "health" / CHECK_FILES[path]
                     if p.exists():
                         try: by_node[name] = json.loads(p.read_text(encoding="utf-8"))
                         except Exception: by_node[name] = {"error":"bad json"}
@@ -475,6 +589,7 @@ class Handler(BaseHTTPRequestHandler):
             # --- Prometheus /metrics (plaintext)
             if path == "/metrics":
                 try:
+                    pc, req_total, req_time = _metrics_view()
                     lines = []
                     lines.append("# HELP pc_up Pattern Controller API up")
                     lines.append("# TYPE pc_up gauge")
@@ -484,40 +599,60 @@ class Handler(BaseHTTPRequestHandler):
                     lines.append(f"pc_nodes {len(nodes)}")
                     lines += [
                         "# HELP pc_toggle_total total toggle calls", "# TYPE pc_toggle_total counter",
-                        f"pc_toggle_total {PC_METR['toggle_total']}",
+                        f"pc_toggle_total {pc['toggle_total']}",
                         "# HELP pc_toggle_fail failed toggle calls", "# TYPE pc_toggle_fail counter",
-                        f"pc_toggle_fail {PC_METR['toggle_fail']}",
+                        f"pc_toggle_fail {pc['toggle_fail']}",
                         "# HELP pc_retry_total retry calls", "# TYPE pc_retry_total counter",
-                        f"pc_retry_total {PC_METR['retry_total']}",
+                        f"pc_retry_total {pc['retry_total']}",
                     ]
+                    st = get_state().stats()  # в --workers N — общее хранилище master'а
+                    lines += [
+                        "# HELP pc_state_keys keys in rate-limit/nonce/idempotency store", "# TYPE pc_state_keys gauge",
+                        f"pc_state_keys {st.get('keys', 0)}",
+                        "# HELP pc_state_replay_keys unexpired nonce/idempotency keys", "# TYPE pc_state_replay_keys gauge",
+                        f"pc_state_replay_keys {st.get('replay_keys', 0)}",
+                        "# HELP pc_state_max_keys size bound of each store (STATE_MAX_KEYS)",
+                        "# TYPE pc_state_max_keys gauge",
+                        f"pc_state_max_keys {st.get('max_keys', 0)}",
+                        "# HELP pc_state_evictions_total rate-limit buckets evicted by the size bound (LRU)",
+                        "# TYPE pc_state_evictions_total counter",
+                        f"pc_state_evictions_total {st.get('evictions', 0)}",
+                        "# HELP pc_state_expired_total keys expired by TTL", "# TYPE pc_state_expired_total counter",
+                        f"pc_state_expired_total {st.get('expired', 0)}",
+                        "# HELP pc_state_rejected_total nonce/idempotency keys refused: store full (503)",
+                        "# TYPE pc_state_rejected_total counter",
+                        f"pc_state_rejected_total {st.get('rejected', 0)}",
+                    ]
+                    if METRICS_DIR is not None:
+                        lines += ["# HELP pc_api_workers api_server worker processes reporting metrics",
+                                  "# TYPE pc_api_workers gauge",
+                                  f"pc_api_workers {len(list(METRICS_DIR.glob('worker-*.json')))}"]
 
                     # HTTP requests total
                     lines.append("# HELP http_requests_total Total HTTP requests")
                     lines.append("# TYPE http_requests_total counter")
-                    with _REQ_LOCK:
-                        for (method, path_t, code), val in HTTP_REQ_TOTAL.items():
-                            lines.append(f'http_requests_total{{method="{method}",path="{path_t}",code="{code}"}} {val}')
+                    for (method, path_t, code), val in req_total.items():
+                        lines.append(f'http_requests_total{{method="{method}",path="{path_t}",code="{code}"}} {val}')
 
                     # HTTP request duration histogram
                     lines.append("# HELP http_request_duration_seconds HTTP request duration")
                     lines.append("# TYPE http_request_duration_seconds histogram")
-                    with _REQ_LOCK:
-                        for (method, path_t), h in HTTP_REQ_TIME.items():
-                            cumulative = 0
-                            for le in HIST_BUCKETS:
-                                cumulative += h["buckets"].get(le, 0)
-                                lines.append(
-                                    f'http_request_duration_seconds_bucket{{method="{method}",path="{path_t}",le="{le}"}} {cumulative}'
-                                )
-                            lines.append(
-                                f'http_request_duration_seconds_bucket{{method="{method}",path="{path_t}",le="+Inf"}} {h["count"]}'
-                            )
-                            lines.append(
-                                f'http_request_duration_seconds_count{{method="{method}",path="{path_t}"}} {h["count"]}'
-                            )
+                    for (method, path_t), h in req_time.items():
+                        cumulative = 0
+                        for le in HIST_BUCKETS:
+                            cumulative += h["buckets"].get(le, 0)
                             lines.append(
-                                f'http_request_duration_seconds_sum{{method="{method}",path="{path_t}"}} {h["sum"]}'
+                                f'http_request_duration_seconds_bucket{{method="{method}",path="{path_t}",le="{le}"}} {cumulative}'
                             )
+                        lines.append(
+                            f'http_request_duration_seconds_bucket{{method="{method}",path="{path_t}",le="+Inf"}} {h["count"]}'
+                        )
+                        lines.append(
+                            f'http_request_duration_seconds_count{{method="{method}",path="{path_t}"}} {h["count"]}'
+                        )
+                        lines.append(
+                            f'http_request_duration_seconds_sum{{method="{method}",path="{path_t}"}} {h["sum"]}'
+                        )
 
                     text = "\n".join(lines) + "\n"
                     return self._send_text(text, 200, "text/plain; version=0.0.4; charset=utf-8")
@@ -557,6 +692,50 @@ class Handler(BaseHTTPRequestHandler):
                 _audit({"ip": ip, "path": path, "ok": bool(res.get("ok"))})
                 return self._send_json({"ok": bool(res.get("ok")), "details": res}, code)
 
+            if path == "/haproxy/toggle/batch":
+                if "application/json" not in self.headers.get("Content-Type", ""):
+                    return self._bad(415, "expected application/json")
+                try:
+                    data = json.loads(body.decode("utf-8"))
+                except Exception:
+                    return self._bad(400, "invalid json")
+                raw = data.get("items") if isinstance(data, dict) else data
+                if not isinstance(raw, list) or not raw:
+                    return self._bad(400, "items required")
+                if len(raw) > BATCH_MAX_ITEMS:
+                    return self._bad(413, f"too many items (max {BATCH_MAX_ITEMS})")
+                items = []
+                for it in raw:
+                    it = it if isinstance(it, dict) else {}
+                    action, backend, server = it.get("action", ""), it.get("backend", ""), it.get("server", "")
+                    if server and "/" in server and not backend:
+                        backend, server = server.split("/", 1)
+                    if action not in SAFE_ACTIONS:
+                        return self._bad(400, f"bad action: {action!r}")
+                    if not (SAFE_NAME.match(backend or "") and SAFE_NAME.match(server or "")):
+                        return self._bad(400, f"bad backend/server: {backend!r}/{server!r}")
+                    items.append((action, backend, server))
+
+                idem = self.headers.get("Idempotency-Key") or hashlib.sha256(body).hexdigest()
+                ok_idem, cached = _idempotent_ok(idem)
+                if not ok_idem:
+                    return self._send_json(cached, 200)
+
+                try:
+                    res = _call_safe_toggle_many(items)
+                except Exception as e:
+                    return self._bad(503, f"batch toggle failed: {e}")
+                results = res["results"]
+                failed = sum(1 for r in results if r["status"] == "error")
+                PC_METR["toggle_total"] += len(results)
+                PC_METR["toggle_fail"] += failed
+                counts: dict[str, int] = {}
+                for r in results:
+                    counts[r["status"]] = counts.get(r["status"], 0) + 1
+                _audit({"ip": ip, "path": path, "items": len(results), "counts": counts, "mode": res.get("mode")})
+                return self._send_json({"ok": failed == 0, "mode": res.get("mode"),
+                                        "counts": counts, "results": results})
+
             if path == "/haproxy/toggle":
                 ctype = self.headers.get("Content-Type", "")
                 if "application/json" not in ctype:
@@ -607,6 +786,8 @@ class Handler(BaseHTTPRequestHandler):
                 return self._send_json({"ok": ok, "details": res}, code)
 
             return self._bad(404, "not found")
+        except StateFull as e:
+            self._bad(503, f"idempotency store full: {e}")  # из _idempotent_ok
         except Exception as e:
             self._bad(500, f"internal: {e}")
         finally:
@@ -614,8 +795,11 @@ class Handler(BaseHTTPRequestHandler):
             code = getattr(self, "_status_code", 200)
             _observe_request("POST", self.path, code, elapsed)
 
-def serve(bind: str, port: int):
-    srv = ThreadingHTTPServer((bind, int(port)), Handler)
+class _ReusePortHTTPServer(ThreadingHTTPServer):
+    allow_reuse_port = True  # pre-fork: свой listen-сокет у каждого воркера, балансирует ядро
+
+def serve(bind: str, port: int, reuse_port: bool = False):
+    srv = (_ReusePortHTTPServer if reuse_port else ThreadingHTTPServer)((bind, int(port)), Handler)
     print(f"[start] api_server bind={bind} port={port} report_root={Handler.report_root}")
     try:
         srv.serve_forever()
@@ -625,12 +809,240 @@ def serve(bind: str, port: int):
         try: srv.server_close()
         except Exception: pass
 
+# ---------- asyncio-режим ----------
+class _BufferedHandler(Handler):
+    """Handler над уже прочитанным запросом: HTTP разбирает asyncio-сервер, ответ копится в wfile."""
+    protocol_version = "HTTP/1.1"  # все ответы Handler идут с Content-Length — keep-alive безопасен
+
+    def __init__(self, method: str, target: str, version: str, headers, body: bytes, client):
+        self.command, self.path, self.request_version = method, target, version
+        self.requestline = f"{method} {target} {version}"
+        self.headers = headers
+        self.rfile = io.BytesIO(body)
+        self.wfile = io.BytesIO()
+        self.client_address = client
+        self.close_connection = False
+
+def _raw_response(code: int, msg: str) -> bytes:
+    data = json.dumps({"error": msg, "code": code}).encode("utf-8")
+    return (f"HTTP/1.1 {code} {msg}\r\nContent-Type: application/json\r\n"
+            f"Content-Length: {len(data)}\r\nConnection: close\r\n\r\n").encode("latin-1") + data
+
+async def _handle_async(h: _BufferedHandler, pool: ThreadPoolExecutor):
+    loop = asyncio.get_running_loop()
+    u = urlparse(h.path)
+    path = u.path or "/"
+    fresh = parse_qs(u.query or "").get("fresh", ["0"])[0] == "1"
+    # из кэша планировщика отдаёт сам Handler; в loop считаем только ?fresh=1 и первый раз
+    if h.command == "GET" and path in CHECK_FILES and (SAMPLER is None or fresh or not SAMPLER.has(path)):
+        t0 = _time.perf_counter()
+        if not h._auth("GET", b""):  # 403 уже записан
+            _observe_request("GET", h.path, 403, _time.perf_counter() - t0)
+            return
+        h._authed = True
+        res = _local_check(path, use_async=True)
+        if asyncio.iscoroutine(res):
+            try:
+                res = await asyncio.wait_for(res, CHECK_TIMEOUT_SEC)
+            except Exception as e:
+                res = {"ts": ts_now(), "ok": False, "error": f"check failed: {e or type(e).__name__}", "items": []}
+            else:
+                if SAMPLER is not None:
+                    res = SAMPLER.put(path, res)
+        h._prefetched = res
+    fn = {"GET": h.do_GET, "POST": h.do_POST}[h.command]
+    await loop.run_in_executor(pool, fn)
+
+async def _serve_conn(reader: asyncio.StreamReader, writer: asyncio.StreamWriter, pool: ThreadPoolExecutor):
+    peer = writer.get_extra_info("peername") or ("", 0)
+    try:
+        while True:
+            try:
+                line = await asyncio.wait_for(reader.readline(), KEEPALIVE_SEC)
+            except asyncio.TimeoutError:
+                break
+            if not line:
+                break
+            parts = line.decode("latin-1").split()
+            if len(parts) != 3 or not parts[2].startswith("HTTP/"):
+                writer.write(_raw_response(400, "Bad Request")); break
+            method, target, version = parts
+            raw = b""
+            while True:
+                hl = await asyncio.wait_for(reader.readline(), KEEPALIVE_SEC)
+                if hl in (b"\r\n", b"\n", b""):
+                    break
+                raw += hl
+                if len(raw) > MAX_HEADER_BYTES:
+                    break
+            if len(raw) > MAX_HEADER_BYTES:
+                writer.write(_raw_response(431, "Request Header Fields Too Large")); break
+            headers = http.client.parse_headers(io.BytesIO(raw + b"\r\n"))
+            conn = (headers.get("Connection") or "").lower()
+            keep = (conn != "close") if version == "HTTP/1.1" else (conn == "keep-alive")
+
+            body = b""
+            cl = headers.get("Content-Length")
+            if headers.get("Transfer-Encoding"):
+                writer.write(_raw_response(411, "Length Required")); break
+            if cl is not None:
+                try:
+                    n = int(cl)
+                except ValueError:
+                    n = -1
+                if 0 <= n <= MAX_BODY:
+                    body = await asyncio.wait_for(reader.readexactly(n), KEEPALIVE_SEC) if n else b""
+                else:
+                    keep = False  # тело не читали — Handler ответит 411/413, соединение закрываем
+
+            if method not in ("GET", "POST"):
+                writer.write(_raw_response(501, "Not Implemented")); break
+            h = _BufferedHandler(method, target, version, headers, body, peer[:2])
+            await _handle_async(h, pool)
+            writer.write(h.wfile.getvalue())
+            await writer.drain()
+            if not keep:
+                break
+    except (asyncio.IncompleteReadError, asyncio.TimeoutError, ConnectionError):
+        pass
+    finally:
+        try:
+            await writer.drain()
+            writer.close()
+            await writer.wait_closed()
+        except Exception:
+            pass
+
+def serve_async(bind: str, port: int, threads: int = 4, reuse_port: bool = False):
+    pool = ThreadPoolExecutor(max_workers=max(1, threads), thread_name_prefix="api")
+
+    async def run():
+        srv = await asyncio.start_server(lambda r, w: _serve_conn(r, w, pool), bind, int(port),
+                                         reuse_port=reuse_port or None)
+        print(f"[start] api_server (asyncio, threads={threads}) bind={bind} port={port} report_root={Handler.report_root}")
+        async with srv:
+            await srv.serve_forever()
+    try:
+        asyncio.run(run())
+    except KeyboardInterrupt:
+        pass
+    finally:
+        pool.shutdown(wait=False)
+
+# ---------- pre-fork (--workers N) ----------
+def _worker_main(idx: int, args, run_dir: Path):
+    global WORKER_ID, METRICS_DIR
+    signal.signal(signal.SIGTERM, signal.SIG_DFL)
+    signal.signal(signal.SIGINT, signal.default_int_handler)
+    WORKER_ID, METRICS_DIR = idx, run_dir / "metrics"
+    set_state(StateClient(str(run_dir / "state.sock")))
+    # перезапущенный воркер продолжает счётчики предшественника — суммы в /metrics не откатываются
+    try:
+        _metrics_apply(json.loads((METRICS_DIR / f"worker-{idx}.json").read_text(encoding="utf-8")),
+                       PC_METR, HTTP_REQ_TOTAL, HTTP_REQ_TIME)
+    except Exception:
+        pass
+    threading.Thread(target=_metrics_flush_loop, name="metrics-flush", daemon=True).start()
+    if not args.no_sampler:
+        _start_sampler(run_dir / "health", leader=(idx == 0))
+    if args.use_async:
+        serve_async(args.bind, args.port, args.threads, reuse_port=True)
+    else:
+        serve(args.bind, args.port, reuse_port=True)
+
+def serve_prefork(args):
+    """
+    Master: общее состояние (StateServer) + N воркеров на одном порту (SO_REUSEPORT).
+    В master нет потоков — fork при перезапуске воркера безопасен.
+    """
+    run_dir = BASE / "run" / f"api_{args.port}"
+    (run_dir / "metrics").mkdir(parents=True, exist_ok=True)
+    for f in (run_dir / "metrics").glob("worker-*"):
+        f.unlink()
+    for f in (run_dir / "health").glob("*.json"):
+        f.unlink()  # результаты прошлого запуска не выдаём за свежие
+    state = StateServer(str(run_dir / "state.sock"), LocalState())
+    children: dict[int, int] = {}      # pid -> номер воркера
+    pending: dict[int, float] = {}     # номер воркера -> когда перезапустить
+    started: dict[int, float] = {}
+    stopping = False
+
+    def spawn(idx: int):
+        pid = os.fork()
+        if pid == 0:
+            code = 0
+            try:
+                state.close(unlink=False)
+                _worker_main(idx, args, run_dir)
+            except KeyboardInterrupt:
+                pass
+            except BaseException:
+                import traceback
+                traceback.print_exc()
+                code = 1
+            os._exit(code)
+        children[pid] = idx
+        started[idx] = _time.monotonic()
+
+    def stop(signum, frame):
+        nonlocal stopping
+        stopping = True
+    signal.signal(signal.SIGTERM, stop)
+    signal.signal(signal.SIGINT, stop)
+
+    for i in range(args.workers):
+        spawn(i)
+    print(f"[start] api_server master pid={os.getpid()} workers={args.workers} bind={args.bind} port={args.port}")
+    try:
+        while not stopping:
+            state.serve_once(0.5)
+            while children:
+                pid, status = os.waitpid(-1, os.WNOHANG)
+                if pid == 0:
+                    break
+                idx = children.pop(pid, None)
+                if idx is None:
+                    continue
+                print(f"[worker] {idx} pid={pid} exited status={status}, restarting")
+                # падающий на старте воркер перезапускаем не чаще раза в секунду
+                pending[idx] = started[idx] + 1.0
+            now = _time.monotonic()
+            for idx, when in list(pending.items()):
+                if when <= now and not stopping:
+                    pending.pop(idx)
+                    spawn(idx)
+    except InterruptedError:
+        pass
+    finally:
+        for pid in list(children):
+            try: os.kill(pid, signal.SIGTERM)
+            except ProcessLookupError: pass
+        for pid in list(children):
+            try: os.waitpid(pid, 0)
+            except ChildProcessError: pass
+        state.close()
+
 def main(argv=None):
     ap = argparse.ArgumentParser(description="Mini API over /report with auth + HAProxy control + health checks + metrics")
     ap.add_argument("--bind", default=os.environ.get("API_BIND", DEFAULT_BIND))
     ap.add_argument("--port", type=int, default=int(os.environ.get("API_PORT", DEFAULT_PORT)))
+    ap.add_argument("--async", dest="use_async", action="store_true",
+                    default=os.environ.get("API_ASYNC", "0") == "1", help="asyncio-сервер вместо потока на запрос")
+    ap.add_argument("--threads", type=int, default=int(os.environ.get("API_THREADS", "4")),
+                    help="asyncio-режим: потоки для блокирующих маршрутов")
+    ap.add_argument("--no-sampler", action="store_true", default=os.environ.get("HEALTH_SAMPLER", "1") == "0",
+                    help="не держать фоновый кэш /checks/* (считать на каждый запрос)")
+    ap.add_argument("--workers", type=int, default=int(os.environ.get("API_WORKERS", "1")),
+                    help="pre-fork: число процессов на порту (SO_REUSEPORT), общее состояние у master")
     args = ap.parse_args(argv)
-    serve(args.bind, args.port)
+    if args.workers > 1:
+        return serve_prefork(args)
+    if not args.no_sampler:
+        _start_sampler()
+    if args.use_async:
+        serve_async(args.bind, args.port, args.threads)
+    else:
+        serve(args.bind, args.port)
 
 if __name__ == "__main__":
     main()
@@ -4,38 +4,74 @@
 Агрегатор графиков (Py3.11).
 Собирает controller_summary.csv и metrics/agg_1h.json из всех /report/<NODE>/...
 Пишет суммарные графики в /tmp/pattern_controller/report/graphs/*.json
+
+Инкрементальный режим (по умолчанию):
+  - суточные счётчики и позиции чтения источников хранятся в graphs/.state.json
+  - из controller_summary.csv дочитываются только новые строки (offset + inode)
+  - agg_1h.json перечитывается, только если изменились mtime/size
+  - перезаписываются только те графики, содержимое которых изменилось
+  --rebuild  — сбросить состояние и пересчитать всю историю
+  --daemon   — работать циклом (--interval), SIGHUP — внеочередной проход
 """
 from __future__ import annotations
-import csv, json, datetime as dt
+import argparse, csv, io, json, os, signal, threading, datetime as dt
 from pathlib import Path
 from collections import defaultdict
-from typing import Dict, Any, List
+from typing import Dict, Any, List, Tuple
 from path_utils import BASE  # общий корень /tmp/pattern_controller
+from lock_utils import with_flock
+
+STATE_VERSION = 1
 
 def _nodes_report_dirs() -> list[Path]:
     root = BASE / "report"
     if not root.exists(): return []
-    return sorted([p for p in root.iterdir() if p.is_dir()])
+    return sorted([p for p in root.iterdir() if p.is_dir() and p.name != "graphs"])
 
-def _load_csv(csv_path: Path, per_day, verify_ok, verify_fail):
-    if not csv_path.exists(): return
+def _count_row(row: List[str], per_day, verify_ok, verify_fail) -> None:
+    if len(row) < 8: return
+    ts_s = row[0]; note = row[7] if len(row) > 7 else ""
+    day = (ts_s.split(" ") or [""])[0]
+    if not day: return
+    per_day[day] += 1
+    s = (note or "").lower()
+    if "verify=ok" in s:   verify_ok[day]   += 1
+    if "verify=fail" in s: verify_fail[day] += 1
+
+def _fold_csv_tail(csv_path: Path, cp: Dict[str, Any], per_day, verify_ok, verify_fail) -> Tuple[Dict[str, Any], bool]:
+    """
+    Дочитывает controller_summary.csv с сохранённого смещения.
+    cp = {"ino": int, "offset": int}. Файл пересоздан (другой inode) или
+    усечён — читаем новый файл с начала (с пропуском заголовка).
+    Незавершённая последняя строка остаётся на следующий проход.
+    """
     try:
-        with csv_path.open("r", encoding="utf-8", newline="") as f:
-            rdr = csv.reader(f)
-            headers = None
-            for row in rdr:
-                if headers is None:
-                    headers = row; continue
-                if len(row) < 8: continue
-                ts_s = row[0]; note = row[7] if len(row) > 7 else ""
-                day = (ts_s.split(" ") or [""])[0]
-                if not day: continue
-                per_day[day] += 1
-                s = (note or "").lower()
-                if "verify=ok" in s:   verify_ok[day]   += 1
-                if "verify=fail" in s: verify_fail[day] += 1
-    except Exception:
-        pass
+        st = csv_path.stat()
+    except OSError:
+        return cp, False
+    ino, offset = cp.get("ino"), int(cp.get("offset", 0))
+    if ino != st.st_ino or st.st_size < offset:
+        offset = 0
+    if st.st_size == offset:
+        return {"ino": st.st_ino, "offset": offset}, False
+    try:
+        with csv_path.open("rb") as f:
+            f.seek(offset)
+            chunk = f.read()
+    except OSError:
+        return cp, False
+    end = chunk.rfind(b"\n")
+    if end < 0:
+        return {"ino": st.st_ino, "offset": offset}, False
+    chunk = chunk[: end + 1]
+    rows = csv.reader(io.StringIO(chunk.decode("utf-8", "replace"), newline=""))
+    if offset == 0:
+        next(rows, None)  # заголовок
+    changed = False
+    for row in rows:
+        _count_row(row, per_day, verify_ok, verify_fail)
+        changed = True
+    return {"ino": st.st_ino, "offset": offset + len(chunk)}, changed
 
 def _load_agg_1h(path: Path) -> List[dict]:
     try:
@@ -61,23 +97,125 @@ def _sum_5xx_per_day(snaps: List[dict]) -> Dict[str, int]:
         if day: out[day] = max(out[day], total)
     return out
 
+# ---------- состояние ----------
+def _empty_state() -> Dict[str, Any]:
+    return {"version": STATE_VERSION, "per_day": {}, "verify_ok": {}, "verify_fail": {},
+            "s5_by_src": {}, "csv": {}, "agg": {}}
+
+def _load_state(path: Path) -> Dict[str, Any]:
+    try:
+        st = json.loads(path.read_text(encoding="utf-8"))
+        if isinstance(st, dict) and st.get("version") == STATE_VERSION:
+            base = _empty_state(); base.update(st)
+            return base
+    except Exception:
+        pass
+    return _empty_state()
+
+def _atomic_write_text(path: Path, text: str) -> None:
+    tmp = path.with_name(f".{path.name}.tmp")
+    tmp.write_text(text, encoding="utf-8")
+    os.replace(tmp, path)
+
+def _write_if_changed(path: Path, text: str) -> bool:
+    try:
+        if path.read_text(encoding="utf-8") == text:
+            return False
+    except OSError:
+        pass
+    _atomic_write_text(path, text)
+    return True
+
+# ---------- один проход ----------
+def build_once(graphs_dir: Path, rebuild: bool = False) -> Dict[str, Any]:
+    """Инкрементальный проход; возвращает сводку {changed_sources, written}."""
+    state_path = graphs_dir / ".state.json"
+    state = _empty_state() if rebuild else _load_state(state_path)
+
+    per_day = defaultdict(int, state["per_day"])
+    verify_ok = defaultdict(int, state["verify_ok"])
+    verify_fail = defaultdict(int, state["verify_fail"])
+    s5_by_src: Dict[str, Dict[str, int]] = state["s5_by_src"]
+    changed_sources = 0
+
+    for rep in _nodes_report_dirs():
+        csv_path = rep / "controller_summary.csv"
+        key = str(csv_path)
+        cp, changed = _fold_csv_tail(csv_path, state["csv"].get(key, {}), per_day, verify_ok, verify_fail)
+        if cp: state["csv"][key] = cp
+        changed_sources += int(changed)
+
+        agg_path = rep / "metrics" / "agg_1h.json"
+        akey = str(agg_path)
+        try:
+            ast = agg_path.stat()
+        except OSError:
+            continue
+        sig = [ast.st_mtime_ns, ast.st_size]
+        if state["agg"].get(akey) == sig:
+            continue
+        # история по дням сохраняется: новое значение дня — максимум из известных
+        days = s5_by_src.setdefault(akey, {})
+        for day, val in _sum_5xx_per_day(_load_agg_1h(agg_path)).items():
+            days[day] = max(int(days.get(day, 0)), val)
+        state["agg"][akey] = sig
+        changed_sources += 1
+
+    s5_day: Dict[str, int] = defaultdict(int)
+    for days in s5_by_src.values():
+        for day, val in days.items():
+            s5_day[day] = max(s5_day[day], int(val))
+
+    state.update(per_day=dict(per_day), verify_ok=dict(verify_ok), verify_fail=dict(verify_fail))
+
+    written: List[str] = []
+    graphs = {
+        "ops_per_day.json": dict(per_day),
+        "verify_status.json": {"ok": dict(verify_ok), "fail": dict(verify_fail)},
+        "5xx_per_day.json": dict(s5_day),
+    }
+    for name, obj in graphs.items():
+        if _write_if_changed(graphs_dir / name, json.dumps(obj, ensure_ascii=False, sort_keys=True)):
+            written.append(name)
+    if changed_sources or written or rebuild or not state_path.exists():
+        _atomic_write_text(state_path, json.dumps(state, ensure_ascii=False))
+    return {"changed_sources": changed_sources, "written": written}
+
 def main(argv=None) -> int:
+    ap = argparse.ArgumentParser(description="graph builder (Py3.11)")
+    ap.add_argument("--rebuild", action="store_true", help="сбросить состояние и пересчитать историю")
+    ap.add_argument("--daemon", action="store_true", help="работать циклом")
+    ap.add_argument("--interval", type=float, default=30.0, help="период опроса источников в режиме --daemon, сек")
+    args = ap.parse_args(argv)
+
     graphs_dir = BASE / "report" / "graphs"
     graphs_dir.mkdir(parents=True, exist_ok=True)
+    lock = graphs_dir / ".graph_builder.lock"
 
-    per_day = defaultdict(int); verify_ok = defaultdict(int); verify_fail = defaultdict(int)
-    s5_day = defaultdict(int)
+    def one(rebuild: bool) -> None:
+        with with_flock(lock, timeout_sec=30):
+            res = build_once(graphs_dir, rebuild=rebuild)
+        print(f"graph_builder done: sources={res['changed_sources']} written={','.join(res['written']) or '-'}")
 
-    for rep in _nodes_report_dirs():
-        _load_csv(rep / "controller_summary.csv", per_day, verify_ok, verify_fail)
-        for p in [rep / "metrics" / "agg_1h.json"]:
-            for day, val in _sum_5xx_per_day(_load_agg_1h(p)).items():
-                s5_day[day] = max(s5_day[day], val)
-
-    (graphs_dir / "ops_per_day.json").write_text(json.dumps(dict(per_day), ensure_ascii=False, sort_keys=True), encoding="utf-8")
-    (graphs_dir / "verify_status.json").write_text(json.dumps({"ok": dict(verify_ok), "fail": dict(verify_fail)}, ensure_ascii=False, sort_keys=True), encoding="utf-8")
-    (graphs_dir / "5xx_per_day.json").write_text(json.dumps(dict(s5_day), ensure_ascii=False, sort_keys=True), encoding="utf-8")
-    print("graph_builder done")
+    if not args.daemon:
+        one(args.rebuild)
+        return 0
+
+    wake = threading.Event(); stop = threading.Event()
+    def _sig_stop(*_): stop.set(); wake.set()
+    signal.signal(signal.SIGINT, _sig_stop)
+    signal.signal(signal.SIGTERM, _sig_stop)
+    signal.signal(signal.SIGHUP, lambda *_: wake.set())
+
+    rebuild = args.rebuild
+    while not stop.is_set():
+        try:
+            one(rebuild)
+            rebuild = False
+        except Exception as e:
+            print(f"graph_builder error: {e}")
+        wake.wait(max(1.0, args.interval))
+        wake.clear()
     return 0
 
 if __name__ == "__main__":
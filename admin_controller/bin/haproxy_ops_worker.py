@@ -45,6 +45,8 @@ def handle_runtime(rt: HAProxyRuntime, backend: str, server: str, op: str, data:
     if op == "enable": return True, rt.set_state(backend, server, "ready")
     if op == "maint":  return True, rt.set_state(backend, server, "maint")
     if op == "weight":
+        if data.get("weight_pct") is not None:
+            return True, rt.set_weight_pct(backend, server, int(data["weight_pct"]))
         w = int(data.get("weight", 0)); return True, rt.set_weight(backend, server, w)
     return False, f"unsupported runtime op: {op}"
 
@@ -46,6 +46,10 @@ class HAProxyRuntime:
     def set_weight(self, backend: str, server: str, weight: int) -> str:
         return self._talk(f"set weight {backend}/{server} {int(weight)}")
 
+    def set_weight_pct(self, backend: str, server: str, pct: int) -> str:
+        # процент от исходного веса из конфига (slow start)
+        return self._talk(f"set weight {backend}/{server} {max(0, min(100, int(pct)))}%")
+
     def get_backends(self) -> list[str]:
         txt = self.show_servers_state()
         res: set[str] = set()
@@ -0,0 +1,310 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+log_index.py — инкрементальный полнотекстовый индекс логов (Py3.11).
+
+Фоновый поток раз в N секунд обходит logs/ и logs/<HOST>/ (node_*.log,
+worker_*.log, dispatcher.log, *.log) и дочитывает только новые строки:
+  - все уникальные токены строки ([a-z0-9_$]{3,64}, без чисто числовых) → posting-списки
+    (array 'Q': file_id << 32 | line_no)
+  - на строку храним смещение в файле и время (из префикса [YYYY-mm-dd HH:MM:SS],
+    строки без времени — стектрейсы — наследуют время предыдущей)
+  - строка длиннее READ_CHUNK без перевода строки режется на куски по READ_CHUNK
+    (иначе offset файла не сдвинулся бы никогда); куски индексируются как строки
+  - ротация (сменился inode / файл усечён) и удаление — файл помечается
+    мёртвым, его постинги отбрасываются при компактификации
+
+Поиск: все токены запроса должны встретиться в строке (по словам, без учёта
+регистра), затем строка перечитывается с диска и проверяется на вхождение
+всей фразы. Результаты — по времени, с контекстом ±ctx строк.
+
+Пример:
+  idx = LogIndex("/tmp/pattern_controller/logs"); idx.start()
+  idx.search("OutOfMemoryError", node="node_97", limit=50)
+"""
+from __future__ import annotations
+
+import os
+import re
+import threading
+import time
+import datetime as dt
+from array import array
+from pathlib import Path
+from typing import Any, Dict, Iterable, List, Optional, Tuple
+
+TOKEN_RX = re.compile(rb"[A-Za-z0-9_$]{3,64}")
+TS_RX = re.compile(rb"^\[?(\d{4}-\d{2}-\d{2})[ T](\d{2}:\d{2}:\d{2})")
+READ_CHUNK = 4 * 1024 * 1024  # порция чтения; lock берётся на порцию, а не на файл
+
+def _is_log_name(name: str) -> bool:
+    return name.endswith(".log")
+
+def _parse_line_ts(line: bytes) -> Optional[float]:
+    m = TS_RX.match(line)
+    if not m:
+        return None
+    try:
+        return time.mktime(time.strptime(f"{m.group(1).decode()} {m.group(2).decode()}", "%Y-%m-%d %H:%M:%S"))
+    except Exception:
+        return None
+
+def parse_when(s: str) -> Optional[float]:
+    """'YYYY-mm-dd', 'YYYY-mm-dd HH:MM[:SS]' или epoch → epoch."""
+    s = (s or "").strip()
+    if not s:
+        return None
+    try:
+        return float(s)
+    except ValueError:
+        pass
+    for fmt in ("%Y-%m-%d %H:%M:%S", "%Y-%m-%dT%H:%M:%S", "%Y-%m-%d %H:%M", "%Y-%m-%d"):
+        try:
+            return dt.datetime.strptime(s, fmt).timestamp()
+        except ValueError:
+            continue
+    return None
+
+def tokenize(data: bytes) -> List[str]:
+    seen: Dict[str, None] = {}
+    for m in TOKEN_RX.finditer(data):
+        tok = m.group(0)
+        if tok.isdigit():
+            continue
+        seen.setdefault(tok.decode("ascii").lower(), None)
+    return list(seen)
+
+class _FileState:
+    __slots__ = ("fid", "path", "host", "node", "ino", "offset", "line_offs", "line_ts", "last_ts", "dead")
+
+    def __init__(self, fid: int, path: str, host: str, node: str, ino: int):
+        self.fid, self.path, self.host, self.node, self.ino = fid, path, host, node, ino
+        self.offset = 0
+        self.line_offs = array("Q")
+        self.line_ts = array("d")
+        self.last_ts = 0.0
+        self.dead = False
+
+def _node_from_name(name: str) -> str:
+    # node_<node>.log / worker_<node>_*.log / worker_<node>.log
+    base = name[:-4] if name.endswith(".log") else name
+    if base.startswith("node_"):
+        return base[len("node_"):]
+    if base.startswith("worker_"):
+        return base[len("worker_"):].split("_", 1)[0]
+    return ""
+
+class LogIndex:
+    def __init__(self, log_root: str, interval_sec: float = 5.0, max_age_days: int = 0):
+        self.root = Path(log_root)
+        self.interval = max(0.5, float(interval_sec))
+        self.max_age_sec = max(0, int(max_age_days)) * 86400
+        self._files: Dict[str, _FileState] = {}
+        self._by_fid: Dict[int, _FileState] = {}
+        self._postings: Dict[str, array] = {}
+        self._next_fid = 1
+        self._dead_lines = 0
+        self._total_lines = 0
+        self._lock = threading.RLock()
+        self._stop = threading.Event()
+        self._thr: Optional[threading.Thread] = None
+        self.last_scan_ts = 0.0
+        self.last_scan_ms = 0.0
+
+    # ---- фон ----
+    def start(self) -> None:
+        if self._thr: return
+        self._thr = threading.Thread(target=self._loop, name="log-index", daemon=True)
+        self._thr.start()
+
+    def stop(self) -> None:
+        self._stop.set()
+
+    def _loop(self) -> None:
+        while not self._stop.is_set():
+            try:
+                self.scan_once()
+            except Exception:
+                pass
+            self._stop.wait(self.interval)
+
+    def _iter_log_files(self) -> Iterable[Tuple[str, str, str]]:
+        """(path, host, name): logs/*.log и logs/<HOST>/*.log"""
+        if not self.root.is_dir():
+            return
+        for entry in os.scandir(self.root):
+            if entry.is_file() and _is_log_name(entry.name):
+                yield entry.path, "", entry.name
+            elif entry.is_dir():
+                try:
+                    for sub in os.scandir(entry.path):
+                        if sub.is_file() and _is_log_name(sub.name):
+                            yield sub.path, entry.name, sub.name
+                except OSError:
+                    continue
+
+    def scan_once(self) -> int:
+        """Один проход: новые файлы, дочитка, ротации. Возвращает число новых строк."""
+        t0 = time.time(); added = 0
+        seen: set[str] = set()
+        for path, host, name in self._iter_log_files():
+            seen.add(path)
+            try:
+                st = os.stat(path)
+            except OSError:
+                continue
+            if self.max_age_sec and st.st_mtime < t0 - self.max_age_sec:
+                continue
+            with self._lock:
+                fs = self._files.get(path)
+                if fs is not None and (fs.ino != st.st_ino or st.st_size < fs.offset):
+                    self._kill(fs); fs = None
+                if fs is None:
+                    fs = _FileState(self._next_fid, path, host, _node_from_name(name), st.st_ino)
+                    self._next_fid += 1
+                    self._files[path] = fs; self._by_fid[fs.fid] = fs
+            if st.st_size > fs.offset:
+                added += self._read_tail(fs)
+        with self._lock:
+            for path in [p for p in self._files if p not in seen]:
+                self._kill(self._files[path])
+            if self._dead_lines and self._dead_lines * 2 > self._total_lines:
+                self._compact()
+        self.last_scan_ts = time.time()
+        self.last_scan_ms = (self.last_scan_ts - t0) * 1000.0
+        return added
+
+    def _read_tail(self, fs: _FileState) -> int:
+        n = 0
+        while True:
+            try:
+                with open(fs.path, "rb") as f:
+                    f.seek(fs.offset)
+                    chunk = f.read(READ_CHUNK)
+            except OSError:
+                return n
+            end = chunk.rfind(b"\n")
+            if end >= 0:
+                body, consumed = chunk[:end], end + 1
+            elif len(chunk) >= READ_CHUNK:
+                body, consumed = chunk, len(chunk)  # строка больше порции — режем принудительно
+            else:
+                return n  # строка ещё не дописана
+            # разбор и токенизация — без lock, вставка — под lock
+            parsed: List[Tuple[int, Optional[float], List[str]]] = []
+            pos = fs.offset
+            for raw in body.split(b"\n"):
+                parsed.append((pos, _parse_line_ts(raw), tokenize(raw)))
+                pos += len(raw) + 1
+            with self._lock:
+                if fs.dead:
+                    return n
+                for off, t, toks in parsed:
+                    line_no = len(fs.line_offs)
+                    if t is not None:
+                        fs.last_ts = t
+                    fs.line_offs.append(off)
+                    fs.line_ts.append(fs.last_ts)
+                    key = (fs.fid << 32) | line_no
+                    for tok in toks:
+                        pl = self._postings.get(tok)
+                        if pl is None:
+                            pl = self._postings[tok] = array("Q")
+                        pl.append(key)
+                fs.offset += consumed
+                self._total_lines += len(parsed)
+            n += len(parsed)
+            if consumed < READ_CHUNK // 2:
+                return n
+
+    def _kill(self, fs: _FileState) -> None:
+        fs.dead = True
+        self._dead_lines += len(fs.line_offs)
+        self._files.pop(fs.path, None)
+
+    def _compact(self) -> None:
+        live = {fid for fid, fs in self._by_fid.items() if not fs.dead}
+        for tok in list(self._postings):
+            pl = array("Q", (k for k in self._postings[tok] if (k >> 32) in live))
+            if pl: self._postings[tok] = pl
+            else: del self._postings[tok]
+        self._by_fid = {fid: fs for fid, fs in self._by_fid.items() if fid in live}
+        self._total_lines -= self._dead_lines
+        self._dead_lines = 0
+
+    # ---- поиск ----
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            return {"files": len(self._files), "lines": self._total_lines - self._dead_lines,
+                    "tokens": len(self._postings), "last_scan_ts": self.last_scan_ts,
+                    "last_scan_ms": round(self.last_scan_ms, 1)}
+
+    def search(self, q: str, node: str = "", t_from: Optional[float] = None, t_to: Optional[float] = None,
+               ctx: int = 2, limit: int = 200) -> Dict[str, Any]:
+        t0 = time.time()
+        phrase = (q or "").strip()
+        toks = tokenize(phrase.encode("utf-8", "ignore"))
+        if not toks:
+            return {"q": phrase, "error": "query must contain a word of 3+ chars", "candidates": 0, "total": 0, "hits": []}
+        ctx = max(0, min(int(ctx), 20)); limit = max(1, min(int(limit), 5000))
+        node = (node or "").strip()
+
+        cands: List[Tuple[float, _FileState, int]] = []
+        with self._lock:
+            lists = [self._postings.get(t) for t in toks]
+            if any(pl is None for pl in lists):
+                return {"q": phrase, "candidates": 0, "total": 0, "hits": [], "took_ms": round((time.time() - t0) * 1000.0, 1)}
+            lists.sort(key=len)
+            keys: Iterable[int] = lists[0]
+            for other in lists[1:4]:
+                s = set(other); keys = [k for k in keys if k in s]
+            for k in keys:
+                fs = self._by_fid.get(k >> 32)
+                if fs is None or fs.dead:
+                    continue
+                if node and node not in (fs.host, fs.node, os.path.basename(fs.path)[:-4]):
+                    continue
+                ln = k & 0xFFFFFFFF
+                t = fs.line_ts[ln]
+                if (t_from is not None and t < t_from) or (t_to is not None and t > t_to):
+                    continue
+                cands.append((t, fs, ln))
+        cands.sort(key=lambda x: (x[0], x[1].path, x[2]))
+
+        hits: List[Dict[str, Any]] = []; truncated = False
+        needle = phrase.lower()
+        by_file: Dict[str, Any] = {}
+        try:
+            for t, fs, ln in cands:
+                fh = by_file.get(fs.path)
+                if fh is None:
+                    try: fh = by_file[fs.path] = open(fs.path, "rb")
+                    except OSError: continue
+                line = self._read_line(fh, fs, ln)
+                if needle not in line.lower():
+                    continue
+                if len(hits) >= limit:
+                    truncated = True; break
+                lo = max(0, ln - ctx); hi = min(len(fs.line_offs) - 1, ln + ctx)
+                hits.append({
+                    "path": fs.path, "host": fs.host, "node": fs.node, "line_no": ln + 1,
+                    "ts": time.strftime("%Y-%m-%d %H:%M:%S", time.localtime(t)) if t else None,
+                    "line": line,
+                    "before": [self._read_line(fh, fs, i) for i in range(lo, ln)],
+                    "after": [self._read_line(fh, fs, i) for i in range(ln + 1, hi + 1)],
+                })
+        finally:
+            for fh in by_file.values():
+                try: fh.close()
+                except Exception: pass
+        return {"q": phrase, "node": node or None, "candidates": len(cands), "total": len(hits),
+                "truncated": truncated, "hits": hits,
+                "first_ts": hits[0]["ts"] if hits else None,
+                "took_ms": round((time.time() - t0) * 1000.0, 1)}
+
+    @staticmethod
+    def _read_line(fh, fs: _FileState, ln: int) -> str:
+        start = fs.line_offs[ln]
+        end = fs.line_offs[ln + 1] if ln + 1 < len(fs.line_offs) else fs.offset
+        fh.seek(start)
+        return fh.read(max(0, end - start)).decode("utf-8", "replace").rstrip("\r\n")
@@ -10,6 +10,7 @@ monitor_35072.py — Py3.11 + path_utils
   - Асинхронная очередь (до 32 воркеров)
   - Автопарсер haproxy.cfg по выбранным backend’ам
   - Вкладки Peers (переключение между точками входа)
+  - Полнотекстовый поиск по логам: /logs/search?q=&node=&from=&to= (фоновый индекс log_index)
 
 Все артефакты строго в /tmp/pattern_controller:
   /tmp/pattern_controller/
@@ -43,6 +44,7 @@ from urllib.parse import urlparse, parse_qs
 
 # ---- единые пути/идентичность
 from path_utils import BASE, HOSTNAME as THIS_HOST, SIGNALS_DIR, LOGS_DIR, REPORT_DIR
+from log_index import LogIndex, parse_when
 
 # ---------- Базовые пути (дефолты можно переопределить флагами) ----------
 DEFAULT_FLAG_DIR = str(SIGNALS_DIR)
@@ -73,6 +75,9 @@ _PARSED_MAP: Dict[str, Dict[str, Any]] = {}
 _PARSED_TS: float = 0.0
 _MAP_LOCK = threading.Lock()
 
+# Индекс логов (создаётся в __main__, если --log-index-interval > 0)
+LOG_INDEX: Optional[LogIndex] = None
+
 HTML_HEAD = """<!doctype html><html><head>
 <meta charset="utf-8"><title>JBoss Monitor</title>
 <style>
@@ -577,6 +582,14 @@ class Handler(BaseHTTPRequestHandler):
         self.end_headers()
         self.wfile.write(data)
 
+    def _write_json(self, obj: Any, code: int = 200) -> None:
+        data = json.dumps(obj, ensure_ascii=False).encode("utf-8")
+        self.send_response(code)
+        self.send_header("Content-Type", "application/json; charset=utf-8")
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
     def _peers_bar(self) -> str:
         if not self.peers: return ""
         buf = ["<div class='peers'><span class='small'>Peers:</span> "]
@@ -629,6 +642,8 @@ class Handler(BaseHTTPRequestHandler):
                 self.handle_node(qs)
             elif path == "/logs":
                 self.handle_logs(qs)
+            elif path == "/logs/search":
+                self.handle_logs_search(qs)
             elif path == "/status":
                 self.handle_status(qs)
             elif path == "/rules":
@@ -769,16 +784,45 @@ class Handler(BaseHTTPRequestHandler):
         html_buf.append(f"<h1>Логи <small>{html.escape(host)}</small> <span class='right'>{self._header_with_rules()}</span></h1>")
         html_buf.append(self._peers_bar())
         html_buf.append("<div class='nav'><a class='btn' href='/'>← Все</a> <a class='btn' href='/queue'>Очередь</a> <a class='btn' href='/rules'>Правила</a></div>")
+        if LOG_INDEX is not None:
+            st = LOG_INDEX.stats()
+            html_buf.append("<div class='card'><div class='hd'>Поиск по логам</div><div class='bd'>"
+                            "<form method='get' action='/logs/search'>"
+                            "<input type='text' name='q' placeholder='OutOfMemoryError'/> "
+                            "<input type='text' name='node' placeholder='нода/хост' size='10'/> "
+                            "<input type='text' name='from' placeholder='с (YYYY-mm-dd HH:MM)' size='16'/> "
+                            "<input type='text' name='to' placeholder='по' size='16'/> "
+                            "<button class='btn' type='submit'>Найти</button></form>"
+                            f"<div class='small'>индекс: файлов {st['files']}, строк {st['lines']}, токенов {st['tokens']}</div>"
+                            "</div></div>")
         html_buf.append("<div class='card'><div class='hd'>Ошибки/диспетчер</div><div class='bd'>")
         files = list_error_logs(self.error_log_dir or "")
         for it in files:
             if q and q not in it["path"]:
                 continue
-            html_buf.append(f"<h3>{html.escape(it['path'])}</h3><div class='mono'>{html.escape('\\n'.join(tail_lines(it['path'], 200)))}</div>")
+            body = "\n".join(tail_lines(it['path'], 200))
+            html_buf.append(f"<h3>{html.escape(it['path'])}</h3><div class='mono'>{html.escape(body)}</div>")
         html_buf.append("</div></div>")
         html_buf.append(HTML_TAIL.format(host=html.escape(host), now=html.escape(ts())))
         self._write_html("".join(html_buf))
 
+    def handle_logs_search(self, qs: Dict[str, List[str]]):
+        if LOG_INDEX is None:
+            self._write_json({"error": "log index disabled (--log-index-interval 0)"}, code=503); return
+        q = (qs.get("q", [""])[0]).strip()
+        if not q:
+            self._write_json({"error": "q required"}, code=400); return
+        try:
+            ctx = int(qs.get("ctx", ["2"])[0]); limit = int(qs.get("limit", ["200"])[0])
+        except ValueError:
+            self._write_json({"error": "ctx/limit must be int"}, code=400); return
+        res = LOG_INDEX.search(q, node=(qs.get("node", [""])[0]),
+                               t_from=parse_when(qs.get("from", [""])[0]),
+                               t_to=parse_when(qs.get("to", [""])[0]),
+                               ctx=ctx, limit=limit)
+        res["index"] = LOG_INDEX.stats()
+        self._write_json(res)
+
     def handle_status(self, qs: Dict[str, List[str]]):
         host = THIS_HOST
         html_buf = [HTML_HEAD]
@@ -990,6 +1034,12 @@ def parse_args(argv: List[str]):
     ap.add_argument("--haproxy-parse-interval", type=int, default=HAPROXY_PARSE_INTERVAL_SEC,
                     help="период пересканирования cfg, сек")
 
+    # Индекс логов
+    ap.add_argument("--log-index-interval", type=float, default=5.0,
+                    help="период дочитки логов в индекс, сек (0 = индекс и /logs/search выключены)")
+    ap.add_argument("--log-index-days", type=int, default=0,
+                    help="индексировать только логи, изменённые за последние N дней (0 = все)")
+
     # Воркеры
     ap.add_argument("--workers", type=int, default=32, help="количество асинхронных воркеров")
 
@@ -1016,6 +1066,12 @@ if __name__ == "__main__":
     # периодический парсер cfg
     schedule_cfg_parser()
 
+    # фоновый индекс логов
+    if args.log_index_interval > 0:
+        LOG_INDEX = LogIndex(args.error_log_dir, interval_sec=args.log_index_interval,
+                             max_age_days=args.log_index_days)
+        LOG_INDEX.start()
+
     # peers
     peers = parse_peers(args.peer_tabs or "", args.port)
 
@@ -7,12 +7,16 @@ policy_auto_drain.py — авто-действия по метрикам/фла
   1) Если для server verify=FAIL (done_<node>.txt) И рост 5xx за 5 минут > --thr-5xx,
      кладём заявки в haproxy_ops: drain + weight=0.
   2) Если затем verify=OK держится --heal-min минут и 5xx за 5 минут < --heal-5xx,
-     возвращаем weight=1 и enable.
+     возвращаем weight=1 и enable; с --ramp вместо weight=1 — заявка weight_ramp
+     (вес поднимается ступенями от 5%, см. weight_ramp.py), но только при живом
+     weight_ramp (свежий heartbeat): иначе сервер остался бы включённым с weight=0.
+     Не удалось поставить заявки — остаёмся в drained и повторяем на следующем запуске.
 """
 
 from __future__ import annotations
 
 import argparse
+import itertools
 import json
 import os
 import time
@@ -24,6 +28,9 @@ DEFAULT_SIGNALS = BASE / "signals"
 DEFAULT_REPORT  = BASE / "report"
 DEFAULT_OPS_Q   = DEFAULT_SIGNALS / "haproxy_ops"
 EVENTS_DIR      = DEFAULT_SIGNALS / "events"
+# заявки одного прогона (weight+enable) пишутся в одну мс: счётчик держит имена
+# уникальными и в порядке постановки (диспетчер сортирует очередь по имени)
+_SEQ = itertools.count()
 
 
 def ensure_dir(p: Path) -> None:
@@ -39,7 +46,7 @@ def emit_event(text: str, severity: str = "info", node: Optional[str] = None) ->
 
 def enqueue_op(qdir: Path, op: str, scope: str, backend: str, server: str, extra: Optional[Dict]=None) -> Tuple[bool, str]:
     ensure_dir(qdir)
-    rid = f"{int(time.time()*1000):08d}"[-8:]
+    rid = f"{int(time.time()*1000):08d}"[-8:] + f"{next(_SEQ) % 1000:03d}"
     tsid = time.strftime("%Y%m%d_%H%M%S", time.localtime())
     payload = {"id": rid, "ts": tsid, "op": op, "scope": scope, "backend": backend, "server": server}
     if extra:
@@ -102,6 +109,7 @@ def main(argv=None) -> int:
     ap.add_argument("--thr-5xx", type=int, default=20)
     ap.add_argument("--heal-5xx", type=int, default=2)
     ap.add_argument("--heal-min", type=int, default=10)
+    ap.add_argument("--ramp", action="store_true", help="возвращать вес плавно (weight_ramp), а не сразу")
     args = ap.parse_args(argv)
 
     agg5_path = Path(args.report_dir) / "metrics" / "agg_5m.json"
@@ -148,10 +156,22 @@ def main(argv=None) -> int:
 
         elif phase == "drained":
             if verify == "OK" and (now_ts - vts) >= (args.heal_min * 60) and sum_5xx < args.heal_5xx:
-                ok1, _ = enqueue_op(qdir, "weight", "runtime", be, srv, {"weight": 1})
+                use_ramp = False
+                if args.ramp:
+                    from weight_ramp import ramp_worker_alive, request_ramp
+                    ramp_dir = flag_dir / "weight_ramp"
+                    if ramp_worker_alive(ramp_dir):
+                        try:
+                            request_ramp(be, srv, "auto_drain", ramp_dir=ramp_dir)
+                            use_ramp = True
+                        except Exception:
+                            pass
+                # без рампы (не просили, weight_ramp молчит, заявка не легла) — weight=1 сразу
+                ok1 = use_ramp or enqueue_op(qdir, "weight", "runtime", be, srv, {"weight": 1})[0]
                 ok2, _ = enqueue_op(qdir, "enable", "runtime", be, srv, {})
-                if ok1 or ok2:
-                    emit_event(f"auto_drain: enable+weight1 {key}", severity="info", node=node)
+                if ok1 and ok2:
+                    emit_event(f"auto_drain: enable+{'ramp' if use_ramp else 'weight1'} {key}",
+                               severity="info", node=node)
                     state[node] = {"phase": "healed", "last": now_ts}
                     changed = True
 
@@ -0,0 +1,169 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+weight_controller.py — адаптивные веса серверов бэкенда по латентности (Py3.11).
+
+policy_auto_drain и RuleEngine действуют бинарно (drain по 5xx); медленная, но
+живая нода (долгий GC) остаётся на полном весе. Контроллер раз в --interval:
+  1) берёт по UP-серверам rtime/ttime/qcur (metrics/last.json коллектора или
+     show stat с --runtime-sock) и сглаживает EWMA (--alpha);
+  2) cost = (rtime + ttime) / 2 × (1 + qcur / --qcur-norm); здоровье сервера —
+     медиана cost по бэкенду / cost сервера;
+  3) целевой вес = здоровье × 100% в границах [--min-pct, 100];
+  4) против колебаний: изменение только если цель отличается от текущего веса
+     больше чем на --deadband п.п., не больше --max-step п.п. за раз и не
+     чаще --min-change-sec на сервер;
+  5) вес меняется заявками в очередь haproxy_ops (op=weight, weight_pct).
+Серверы в slow-start рампе (weight_ramp) и не-UP не трогаются: drain/maint
+управляют весом сами (drain ставит 0), поэтому снятый контроллером вес
+возвращается на 100% только когда сервер снова UP — до этого запись состояния
+сохраняется с пометкой out.
+Состояние — report/<HOST>/weight_controller_state.json.
+"""
+from __future__ import annotations
+
+import argparse
+import json
+import statistics
+import time
+from pathlib import Path
+from typing import Any, Dict
+
+from lock_utils import with_flock
+from path_utils import REPORT_DIR, LOGS_DIR, haproxy_ops_dirs
+from weight_ramp import STATE_FILE as RAMP_STATE_FILE, enqueue_weight, load_rows, to_int
+
+STATE_FILE = REPORT_DIR / "weight_controller_state.json"
+
+class WeightController:
+    def __init__(self, args: argparse.Namespace):
+        self.args = args
+        self.qdir = Path(args.ops_queue)
+        self.state_path = Path(args.state)
+        self.log_path = Path(args.log_dir) / "weight_controller.log"
+        self.backends = {x.strip() for x in args.backends.split(",") if x.strip()}
+        try:
+            self.state: Dict[str, Dict[str, Any]] = json.loads(self.state_path.read_text(encoding="utf-8"))
+        except Exception:
+            self.state = {}
+
+    def log(self, line: str) -> None:
+        self.log_path.parent.mkdir(parents=True, exist_ok=True)
+        with self.log_path.open("a", encoding="utf-8") as f:
+            f.write(time.strftime("[%Y-%m-%d %H:%M:%S] ") + line + "\n")
+
+    def save(self) -> None:
+        self.state_path.parent.mkdir(parents=True, exist_ok=True)
+        tmp = self.state_path.with_suffix(".tmp")
+        tmp.write_text(json.dumps(self.state, ensure_ascii=False, indent=2), encoding="utf-8")
+        tmp.replace(self.state_path)
+
+    def _ramping(self) -> set:
+        try:
+            st = json.loads(Path(self.args.ramp_state).read_text(encoding="utf-8"))
+        except Exception:
+            return set()
+        return {k for k, v in st.items() if v.get("phase") in ("ramping", "held")}
+
+    def tick(self) -> Dict[str, int]:
+        a = self.args
+        rows = load_rows(a.stats_max_age, a.runtime_sock)
+        ramping = self._ramping()
+        now = time.time()
+        changes: Dict[str, int] = {}
+
+        by_be: Dict[str, Dict[str, float]] = {}
+        for key, row in rows.items():
+            be = key.split("/", 1)[0]
+            if self.backends and be not in self.backends:
+                continue
+            if key in ramping:
+                # вес ведёт weight_ramp — наше значение больше не действует
+                self.state.pop(key, None)
+                continue
+            if (row.get("status") or "").upper() != "UP":
+                # не в ротации: вес не трогаем (перебил бы drain weight=0), запись держим до UP
+                if key in self.state:
+                    self.state[key]["out"] = True
+                continue
+            st = self.state.setdefault(key, {"pct": 100, "last_change": 0.0})
+            if st.pop("out", False):
+                # вернулся в ротацию: прежняя EWMA устарела; снятый нами вес — обратно на 100%
+                for f in ("rtime", "ttime", "qcur", "cost", "target"):
+                    st.pop(f, None)
+                if int(st["pct"]) != 100:
+                    self.log(f"{key}: weight {st['pct']}%→100% (release: back UP)")
+                    st["pct"], st["last_change"] = 100, now
+                    changes[key] = 100
+                    if not a.dry_run:
+                        enqueue_weight(self.qdir, be, key.split("/", 1)[1], 100, "weight_controller: release")
+            for f in ("rtime", "ttime", "qcur"):
+                v = float(to_int(row.get(f)))
+                st[f] = v if f not in st else a.alpha * v + (1 - a.alpha) * st[f]
+            cost = max(1.0, (st["rtime"] + st["ttime"]) / 2.0) * (1.0 + st["qcur"] / a.qcur_norm)
+            st["cost"] = round(cost, 2)
+            by_be.setdefault(be, {})[key] = cost
+
+        for be, costs in by_be.items():
+            if len(costs) < a.min_servers:
+                continue  # не с кем сравнивать
+            med = statistics.median(costs.values())
+            for key, cost in costs.items():
+                st = self.state[key]
+                target = max(a.min_pct, min(100, int(round(100.0 * med / cost))))
+                cur = int(st["pct"])
+                st["target"] = target
+                # в мёртвой зоне не дёргаемся, но здоровый сервер возвращаем ровно на 100%
+                if (abs(target - cur) < a.deadband and not (target == 100 and cur != 100)) \
+                        or now - st["last_change"] < a.min_change_sec:
+                    continue
+                new = cur + max(-a.max_step, min(a.max_step, target - cur))
+                st["pct"], st["last_change"] = new, now
+                changes[key] = new
+                srv = key.split("/", 1)[1]
+                self.log(f"{key}: weight {cur}%→{new}% (target={target}% cost={cost:.1f} median={med:.1f})")
+                if not a.dry_run:
+                    enqueue_weight(self.qdir, be, srv, new, f"weight_controller: cost={cost:.0f} med={med:.0f}")
+        self.save()
+        return changes
+
+def main(argv=None) -> int:
+    q, _, _, _ = haproxy_ops_dirs()
+    ap = argparse.ArgumentParser(description="Latency-aware adaptive weight controller (Py3.11)")
+    ap.add_argument("--backends", default="Jboss_client", help="через запятую; пусто — все")
+    ap.add_argument("--ops-queue", default=str(q))
+    ap.add_argument("--state", default=str(STATE_FILE))
+    ap.add_argument("--ramp-state", default=str(RAMP_STATE_FILE))
+    ap.add_argument("--log-dir", default=str(LOGS_DIR))
+    ap.add_argument("--runtime-sock", help="запасной источник статистики, если last.json коллектора устарел")
+    ap.add_argument("--stats-max-age", type=float, default=120.0)
+    ap.add_argument("--alpha", type=float, default=0.3, help="коэффициент EWMA")
+    ap.add_argument("--qcur-norm", type=float, default=10.0, help="очередь, удваивающая cost")
+    ap.add_argument("--min-pct", type=int, default=25)
+    ap.add_argument("--deadband", type=int, default=10, help="п.п.; меньшие отклонения игнорируются")
+    ap.add_argument("--max-step", type=int, default=15, help="п.п. за одно изменение")
+    ap.add_argument("--min-change-sec", type=float, default=60.0)
+    ap.add_argument("--min-servers", type=int, default=3)
+    ap.add_argument("--dry-run", action="store_true")
+    ap.add_argument("--loop", action="store_true")
+    ap.add_argument("--interval", type=float, default=15.0)
+    args = ap.parse_args(argv)
+
+    try:
+        with with_flock(LOGS_DIR / "locks" / "weight_controller.lock", timeout_sec=1.0):
+            wc = WeightController(args)
+            while True:
+                try:
+                    wc.tick()
+                except Exception as e:
+                    wc.log(f"tick error: {e}")
+                if not args.loop:
+                    break
+                time.sleep(args.interval)
+    except TimeoutError:
+        print("weight_controller: another instance is running")
+        return 1
+    return 0
+
+if __name__ == "__main__":
+    raise SystemExit(main())
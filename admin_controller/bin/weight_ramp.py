@@ -0,0 +1,288 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+weight_ramp.py — плавный ввод ноды в нагрузку после рестарта (slow start) (Py3.11).
+
+Холодная JVM на полном весе поднимает p99 по всему бэкенду, поэтому вес
+поднимается ступенями через runtime `set weight <be>/<srv> N%`
+(по умолчанию 5 → 10 → 25 → 50 → 75 → 100% за --duration-sec).
+
+Логика (один тик раз в --interval):
+  1) Заявки signals/weight_ramp/ramp_<backend>_<server>.json (пишут
+     worker_rebooter --ramp, policy_auto_drain --ramp, агент /enable?ramp=1)
+     превращаются в рампы; первая ступень ставится сразу.
+  2) По статистике сервера (metrics/last.json коллектора, если свежий, иначе
+     show stat с --runtime-sock):
+       - сервер не UP (ещё в drain/maint) — таймер ступени не идёт;
+       - прирост hrsp_5xx за тик > --max-5xx — откат на ступень назад
+         и пауза --hold-sec; больше --max-rollbacks откатов — рампа FAIL,
+         вес остаётся минимальным, событие в signals/events;
+       - rtime заметно выше медианы соседей по бэкенду — ступень держим;
+       - иначе по истечении ступени — следующая; на 100% рампа завершена.
+  3) Вес меняется заявками в общую очередь haproxy_ops (op=weight, weight_pct),
+     состояние — report/<HOST>/weight_ramp_state.json.
+  Каждый тик обновляет <ramp-dir>/heartbeat: агент по нему решает, есть ли кому
+  поднимать вес (иначе /enable?ramp=1 ставит сразу 100%).
+"""
+from __future__ import annotations
+
+import argparse
+import json
+import statistics
+import time
+from pathlib import Path
+from typing import Any, Dict, List, Optional
+
+from lock_utils import with_flock
+from path_utils import REPORT_DIR, SIGNALS_DIR, LOGS_DIR, metrics_root, haproxy_ops_dirs
+
+RAMP_DIR   = SIGNALS_DIR / "weight_ramp"
+EVENTS_DIR = SIGNALS_DIR / "events"
+STATE_FILE = REPORT_DIR / "weight_ramp_state.json"
+DEFAULT_STEPS = "5,10,25,50,75,100"
+HEARTBEAT_MAX_AGE_SEC = 60.0  # как ramp.heartbeat_max_age_sec агента
+
+def ensure_dir(p: Path) -> None:
+    p.mkdir(parents=True, exist_ok=True)
+
+def to_int(v: Any, default: int = 0) -> int:
+    try: return int(v)
+    except Exception: return default
+
+def ramp_worker_alive(ramp_dir: Path = RAMP_DIR, max_age_sec: float = HEARTBEAT_MAX_AGE_SEC) -> bool:
+    """Есть ли кому поднимать вес: heartbeat weight_ramp свежее max_age_sec."""
+    try:
+        return time.time() - (ramp_dir / "heartbeat").stat().st_mtime <= max_age_sec
+    except OSError:
+        return False
+
+def request_ramp(backend: str, server: str, source: str, steps: Optional[List[int]] = None,
+                 duration_sec: Optional[int] = None, ramp_dir: Path = RAMP_DIR) -> Path:
+    """Положить заявку на рампу (повторная заявка по тому же серверу заменяет прежнюю)."""
+    ensure_dir(ramp_dir)
+    obj: Dict[str, Any] = {"backend": backend, "server": server, "source": source, "ts": time.time()}
+    if steps:
+        obj["steps"] = [int(x) for x in steps]
+    if duration_sec:
+        obj["duration_sec"] = int(duration_sec)
+    path = ramp_dir / f"ramp_{backend}_{server}.json"
+    tmp = path.with_suffix(".tmp")
+    tmp.write_text(json.dumps(obj, ensure_ascii=False), encoding="utf-8")
+    tmp.replace(path)
+    return path
+
+def emit_event(text: str, severity: str = "info", node: Optional[str] = None, source: str = "weight_ramp") -> None:
+    ensure_dir(EVENTS_DIR)
+    tsid = time.strftime("%Y%m%d_%H%M%S", time.localtime())
+    obj = {"ts": tsid, "severity": severity, "source": source, "node": node, "text": text}
+    (EVENTS_DIR / f"ev_{tsid}_{source}_{node or 'na'}.json").write_text(json.dumps(obj), encoding="utf-8")
+
+def enqueue_op(qdir: Path, op: str, backend: str, server: str, note: str,
+               extra: Optional[Dict[str, Any]] = None) -> bool:
+    """Заявка runtime-операции (drain/enable/weight) в очередь haproxy_ops."""
+    ensure_dir(qdir)
+    rid = f"{int(time.time()*1000):08d}"[-8:]
+    tsid = time.strftime("%Y%m%d_%H%M%S", time.localtime())
+    payload = {"id": rid, "ts": tsid, "op": op, "scope": "runtime", "backend": backend,
+               "server": server, **(extra or {}), "note": note}
+    try:
+        (qdir / f"rq_{tsid}_{backend}_{server}_{rid}.json").write_text(json.dumps(payload), encoding="utf-8")
+        return True
+    except Exception:
+        return False
+
+def enqueue_weight(qdir: Path, backend: str, server: str, pct: int, note: str) -> bool:
+    return enqueue_op(qdir, "weight", backend, server, note, {"weight_pct": int(pct)})
+
+def load_rows(max_age_sec: float, runtime_sock: Optional[str]) -> Dict[str, Dict[str, str]]:
+    """backend/server -> строка show stat: из last.json коллектора или напрямую из сокета."""
+    rows: List[Dict[str, str]] = []
+    last = metrics_root() / "last.json"
+    try:
+        if time.time() - last.stat().st_mtime <= max_age_sec:
+            rows = json.loads(last.read_text(encoding="utf-8")).get("rows") or []
+    except Exception:
+        rows = []
+    if not rows and runtime_sock:
+        from stats_collector_haproxy import read_runtime_csv
+        try:
+            rows = read_runtime_csv(runtime_sock)
+        except Exception:
+            rows = []
+    return {f'{r.get("pxname","")}/{r.get("svname","")}': r for r in rows}
+
+def rtime_regressed(key: str, rows: Dict[str, Dict[str, str]], factor: float, min_ms: int) -> bool:
+    be = key.split("/", 1)[0]
+    cur = to_int(rows[key].get("rtime"))
+    peers = [to_int(r.get("rtime")) for k, r in rows.items()
+             if k != key and k.startswith(be + "/") and (r.get("status") or "").upper() == "UP"
+             and to_int(r.get("rtime")) > 0]
+    if not peers or cur <= 0:
+        return False
+    med = statistics.median(peers)
+    return cur > med * factor and cur - med > min_ms
+
+class Ramper:
+    def __init__(self, args: argparse.Namespace):
+        self.args = args
+        self.qdir = Path(args.ops_queue)
+        self.state_path = Path(args.state)
+        self.log_path = Path(args.log_dir) / "weight_ramp.log"
+        self.steps = [int(x) for x in str(args.steps).split(",") if x.strip()]
+        try:
+            self.state: Dict[str, Dict[str, Any]] = json.loads(self.state_path.read_text(encoding="utf-8"))
+        except Exception:
+            self.state = {}
+
+    def log(self, line: str) -> None:
+        ensure_dir(self.log_path.parent)
+        with self.log_path.open("a", encoding="utf-8") as f:
+            f.write(time.strftime("[%Y-%m-%d %H:%M:%S] ") + line + "\n")
+
+    def save(self) -> None:
+        ensure_dir(self.state_path.parent)
+        tmp = self.state_path.with_suffix(".tmp")
+        tmp.write_text(json.dumps(self.state, ensure_ascii=False, indent=2), encoding="utf-8")
+        tmp.replace(self.state_path)
+
+    def _apply(self, key: str, st: Dict[str, Any], why: str) -> None:
+        be, srv = key.split("/", 1)
+        pct = st["steps"][st["idx"]]
+        enqueue_weight(self.qdir, be, srv, pct, f"weight_ramp: {why}")
+        self.log(f"{key}: weight {pct}% ({why})")
+
+    def ingest(self) -> None:
+        ramp_dir = Path(self.args.ramp_dir)
+        if not ramp_dir.is_dir():
+            return
+        now = time.time()
+        for p in sorted(ramp_dir.glob("ramp_*.json")):
+            try:
+                rq = json.loads(p.read_text(encoding="utf-8"))
+                p.unlink()
+            except Exception:
+                continue
+            key = f'{rq.get("backend","")}/{rq.get("server","")}'
+            steps = [int(x) for x in (rq.get("steps") or self.steps)] or [100]
+            duration = float(rq.get("duration_sec") or self.args.duration_sec)
+            st = {"steps": steps, "idx": 0, "phase": "ramping", "source": rq.get("source", ""),
+                  "started": now, "step_sec": duration / max(1, len(steps) - 1),
+                  "next_at": now + duration / max(1, len(steps) - 1),
+                  "last_5xx": None, "rollbacks": 0, "holds": 0, "updated": now}
+            self.state[key] = st
+            self._apply(key, st, f"start from {st['source'] or 'request'}")
+            emit_event(f"weight_ramp: start {key} {steps[0]}%→{steps[-1]}% over {int(duration)}s",
+                       node=key.split("/", 1)[1])
+
+    def heartbeat(self) -> None:
+        ramp_dir = Path(self.args.ramp_dir)
+        ensure_dir(ramp_dir)
+        tmp = ramp_dir / "heartbeat.tmp"
+        tmp.write_text(str(time.time()), encoding="utf-8")
+        tmp.replace(ramp_dir / "heartbeat")
+
+    def tick(self) -> None:
+        a = self.args
+        self.heartbeat()
+        self.ingest()
+        active = {k: st for k, st in self.state.items() if st["phase"] in ("ramping", "held")}
+        if not active:
+            return
+        rows = load_rows(a.stats_max_age, a.runtime_sock)
+        now = time.time()
+        for key, st in active.items():
+            row = rows.get(key)
+            if row is None:
+                continue
+            node = key.split("/", 1)[1]
+            cur5 = to_int(row.get("hrsp_5xx"))
+            d5 = max(0, cur5 - st["last_5xx"]) if st["last_5xx"] is not None else 0
+            st["last_5xx"] = cur5
+            st["updated"] = now
+
+            if (row.get("status") or "").upper() != "UP":
+                # ещё не в ротации — ступень не расходуется
+                st["next_at"] = max(st["next_at"], now + st["step_sec"] * 0.5)
+                continue
+
+            if d5 > a.max_5xx:
+                st["rollbacks"] += 1
+                if st["rollbacks"] > a.max_rollbacks:
+                    st["phase"] = "failed"
+                    st["idx"] = 0
+                    self._apply(key, st, f"failed: 5xx +{d5}")
+                    emit_event(f"weight_ramp: FAIL {key} after {st['rollbacks']-1} rollbacks (5xx +{d5})",
+                               severity="warn", node=node)
+                    continue
+                st["idx"] = max(0, st["idx"] - 1)
+                st["phase"] = "held"
+                st["next_at"] = now + a.hold_sec
+                self._apply(key, st, f"rollback: 5xx +{d5}")
+                emit_event(f"weight_ramp: rollback {key} to {st['steps'][st['idx']]}% (5xx +{d5})",
+                           severity="warn", node=node)
+                continue
+
+            if rtime_regressed(key, rows, a.rtime_factor, a.rtime_min_ms):
+                # латентность хуже соседей — держим текущую ступень
+                if st["phase"] != "held":
+                    self.log(f"{key}: hold at {st['steps'][st['idx']]}% (rtime={row.get('rtime')})")
+                st["phase"] = "held"
+                st["holds"] += 1
+                st["next_at"] = max(st["next_at"], now + a.interval)
+                continue
+
+            st["phase"] = "ramping"
+            if now >= st["next_at"]:
+                st["idx"] += 1
+                st["next_at"] = now + st["step_sec"]
+                if st["idx"] >= len(st["steps"]) - 1:
+                    st["idx"] = len(st["steps"]) - 1
+                    st["phase"] = "done"
+                self._apply(key, st, "step" if st["phase"] != "done" else "done")
+                if st["phase"] == "done":
+                    emit_event(f"weight_ramp: done {key} in {int(now - st['started'])}s", node=node)
+
+        # завершённые храним сутки — для истории
+        for k in [k for k, st in self.state.items()
+                  if st["phase"] in ("done", "failed") and now - st["updated"] > 86400]:
+            del self.state[k]
+        self.save()
+
+def main(argv=None) -> int:
+    q, _, _, _ = haproxy_ops_dirs()
+    ap = argparse.ArgumentParser(description="Slow-start weight ramp (Py3.11)")
+    ap.add_argument("--ramp-dir", default=str(RAMP_DIR))
+    ap.add_argument("--ops-queue", default=str(q))
+    ap.add_argument("--state", default=str(STATE_FILE))
+    ap.add_argument("--log-dir", default=str(LOGS_DIR))
+    ap.add_argument("--runtime-sock", help="запасной источник статистики, если last.json коллектора устарел")
+    ap.add_argument("--stats-max-age", type=float, default=120.0)
+    ap.add_argument("--steps", default=DEFAULT_STEPS, help="ступени веса, %% от исходного")
+    ap.add_argument("--duration-sec", type=int, default=600, help="время от первой до последней ступени")
+    ap.add_argument("--max-5xx", type=int, default=5, help="прирост hrsp_5xx за тик, выше — откат")
+    ap.add_argument("--max-rollbacks", type=int, default=3)
+    ap.add_argument("--hold-sec", type=int, default=120, help="пауза после отката")
+    ap.add_argument("--rtime-factor", type=float, default=1.5)
+    ap.add_argument("--rtime-min-ms", type=int, default=50)
+    ap.add_argument("--loop", action="store_true")
+    ap.add_argument("--interval", type=float, default=10.0)
+    args = ap.parse_args(argv)
+
+    try:
+        with with_flock(LOGS_DIR / "locks" / "weight_ramp.lock", timeout_sec=1.0):
+            r = Ramper(args)
+            while True:
+                try:
+                    r.tick()
+                except Exception as e:
+                    r.log(f"tick error: {e}")
+                if not args.loop:
+                    break
+                time.sleep(args.interval)
+    except TimeoutError:
+        print("weight_ramp: another instance is running")
+        return 1
+    return 0
+
+if __name__ == "__main__":
+    raise SystemExit(main())
@@ -8,9 +8,12 @@ worker_rebooter.py — локальный воркер перезапуска у
       1) выполнить --pre-cmd (опционально)
       2) выполнить --restart-cmd (обязательно)
       3) ждать health (tcp-порт и/или HTTP-URL)
+      3a) опционально — прогрев JVM (--warmup-*): параллельные GET-запросы к
+          локальному JBoss, пока p90 не опустится ниже порога или не кончится бюджет
       4) выполнить --post-cmd (опционально)
       5) записать signals/done_<node>.txt с verify=OK|FAIL
       6) убрать restart_*.txt (идемпотентно)
+      7) с --ramp и verify=OK — заявка weight_ramp (вес поднимается ступенями)
   - Пишет логи в /tmp/pattern_controller/logs/<HOST>/worker_<node>.log
   - Добавляет строку в /tmp/pattern_controller/report/<HOST>/controller_summary.csv
 """
@@ -18,17 +21,22 @@ worker_rebooter.py — локальный воркер перезапуска у
 from __future__ import annotations
 
 import argparse
+import collections
 import csv
 import datetime as dt
 import http.client
 import os
+import random
+import re
 import shlex
 import socket
 import subprocess
 import sys
+import threading
 import time
+from concurrent.futures import ThreadPoolExecutor
 from pathlib import Path
-from typing import Optional
+from typing import Dict, List, Optional, Tuple
 
 # Единая точка путей/идентичности
 from path_utils import SIGNALS_DIR, REPORT_DIR, LOGS_DIR, HOSTNAME
@@ -142,6 +150,122 @@ def http_health(url: str, timeout: float, log_fh=None) -> bool:
     _log_write(log_fh, f"[{ts()}] http_health FAIL: {url} after {timeout}s")
     return False
 
+# ---------- warm-up ----------
+_ACCESS_RE = re.compile(r'"GET (\S+) HTTP/[\d.]+"')
+
+def _parse_warmup_spec(spec: str) -> List[Tuple[str, int]]:
+    """
+    --warmup-urls → [(path, weight)]. Вес — только числовой суффикс после последнего "=":
+    "/q?a=b" — путь целиком с весом 1, "/q?a=b=3" — вес 3. В файле вес — второе поле
+    через пробел. ValueError — путь не с "/" или файл не читается.
+    """
+    pairs: List[Tuple[str, str]] = []
+    if spec.startswith("@"):
+        for ln in Path(spec[1:]).read_text(encoding="utf-8").splitlines():
+            f = ln.split()
+            if f and not f[0].startswith("#"):
+                pairs.append((f[0], f[1] if len(f) > 1 else ""))
+    else:
+        for it in (x.strip() for x in spec.split(",")):
+            if not it:
+                continue
+            path, _, w = it.rpartition("=")
+            pairs.append((path, w) if path and w.isdigit() else (it, ""))
+    out = []
+    for path, w in pairs:
+        if not path.startswith("/"):
+            raise ValueError(f"warmup path must start with '/': {path!r}")
+        out.append((path, max(1, int(w)) if w.isdigit() else 1))
+    return out
+
+def _warmup_spec_arg(spec: str) -> str:
+    # проверка --warmup-urls при разборе аргументов, а не после рестарта
+    try:
+        _parse_warmup_spec(spec)
+    except (OSError, ValueError) as e:
+        raise argparse.ArgumentTypeError(str(e))
+    return spec
+
+def warmup_targets(spec: Optional[str], access_log: Optional[str], top: int = 50) -> List[Tuple[str, int]]:
+    """
+    [(path, weight)]: из --warmup-urls ("/a=5,/b,/c=2"; файл @path — по строке "path [weight]")
+    и/или top-N самых частых GET-путей из хвоста access-лога.
+    """
+    out: Dict[str, int] = {}
+    for path, w in (_parse_warmup_spec(spec) if spec else []):
+        out[path] = out.get(path, 0) + w
+    if access_log:
+        try:
+            with open(access_log, "rb") as f:
+                f.seek(0, os.SEEK_END)
+                f.seek(max(0, f.tell() - 512 * 1024))
+                tail = f.read().decode("utf-8", "replace")
+            cnt = collections.Counter(m.group(1) for m in _ACCESS_RE.finditer(tail))
+            for path, n in cnt.most_common(top):
+                out[path] = out.get(path, 0) + n
+        except Exception:
+            pass
+    return sorted(out.items(), key=lambda kv: -kv[1])
+
+def _pct(vals: List[float], q: float) -> float:
+    s = sorted(vals)
+    return s[min(len(s) - 1, int(q * len(s)))] if s else 0.0
+
+def warmup(base_url: str, targets: List[Tuple[str, int]], concurrency: int, round_size: int,
+           p90_ms: float, settle_rounds: int, budget_sec: float, log_fh=None) -> Dict[str, object]:
+    """
+    Раунды по round_size запросов (выбор пути по весам) в concurrency потоков,
+    keep-alive соединение на поток. Стоп: p90 раунда <= p90_ms settle_rounds раз
+    подряд (settled) либо истёк budget_sec (budget). Кривая p50/p90 — в лог воркера.
+    """
+    rest = base_url[7:] if base_url.startswith("http://") else base_url
+    hostport = rest.split("/", 1)[0]
+    host, _, port_s = hostport.partition(":")
+    port = int(port_s or "80")
+    paths = [p for p, _ in targets]
+    weights = [w for _, w in targets]
+    local = threading.local()
+
+    def one(path: str) -> Tuple[float, int]:
+        t0 = time.monotonic()
+        for _ in range(2):
+            conn = getattr(local, "conn", None)
+            if conn is None:
+                conn = local.conn = http.client.HTTPConnection(host, port, timeout=10.0)
+            try:
+                conn.request("GET", path)
+                resp = conn.getresponse()
+                resp.read()
+                return (time.monotonic() - t0) * 1000.0, resp.status
+            except Exception:
+                conn.close()
+                local.conn = None
+        return (time.monotonic() - t0) * 1000.0, 0
+
+    start = time.time()
+    curve: List[Dict[str, float]] = []
+    good = 0
+    result = "budget"
+    with ThreadPoolExecutor(max_workers=max(1, concurrency)) as ex:
+        while time.time() - start < budget_sec:
+            batch = random.choices(paths, weights=weights, k=max(1, round_size))
+            res = list(ex.map(one, batch))
+            lat = [ms for ms, _ in res]
+            errs = sum(1 for _, st in res if st == 0 or st >= 500)
+            pt = {"t": round(time.time() - start, 1), "p50": round(_pct(lat, 0.5), 1),
+                  "p90": round(_pct(lat, 0.9), 1), "errors": errs}
+            curve.append(pt)
+            _log_write(log_fh, f"[{ts()}] warmup round={len(curve)} t={pt['t']}s p50={pt['p50']}ms "
+                               f"p90={pt['p90']}ms errors={errs}/{len(res)}")
+            good = good + 1 if (pt["p90"] <= p90_ms and errs == 0) else 0
+            if good >= settle_rounds:
+                result = "settled"
+                break
+    spent = round(time.time() - start, 1)
+    _log_write(log_fh, f"[{ts()}] warmup {result} in {spent}s rounds={len(curve)} "
+                       f"p90 {curve[0]['p90'] if curve else '-'}→{curve[-1]['p90'] if curve else '-'}ms")
+    return {"result": result, "spent_sec": spent, "rounds": len(curve), "curve": curve}
+
 # ---------- CSV summary ----------
 HEAD = ["timestamp","host","node","phase","severity","action","result","note","op_log","logfile","line_snippet"]
 
@@ -172,6 +296,20 @@ def main(argv=None) -> int:
     ap.add_argument("--health-tcp", help="формат host:port")
     ap.add_argument("--health-http", help="формат http://host:port/path")
     ap.add_argument("--health-timeout", type=int, default=300)
+    ap.add_argument("--warmup-base", help="прогрев: http://127.0.0.1:8080 (без него прогрева нет)")
+    ap.add_argument("--warmup-urls", type=_warmup_spec_arg,
+                    help='пути с весами: "/a=5,/b,/c=2" (вес — числовой суффикс после последнего "=") '
+                         'или @файл ("path weight" по строке)')
+    ap.add_argument("--warmup-access-log", help="добавить top-N GET-путей из хвоста access-лога")
+    ap.add_argument("--warmup-concurrency", type=int, default=8)
+    ap.add_argument("--warmup-round", type=int, default=40, help="запросов в раунде")
+    ap.add_argument("--warmup-p90-ms", type=float, default=300.0, help="порог p90 раунда")
+    ap.add_argument("--warmup-settle-rounds", type=int, default=3, help="раундов подряд ниже порога")
+    ap.add_argument("--warmup-budget-sec", type=int, default=180)
+    ap.add_argument("--ramp", action="store_true", help="после успешного рестарта — плавный ввод веса (weight_ramp)")
+    ap.add_argument("--ramp-backend", default="Jboss_client")
+    ap.add_argument("--ramp-server", help="имя server в HAProxy (по умолчанию = --node)")
+    ap.add_argument("--ramp-duration-sec", type=int)
     args = ap.parse_args(argv)
 
     sig_dir = Path(args.signals); sig_dir.mkdir(parents=True, exist_ok=True)
@@ -203,12 +341,29 @@ def main(argv=None) -> int:
         if args.health_http:
             ok = ok and http_health(args.health_http, float(args.health_timeout), log_fh=lf)
 
+        # 3a) warm-up: только на живой ноде; результат (и ошибка) не влияет на verify и done-флаг
+        wu_note = ""
+        if ok and rc_restart == 0 and args.warmup_base:
+            try:
+                targets = warmup_targets(args.warmup_urls, args.warmup_access_log)
+                if targets:
+                    wu = warmup(args.warmup_base, targets, args.warmup_concurrency, args.warmup_round,
+                                args.warmup_p90_ms, args.warmup_settle_rounds, float(args.warmup_budget_sec), log_fh=lf)
+                    curve = wu["curve"]
+                    wu_note = (f"; warmup={wu['result']} {wu['spent_sec']}s rounds={wu['rounds']}"
+                               f" p90={curve[0]['p90'] if curve else '-'}->{curve[-1]['p90'] if curve else '-'}ms")
+                else:
+                    _log_write(lf, f"[{ts()}] warmup skipped: no targets")
+            except Exception as e:
+                _log_write(lf, f"[{ts()}] warmup error: {type(e).__name__}: {e}")
+                wu_note = "; warmup=error"
+
         # 4) post
         rc_post = sh(args.post_cmd, timeout=120, log_fh=lf) if args.post_cmd else 0
 
         # 5) done + summary
         verify = "OK" if (ok and rc_restart == 0) else "FAIL"
-        note = f"verify={verify}; rc_pre={rc_pre}; rc_restart={rc_restart}; rc_post={rc_post}"
+        note = f"verify={verify}; rc_pre={rc_pre}; rc_restart={rc_restart}; rc_post={rc_post}{wu_note}"
         f_done.write_text(
             f"ts={ts()}\nnode={args.node}\nverify={verify}\n",
             encoding="utf-8",
@@ -221,6 +376,13 @@ def main(argv=None) -> int:
         except Exception:
             pass
 
+        # 7) slow start: холодную JVM вводим в нагрузку ступенями
+        if args.ramp and verify == "OK":
+            from weight_ramp import request_ramp
+            rp = request_ramp(args.ramp_backend, args.ramp_server or args.node, "worker_rebooter",
+                              duration_sec=args.ramp_duration_sec, ramp_dir=sig_dir / "weight_ramp")
+            _log_write(lf, f"[{ts()}] weight_ramp requested: {rp}")
+
         _log_write(lf, f"[{ts()}] === worker_rebooter end node={args.node} result={verify}")
 
     return 0
@@ -1,8 +1,13 @@
 #!/usr/bin/env python3
 # -*- coding: utf-8 -*-
-import os, time, hmac, hashlib, threading
+import os, time, hmac, hashlib
 from typing import Optional, Tuple
 
+try:
+    from controller.shared_state import get_state
+except ImportError:  # запуск файлом из каталога controller/
+    from shared_state import get_state
+
 # Секрет берём из TOGGLE_SECRET или из файла (systemd credentials)
 def _load_secret() -> str:
     path = os.environ.get("TOGGLE_SECRET_FILE")
@@ -14,8 +19,6 @@ def _load_secret() -> str:
 
 _SECRET = _load_secret()
 _NONCE_TTL = int(os.environ.get("SIG_TTL_SEC", "60"))
-_nonce_cache = {}
-_lock = threading.Lock()
 
 def set_secret_for_tests(value: str):
     global _SECRET
@@ -37,17 +40,12 @@ def _parse_sig_header(hv: str) -> Optional[Tuple[str,str,str]]:
     if not (ts and nonce and sig): return None
     return ts, nonce, sig
 
-def _check_replay_and_store(nonce: str, now: int) -> bool:
-    # простая in-mem защита от повторов по nonce с TTL
-    with _lock:
-        # cleanup
-        to_del = [k for k,v in _nonce_cache.items() if v < now - _NONCE_TTL]
-        for k in to_del:
-            _nonce_cache.pop(k, None)
-        if nonce in _nonce_cache:
-            return False
-        _nonce_cache[nonce] = now
-        return True
+def _check_replay_and_store(nonce: str, ts: int, now: int) -> bool:
+    # защита от повторов по nonce; в --workers N набор nonce общий (shared_state).
+    # Подпись принимается до ts + _NONCE_TTL (ts может быть и в будущем) — nonce
+    # хранится до того же момента, иначе повтор прошёл бы после его вытеснения
+    ttl = ts + _NONCE_TTL - now + 1
+    return get_state().put_if_absent("nonce:" + nonce, ttl, now) is None
 
 class AuthError(Exception): pass
 
@@ -57,7 +55,9 @@ def verify_request(method: str, path_qs: str, body: bytes, headers: dict):
       1) Разрешаем простой токен: X-Auth-Token == TOGGLE_SECRET  ИЛИ ?secret=...
       2) Или HMAC: X-Signature: v=1;ts=...;nonce=...;sig=...
          - |now - ts| <= SIG_TTL_SEC (60 по умолчанию)
-         - nonce не использовался ранее (in-mem)
+         - подпись верна, и только потом — nonce не использовался ранее (shared_state:
+           память процесса или master'а); неподписанный мусор не занимает место под nonce
+      Хранилище nonce заполнено — shared_state.StateFull (сервер отвечает 503).
     """
     # 1) Простой токен
     if _SECRET:
@@ -85,9 +85,8 @@ def verify_request(method: str, path_qs: str, body: bytes, headers: dict):
     now = int(time.time())
     if abs(now - ts) > _NONCE_TTL:
         raise AuthError("ts out of window")
-    if not _check_replay_and_store(nonce, now):
-        raise AuthError("replay detected")
-
     expected = sign_v1(method, path_qs, ts_str, nonce, body)
     if not hmac.compare_digest(expected, sig):
         raise AuthError("invalid signature")
+    if not _check_replay_and_store(nonce, ts, now):
+        raise AuthError("replay detected")
@@ -0,0 +1,154 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Оценка нагрузки на оставшиеся серверы перед drain/disable (для safe_toggle).
+
+Статический min_enabled не знает о нагрузке: в пик снять 6-й сервер из 6 опасно,
+ночью можно опуститься до 2. Здесь по строкам show stat бэкенда считается,
+какая нагрузка придётся на сервер после снятия одного:
+  conc = (Σscur + Σqcur + qcur бэкенда) / (n - 1)    — одновременные сессии
+  rate = Σrate / (n - 1)                              — новые сессии в секунду
+и утилизация = max(conc / capacity.scur, rate / capacity.rate).
+
+Ёмкость сервера (по приоритету):
+  - rules.json / clusters.json: "capacity": {"scur": N, "rate": N};
+  - slim сервера (maxconn) — для scur;
+  - выученная: квантиль "learn_quantile" (0.95) scur на сервер без очереди (qcur=0)
+    × "learn_headroom" (1.5) — report/capacity_learned.json. Не пик: по пику
+    утилизация в пик всегда выше max_util, и снятие в пик запрещалось бы всегда.
+    Квантиль — потоковая оценка на сетке уровней ×LEARN_GRID: наблюдение выше оценки
+    поднимает её на уровень с вероятностью LEARN_MOVE·p, ниже — опускает с
+    вероятностью LEARN_MOVE·(1-p) (равновесие — ровно на квантиле p). В файле одно
+    число, и он переписывается только при смене уровня, а не на каждой проверке.
+Лимит утилизации — "max_util" (по умолчанию 0.8). Без известной ёмкости
+проверка не ограничивает (остаётся только min_enabled).
+"""
+from __future__ import annotations
+
+import json
+import os
+import random
+import time
+from pathlib import Path
+from typing import Any, Dict, List, Optional, Tuple
+
+DEFAULT_MAX_UTIL = 0.8
+DEFAULT_LEARN_QUANTILE = 0.95
+DEFAULT_LEARN_HEADROOM = 1.5
+# сетка потокового квантиля (+10% на уровень) и доля наблюдений, сдвигающих оценку
+LEARN_GRID = 1.1
+LEARN_MOVE = 0.2
+
+def _f(v: Any) -> float:
+    try: return float(v or 0)
+    except Exception: return 0.0
+
+def is_enabled(row: Dict[str, str]) -> bool:
+    status = (row.get("status") or "").upper()
+    admin  = (row.get("admin")  or "").upper()
+    return status in ("UP", "OPEN") and "MAINT" not in admin
+
+def capacity_conf(rules: Dict[str, Any], backend: str, cluster_conf: Optional[Dict[str, Any]] = None) -> Dict[str, Any]:
+    """max_util, capacity и параметры обучения: кластер (clusters.json) → rules.backends → rules.global."""
+    g = rules.get("global", {}) or {}
+    be = (rules.get("backends", {}) or {}).get(backend, {}) or {}
+    cc = cluster_conf or {}
+    cap = dict(g.get("capacity") or {})
+    cap.update(be.get("capacity") or {})
+    cap.update(cc.get("capacity") or {})
+
+    def opt(name: str, default: float) -> float:
+        return float(cc.get(name, be.get(name, g.get(name, default))))
+
+    return {"max_util": opt("max_util", DEFAULT_MAX_UTIL), "scur": _f(cap.get("scur")), "rate": _f(cap.get("rate")),
+            "learn_quantile": opt("learn_quantile", DEFAULT_LEARN_QUANTILE),
+            "learn_headroom": opt("learn_headroom", DEFAULT_LEARN_HEADROOM)}
+
+def learn(rows: List[Dict[str, str]], backend: str, path: Path,
+          conf: Optional[Dict[str, Any]] = None) -> Dict[str, float]:
+    """
+    Обновить выученную ёмкость по текущему снимку; вернуть {"scur": q × headroom, "q": ..., "ts": ...}.
+    q — потоковый квантиль scur серверов без очереди; запись в файл — только при смене
+    уровня q (проверка на каждый toggle файл не переписывает).
+    """
+    conf = conf or {}
+    p = float(conf.get("learn_quantile", DEFAULT_LEARN_QUANTILE))
+    headroom = float(conf.get("learn_headroom", DEFAULT_LEARN_HEADROOM))
+    try:
+        data = json.loads(path.read_text(encoding="utf-8"))
+    except Exception:
+        data = {}
+    stored = data.get(backend) or {}
+    q = stored.get("q")
+    for r in rows:
+        if r.get("svname") == "BACKEND" or not is_enabled(r) or _f(r.get("qcur")) != 0:
+            continue
+        x = _f(r.get("scur"))
+        if q is None:
+            q = max(1.0, x)
+        elif x > q and random.random() < LEARN_MOVE * p:
+            q = q * LEARN_GRID
+        elif x < q and random.random() < LEARN_MOVE * (1 - p):
+            q = max(1.0, q / LEARN_GRID)
+    if q is None:
+        return {}
+    cur = {"q": round(q, 2), "ts": stored.get("ts", time.time())}
+    if stored.get("q") != cur["q"]:
+        cur["ts"] = time.time()
+        data[backend] = cur
+        try:
+            path.parent.mkdir(parents=True, exist_ok=True)
+            tmp = path.with_suffix(".tmp")
+            tmp.write_text(json.dumps(data), encoding="utf-8")
+            os.replace(tmp, path)
+        except Exception:
+            pass
+    return {"scur": round(cur["q"] * headroom, 1), **cur}
+
+def project(rows: List[Dict[str, str]], server: str, conf: Dict[str, Any],
+            learned: Optional[Dict[str, float]] = None) -> Tuple[bool, str, Dict[str, Any]]:
+    """
+    (ok, reason, info): можно ли снять server, не превысив max_util на оставшихся.
+    rows — строки show stat бэкенда (серверы и, если есть, BACKEND).
+    """
+    servers = [r for r in rows if r.get("svname") not in ("BACKEND", "FRONTEND", "")]
+    be_row = next((r for r in rows if r.get("svname") == "BACKEND"), {})
+    active = [r for r in servers if is_enabled(r)]
+    left = len(active) - (1 if any(r.get("svname") == server for r in active) else 0)
+
+    conc = sum(_f(r.get("scur")) + _f(r.get("qcur")) for r in active) + _f(be_row.get("qcur"))
+    rate = sum(_f(r.get("rate")) for r in active)
+
+    cap_scur = conf.get("scur") or 0.0
+    src = "conf"
+    if not cap_scur:
+        slims = [_f(r.get("slim")) for r in active if _f(r.get("slim")) > 0]
+        if slims:
+            cap_scur, src = min(slims), "slim"
+        elif learned and learned.get("scur"):
+            cap_scur, src = float(learned["scur"]), "learned"
+    cap_rate = conf.get("rate") or 0.0
+
+    info: Dict[str, Any] = {"left": left, "conc": round(conc, 1), "rate": round(rate, 1),
+                            "cap_scur": round(cap_scur, 1), "cap_rate": cap_rate, "cap_src": src,
+                            "max_util": conf["max_util"]}
+    if left <= 0:
+        info["util"] = float("inf")
+        return False, f"util=inf (no servers left) {_fmt(info)}", info
+    utils = []
+    if cap_scur > 0:
+        utils.append(conc / left / cap_scur)
+    if cap_rate > 0:
+        utils.append(rate / left / cap_rate)
+    if not utils:
+        info["util"] = None
+        return True, "capacity unknown", info
+    util = max(utils)
+    info["util"] = round(util, 3)
+    if util > conf["max_util"]:
+        return False, f"util={util:.2f}>{conf['max_util']:.2f} {_fmt(info)}", info
+    return True, f"util={util:.2f}", info
+
+def _fmt(info: Dict[str, Any]) -> str:
+    return (f"(left={info['left']} conc={info['conc']} rate={info['rate']} "
+            f"cap_scur={info['cap_scur']}[{info['cap_src']}] cap_rate={info['cap_rate']})")
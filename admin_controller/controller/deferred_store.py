@@ -0,0 +1,136 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Очередь отложенных операций (deferred.csv / deferred_all.csv) с ключом (группа, server, action).
+
+Раньше каждая отказанная операция дописывала новую строку — за долгий инцидент
+один и тот же drain набирался сотнями. Здесь строка на ключ одна:
+  ts        — когда операция впервые отложена
+  reason    — последняя причина отказа
+  attempts  — сколько раз операция была отклонена (постановка + неудачные retry)
+  last_ts   — время последней попытки
+  errors    — ошибок применения подряд (reason "error: ..."): отказ по min_enabled —
+              повод ждать, ошибка сокета/команды — нет; после DEFERRED_MAX_ERRORS (3)
+              подряд строка снимается из очереди, settle() отдаёт её вызывающему для лога
+Операция противоположного направления для того же сервера (enable против
+drain/disable) вытесняет отложенную: выполняется последнее намерение.
+Группа — "cluster" для guarded_toggle и "backend" для safe_haproxy_toggle.
+Файл пишется целиком через temp+rename под fcntl-локом <файл>.lock; старые файлы
+(без attempts/last_ts, с дублями) читаются и схлопываются.
+"""
+from __future__ import annotations
+
+import contextlib
+import csv
+import fcntl
+import os
+import tempfile
+import time
+from pathlib import Path
+from typing import Dict, Iterable, Iterator, List, Tuple
+
+Key = Tuple[str, str, str]  # (group, server, action)
+MAX_ERRORS = int(os.environ.get("DEFERRED_MAX_ERRORS", "3"))
+
+def _opposite(a: str, b: str) -> bool:
+    return (a == "enable") != (b == "enable")
+
+class DeferredStore:
+    def __init__(self, path: Path, group_field: str = "cluster"):
+        self.path = Path(path)
+        self.group_field = group_field
+        self.fields = ["ts", "action", group_field, "server", "reason", "attempts", "last_ts", "errors"]
+
+    def key(self, row: Dict[str, str]) -> Key:
+        return (row.get(self.group_field, ""), row.get("server", ""), row.get("action", ""))
+
+    @contextlib.contextmanager
+    def _locked(self) -> Iterator[None]:
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        with open(self.path.with_suffix(".lock"), "w") as f:
+            fcntl.flock(f.fileno(), fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(f.fileno(), fcntl.LOCK_UN)
+
+    def _read(self) -> Dict[Key, Dict[str, str]]:
+        rows: Dict[Key, Dict[str, str]] = {}
+        try:
+            with self.path.open("r", encoding="utf-8", newline="") as f:
+                for r in csv.DictReader(f, delimiter=';'):
+                    k = self.key(r)
+                    r["attempts"] = str(int(r.get("attempts") or 1))
+                    r["last_ts"] = r.get("last_ts") or r.get("ts", "")
+                    r["errors"] = str(int(r.get("errors") or 0))
+                    if k in rows:  # дубли из старого формата
+                        old = rows[k]
+                        r["ts"] = old["ts"]
+                        r["attempts"] = str(int(old["attempts"]) + int(r["attempts"]))
+                    rows[k] = r
+        except FileNotFoundError:
+            pass
+        return rows
+
+    def _write(self, rows: Dict[Key, Dict[str, str]]) -> None:
+        if not rows:
+            with contextlib.suppress(FileNotFoundError):
+                self.path.unlink()
+            return
+        with tempfile.NamedTemporaryFile("w", delete=False, encoding="utf-8", newline="",
+                                         dir=str(self.path.parent)) as tf:
+            w = csv.DictWriter(tf, fieldnames=self.fields, delimiter=';', extrasaction="ignore")
+            w.writeheader()
+            for r in rows.values():
+                w.writerow(r)
+        os.replace(tf.name, self.path)
+
+    def load(self) -> Dict[Key, Dict[str, str]]:
+        """Снимок очереди: {(group, server, action): row}."""
+        with self._locked():
+            return self._read()
+
+    def add_many(self, items: Iterable[Tuple[str, str, str, str]]) -> None:
+        """items: (action, group, server, reason) — upsert по ключу, attempts += 1."""
+        now = time.strftime("%Y-%m-%d %H:%M:%S")
+        with self._locked():
+            rows = self._read()
+            for action, group, server, reason in items:
+                for k in [k for k in rows if k[0] == group and k[1] == server and _opposite(k[2], action)]:
+                    rows.pop(k)
+                k = (group, server, action)
+                r = rows.get(k)
+                if r is None:
+                    rows[k] = {"ts": now, "action": action, self.group_field: group, "server": server,
+                               "reason": reason, "attempts": "1", "last_ts": now, "errors": "0"}
+                else:
+                    r.update(reason=reason, last_ts=now, attempts=str(int(r["attempts"]) + 1))
+            self._write(rows)
+
+    def add(self, action: str, group: str, server: str, reason: str) -> None:
+        self.add_many([(action, group, server, reason)])
+
+    def settle(self, done: Iterable[Key], failed: Dict[Key, str],
+               max_errors: int = MAX_ERRORS) -> Tuple[int, List[Dict[str, str]]]:
+        """
+        Итог прохода retry: выполненные — убрать, отклонённые — обновить reason/attempts
+        на месте; reason "error: ..." max_errors раз подряд — снять строку. Ключи,
+        исчезнувшие за время прохода (вытеснены другим намерением), не возвращаются.
+        Возвращает (размер очереди, снятые по ошибкам строки).
+        """
+        now = time.strftime("%Y-%m-%d %H:%M:%S")
+        dropped: List[Dict[str, str]] = []
+        with self._locked():
+            rows = self._read()
+            for k in done:
+                rows.pop(k, None)
+            for k, reason in failed.items():
+                r = rows.get(k)
+                if r is None:
+                    continue
+                errors = int(r["errors"]) + 1 if reason.startswith("error:") else 0
+                r.update(reason=reason, last_ts=now, attempts=str(int(r["attempts"]) + 1), errors=str(errors))
+                if max_errors and errors >= max_errors:
+                    dropped.append(rows.pop(k))
+            self._write(rows)
+            return len(rows), dropped
@@ -4,16 +4,26 @@
 Универсальный предохранитель для пулов сервисов: HAProxy, Nginx, systemd-группы, JBoss.
 - Конфиг кластеров: /tmp/pattern_controller/report/clusters.json
 - Очередь отложенных операций: /tmp/pattern_controller/signals/queue/deferred_all.csv
+  (строка на (cluster, server, action): reason — последняя причина, attempts, см. deferred_store.py)
 - Ежеминутный retry: guarded_toggle.py --action retry
+- Состояние пула — provider.probe_all (один запрос на пул), кэш на кластер
+  PROBE_TTL_SEC секунд; в одном проходе retry кэш общий для всех строк
 CLI:
   --action {disable,drain,enable,retry}
   --cluster <name> --server <name>
 """
 
-import os, sys, json, csv, time, fcntl, tempfile, subprocess, importlib, contextlib
+import os, sys, json, time, fcntl, subprocess, importlib, contextlib
 from pathlib import Path
 from typing import Dict, Any, List, Tuple
 
+try:
+    from controller import capacity
+    from controller.deferred_store import DeferredStore
+except ImportError:  # запуск файлом из каталога controller/
+    import capacity
+    from deferred_store import DeferredStore
+
 BASE = Path("/tmp/pattern_controller")
 REPORT = BASE / "report"
 SIGNALS = BASE / "signals"
@@ -26,6 +36,10 @@ CLUSTERS_FILE = REPORT / "clusters.json"  # описание пулов/бэке
 RULES_FILE    = REPORT / "rules.json"     # min_enabled глобально/по пулам (можно заменить через env RULES_FILE)
 
 RULES_FILE = Path(os.environ.get("RULES_FILE", str(RULES_FILE)))
+LEARNED_CAPACITY = REPORT / "capacity_learned.json"
+
+PROBE_TTL_SEC = float(os.environ.get("PROBE_TTL_SEC", "5"))
+_PROBE_CACHE: Dict[str, Dict[str, Any]] = {}  # cluster -> {"ts", "states" | "enabled"/"total"}
 
 def ensure_dirs():
     for p in (REPORT, SIGNALS, LOGS, LOCKS, QUEUE):
@@ -50,8 +64,10 @@ def load_clusters() -> Dict[str, Any]:
     {
       "Jboss_client": {
         "provider": "haproxy",
-        "provider_conf": { "socket": "/run/haproxy/admin.sock" },
-        "min_enabled": 4
+        "provider_conf": { "socket": "/run/haproxy/admin.sock", "backend": "Jboss_client" },
+        "min_enabled": 4,
+        "max_util": 0.8,                                  # опционально, см. capacity.py
+        "capacity": { "scur": 200, "rate": 150 }          # опционально: ёмкость одного сервера
       },
       "nginx_api": {
         "provider": "nginx",
@@ -96,14 +112,12 @@ def with_lock(name: str):
         fcntl.flock(f.fileno(), fcntl.LOCK_UN)
         f.close()
 
+def deferred_store() -> DeferredStore:
+    return DeferredStore(QUEUE_FILE, "cluster")
+
 def enqueue(action: str, cluster: str, server: str, reason: str):
     ensure_dirs()
-    new = not QUEUE_FILE.exists()
-    with QUEUE_FILE.open("a", encoding="utf-8", newline="") as f:
-        w = csv.writer(f, delimiter=';')
-        if new:
-            w.writerow(["ts","action","cluster","server","reason"])
-        w.writerow([time.strftime("%Y-%m-%d %H:%M:%S"), action, cluster, server, reason])
+    deferred_store().add(action, cluster, server, reason)
     log(f"[DEFER] {action} {cluster}/{server} — {reason}")
 
 # ===== динамическая загрузка провайдеров =====
@@ -112,10 +126,71 @@ def get_provider(provider_name: str):
     providers/haproxy.py: must define:
       count_enabled(conf) -> (enabled:int, total:int)
       set_state(conf, server:str, action:str)  # action in {"enable","disable","drain"}
+    опционально:
+      probe_all(conf) -> {server: enabled:bool}  # весь пул одним запросом
+      set_state_many(conf, [(server, action), ...]) -> [err|None, ...]  # пачкой; иначе цикл set_state
+      load_stats(conf) -> [row show stat]     # для прогноза ёмкости (capacity.py)
     """
     mod = importlib.import_module(f"controller.providers.{provider_name}")
     return mod
 
+def probe(cluster: str, provider, provider_conf: Dict[str, Any]) -> Tuple[int, int]:
+    """(enabled, total) пула из кэша (не старше PROBE_TTL_SEC) или одним probe_all/count_enabled."""
+    ent = _PROBE_CACHE.get(cluster)
+    if ent is None or time.time() - ent["ts"] > PROBE_TTL_SEC:
+        if hasattr(provider, "probe_all"):
+            ent = {"ts": time.time(), "states": dict(provider.probe_all(provider_conf))}
+        else:
+            enabled, total = provider.count_enabled(provider_conf)
+            ent = {"ts": time.time(), "enabled": enabled, "total": total}
+        _PROBE_CACHE[cluster] = ent
+    if "states" in ent:
+        return sum(ent["states"].values()), len(ent["states"])
+    return ent["enabled"], ent["total"]
+
+def note_state(cluster: str, server: str, action: str):
+    """Учесть собственное переключение в кэше, чтобы следующие строки retry видели его без нового опроса."""
+    ent = _PROBE_CACHE.get(cluster)
+    if ent is None:
+        return
+    up = action == "enable"
+    if "states" in ent:
+        key = server if server in ent["states"] else server.split("/", 1)[-1]
+        if key in ent["states"]:
+            ent["states"][key] = up
+        else:
+            _PROBE_CACHE.pop(cluster, None)  # не знаем такой сервер — перечитаем
+    else:
+        ent["enabled"] = max(0, min(ent["total"], ent["enabled"] + (1 if up else -1)))
+
+def set_state_many(provider, provider_conf: Dict[str, Any], items: List[Tuple[str, str]]) -> List[Any]:
+    """Применить [(server, action)] одним вызовом провайдера; ошибки — по позициям (None = ок)."""
+    if hasattr(provider, "set_state_many"):
+        return list(provider.set_state_many(provider_conf, items))
+    errs: List[Any] = []
+    for server, action in items:
+        try:
+            provider.set_state(provider_conf, server, action); errs.append(None)
+        except Exception as e:
+            errs.append(str(e))
+    return errs
+
+def capacity_check(cluster: str, conf: Dict[str, Any], provider, server: str,
+                   rules: Dict[str, Any], rows: List[Dict[str, str]] = None) -> Tuple[bool, str]:
+    """Прогноз утилизации после снятия server; провайдеры без load_stats не ограничиваются."""
+    if not hasattr(provider, "load_stats"):
+        return True, "no load stats"
+    pconf = conf.get("provider_conf", {})
+    backend = pconf.get("backend", cluster)
+    if rows is None:
+        rows = provider.load_stats(pconf)
+    srv = server.split("/", 1)[1] if "/" in server else server
+    cconf = capacity.capacity_conf(rules, backend, conf)
+    learned = capacity.learn(rows, backend, LEARNED_CAPACITY, cconf)
+    ok, reason, _ = capacity.project(rows, srv, cconf, learned)
+    log(f"[CAPACITY] {cluster}/{server}: {'ok' if ok else 'refuse'} {reason}")
+    return ok, reason
+
 # ===== основные операции =====
 def safe_toggle(action: str, cluster: str, server: str):
     """
@@ -133,71 +208,99 @@ def safe_toggle(action: str, cluster: str, server: str):
     if action == "enable":
         with with_lock(cluster):
             provider.set_state(provider_conf, server, "enable")
+            note_state(cluster, server, "enable")
             log(f"[ENABLE] {cluster}/{server}")
         return
 
     with with_lock(cluster):
-        enabled, total = provider.count_enabled(provider_conf)
+        _PROBE_CACHE.pop(cluster, None)  # одиночная операция — решаем по свежему состоянию
+        enabled, total = probe(cluster, provider, provider_conf)
         if enabled <= min_enabled:
             enqueue(action, cluster, server, f"enabled={enabled}, min={min_enabled}")
             return
+        ok, why = capacity_check(cluster, conf, provider, server, rules)
+        if not ok:
+            enqueue(action, cluster, server, why)
+            return
         provider.set_state(provider_conf, server, action)
+        note_state(cluster, server, action)
         log(f"[{action.upper()}] {cluster}/{server}")
 
 def retry_once():
-    if not QUEUE_FILE.exists():
+    """
+    Проход по очереди: по кластеру — один лок, один опрос пула, один set_state_many
+    на всё, что проходит по min_enabled/ёмкости; остальные строки обновляются на месте.
+    """
+    store = deferred_store()
+    queued = store.load()
+    if not queued:
         log("[RETRY] queue empty")
         return
 
     clusters = load_clusters()
     rules = load_rules()
-    with QUEUE_FILE.open("r", encoding="utf-8") as f:
-        rows = list(csv.DictReader(f, delimiter=';'))
-
-    remaining = []
-    for r in rows:
-        action  = r["action"]
-        cluster = r["cluster"]
-        server  = r["server"]
-        try:
-            if cluster not in clusters:
-                r["reason"] = "unknown cluster"
-                remaining.append(r); continue
+    done: List[Tuple[str, str, str]] = []
+    failed: Dict[Tuple[str, str, str], str] = {}
+    _PROBE_CACHE.clear()  # кэш общий для строк этого прохода
+    by_cluster: Dict[str, List[Dict[str, str]]] = {}
+    for r in queued.values():
+        by_cluster.setdefault(r["cluster"], []).append(r)
 
-            conf = clusters[cluster]
+    for cluster, group in by_cluster.items():
+        if cluster not in clusters:
+            for r in group:
+                failed[store.key(r)] = "unknown cluster"
+            continue
+        # enable первыми: они добавляют запас под min_enabled для drain/disable
+        group.sort(key=lambda r: r["action"] != "enable")
+        conf = clusters[cluster]
+        try:
             provider = get_provider(conf["provider"])
             provider_conf = conf.get("provider_conf", {})
             min_enabled = get_min_enabled(cluster, clusters, rules)
+            planned: List[Dict[str, str]] = []
 
             with with_lock(cluster):
-                enabled, _ = provider.count_enabled(provider_conf)
-                if action in ("disable","drain"):
-                    if enabled <= min_enabled:
-                        r["reason"] = f"enabled={enabled}<=min={min_enabled}"
-                        remaining.append(r); continue
-                    provider.set_state(provider_conf, server, action)
-                    log(f"[RETRY {action}] {cluster}/{server}")
-                else:
-                    provider.set_state(provider_conf, server, "enable")
-                    log(f"[RETRY enable] {cluster}/{server}")
+                stats = provider.load_stats(provider_conf) if hasattr(provider, "load_stats") else None
+                for r in group:
+                    action, server = r["action"], r["server"]
+                    if action in ("disable","drain"):
+                        enabled, _ = probe(cluster, provider, provider_conf)
+                        if enabled <= min_enabled:
+                            failed[store.key(r)] = f"enabled={enabled}<=min={min_enabled}"
+                            continue
+                        ok, why = capacity_check(cluster, conf, provider, server, rules, stats)
+                        if not ok:
+                            failed[store.key(r)] = why
+                            continue
+                    planned.append(r)
+                    # решения по следующим строкам — с учётом уже запланированных
+                    note_state(cluster, server, action)
+                    srv = server.split("/", 1)[-1]
+                    for row in stats or []:
+                        if row.get("svname") == srv:
+                            row["admin"] = "" if action == "enable" else "MAINT"
+                            row["status"] = "UP" if action == "enable" else "MAINT"
+
+                errs = set_state_many(provider, provider_conf, [(r["server"], r["action"]) for r in planned])
+                for r, err in zip(planned, errs):
+                    if err:
+                        _PROBE_CACHE.pop(cluster, None)
+                        failed[store.key(r)] = f"error: {err}"
+                    else:
+                        done.append(store.key(r))
+                        log(f"[RETRY {r['action']}] {cluster}/{r['server']}")
         except Exception as e:
-            r["reason"] = f"error: {e}"
-            remaining.append(r)
-
-    if remaining:
-        with tempfile.NamedTemporaryFile("w", delete=False, encoding="utf-8") as tf:
-            w = csv.DictWriter(tf, fieldnames=["ts","action","cluster","server","reason"], delimiter=';')
-            w.writeheader()
-            for r in remaining:
-                if "reason" not in r:
-                    r["reason"] = "unknown"
-                w.writerow(r)
-        os.replace(tf.name, QUEUE_FILE)
-        log(f"[RETRY] remaining: {len(remaining)}")
-    else:
-        try: QUEUE_FILE.unlink()
-        except FileNotFoundError: pass
-        log("[RETRY] queue cleared")
+            _PROBE_CACHE.pop(cluster, None)  # состояние после ошибки неизвестно
+            for r in group:
+                k = store.key(r)
+                if k not in failed and k not in done:
+                    failed[k] = f"error: {e}"
+
+    left, dropped = store.settle(done, failed)
+    for r in dropped:
+        log(f"[DROP] {r.get('action')} {r.get('cluster')}/{r.get('server')} after {r.get('errors')} errors — {r.get('reason')}")
+    log(f"[RETRY] applied: {len(done)}, remaining: {left}" if left else "[RETRY] queue cleared")
 
 if __name__ == "__main__":
     import argparse
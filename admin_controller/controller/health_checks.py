@@ -10,6 +10,19 @@
   4) check_jboss_deploys()
   5) check_system_load()
 
+У проверок с подпроцессами/сетью есть async-варианты для asyncio-режима api_server:
+  check_services_async(), check_ports_async(), check_jboss_deploys_async(),
+  check_system_load_async() — asyncio-подпроцессы с таймаутом, чтение /proc в потоке.
+check_system_load() читает /proc (proc_sampler.py): CPU — дельта с прошлого вызова;
+prime_system_load() на старте процесса снимает опорные показания для первого вызова.
+check_ports() — неблокирующие connect ко всем целям с одним общим дедлайном;
+check_services() — один `systemctl show` на все юниты; CLI --all запускает проверки
+параллельно — весь проход ограничен самой медленной проверкой.
+
+JBoss: по умолчанию HTTP management API (JSON DMR на JBOSS_CONTROLLER, см. jboss_mgmt.py) —
+миллисекунды вместо старта JVM jboss-cli; JBOSS_MGMT=auto|http|cli (auto — cli, только
+если management API недоступен).
+
 Все функции возвращают словари с ключами: ts, items/ok/...,
 и ДОПОЛНИТЕЛЬНО сохраняют результат в:
   /tmp/pattern_controller/report/<HOST>/health/{disk,services,ports,jboss,system}.json
@@ -22,12 +35,24 @@ CLI:
   python3 controller/health_checks.py --ports 127.0.0.1:35073,127.0.0.1:35009
   python3 controller/health_checks.py --jboss
   python3 controller/health_checks.py --system
+  python3 controller/health_checks.py --daemon [--intervals disk=60,system=10]
+      — фоновый режим: проверки по своим интервалам пишут health/*.json (health_sampler.py)
 """
 
 from __future__ import annotations
-import os, json, time, socket, subprocess, argparse, shutil
+import os, json, time, socket, subprocess, argparse, shutil, asyncio, selectors, errno, threading
+from concurrent.futures import ThreadPoolExecutor
 from typing import List, Dict, Any, Tuple
 
+try:
+    from controller.jboss_mgmt import get_client, JBossMgmtError
+except ImportError:  # запуск файлом из каталога controller/
+    from jboss_mgmt import get_client, JBossMgmtError
+try:
+    from controller.proc_sampler import ProcSampler
+except ImportError:
+    from proc_sampler import ProcSampler
+
 # Единые пути (report/<HOST>/...)
 try:
     from bin.path_utils import REPORT_DIR
@@ -49,9 +74,14 @@ DEFAULT_JBOSS_CONTROLLER = os.environ.get("JBOSS_CONTROLLER", "127.0.0.1:9990")
 DEFAULT_JBOSS_USER       = os.environ.get("JBOSS_USER") or None
 DEFAULT_JBOSS_PASS       = os.environ.get("JBOSS_PASS") or None
 DEFAULT_JBOSS_DEPLOYS    = [x for x in os.environ.get("JBOSS_DEPLOYS","").split(",") if x.strip()]
+JBOSS_MGMT_MODE          = os.environ.get("JBOSS_MGMT", "auto")  # auto | http | cli
 
 HEALTH_OUT_DIR = os.environ.get("HEALTH_OUT_DIR", _DEFAULT_OUT_DIR)
 
+# JVM для истории/тренда в check_system_load — regex по cmdline
+JVM_PATTERN = os.environ.get("JVM_PATTERN", r"jboss-modules\.jar|org\.jboss")
+PROC_SAMPLER = ProcSampler(JVM_PATTERN)
+
 # ---- утилиты --------------------------------------------------------------------
 
 def _now_ts() -> str:
@@ -66,15 +96,29 @@ def _ensure_outdir() -> str:
     return HEALTH_OUT_DIR
 
 def _write_json(name: str, data: dict):
-    """Пишем JSON в health/<name>.json (best-effort)."""
+    """Пишем JSON в health/<name>.json (best-effort; temp+rename — писателей может быть несколько)."""
     outdir = _ensure_outdir()
     try:
         path = os.path.join(outdir, f"{name}.json")
-        with open(path, "w", encoding="utf-8") as f:
+        tmp = f"{path}.tmp{os.getpid()}.{threading.get_ident()}"
+        with open(tmp, "w", encoding="utf-8") as f:
             json.dump(data, f, ensure_ascii=False)
+        os.replace(tmp, path)
     except Exception:
         pass
 
+async def _run_async(cmd: List[str], timeout: float, env: dict | None = None) -> Tuple[int, str, str]:
+    """asyncio-подпроцесс: (rc, stdout, stderr); по таймауту процесс убивается, TimeoutError наружу."""
+    proc = await asyncio.create_subprocess_exec(*cmd, stdout=asyncio.subprocess.PIPE,
+                                                stderr=asyncio.subprocess.PIPE, env=env)
+    try:
+        out, err = await asyncio.wait_for(proc.communicate(), timeout)
+    except asyncio.TimeoutError:
+        proc.kill()
+        await proc.wait()
+        raise TimeoutError(f"timeout {timeout}s: {cmd[0]}")
+    return proc.returncode, out.decode("utf-8", "ignore"), err.decode("utf-8", "ignore")
+
 # ---- 1) Диски -------------------------------------------------------------------
 
 def _read_mounts() -> list[tuple[str, str, str]]:
@@ -138,60 +182,160 @@ def check_disk(mounts: List[str] | None = None, warn_pct: float = DISK_WARN, cri
 
 # ---- 2) Сервисы (systemd) -------------------------------------------------------
 
-def check_services(services: List[str] | None = None) -> Dict[str, Any]:
-    """systemd is-active для каждого сервиса."""
+SYSTEMD_PROPS = ["Id", "LoadState", "ActiveState", "SubState", "ActiveEnterTimestamp"]
+
+def _systemctl_show_cmd(systemctl: str, units: List[str]) -> List[str]:
+    """Один systemctl show на все юниты (вместо is-active на каждый)."""
+    cmd = [systemctl, "show"]
+    for p in SYSTEMD_PROPS:
+        cmd += ["-p", p]
+    return cmd + ["--"] + units
+
+def _services_items(units: List[str], stdout: str) -> list[dict]:
+    """
+    systemctl show печатает блоки KEY=VALUE через пустую строку в порядке аргументов;
+    status — ActiveState (то же, что печатал is-active).
+    """
+    blocks = [dict(l.split("=", 1) for l in b.splitlines() if "=" in l)
+              for b in stdout.strip().split("\n\n")] if stdout.strip() else []
+    items = []
+    for i, svc in enumerate(units):
+        p = blocks[i] if i < len(blocks) else {}
+        state = p.get("ActiveState") or "unknown"
+        item = {"name": svc, "active": state == "active", "status": state,
+                "sub": p.get("SubState", ""), "since": p.get("ActiveEnterTimestamp", "")}
+        if p.get("LoadState") == "not-found":
+            item["load"] = "not-found"
+        items.append(item)
+    return items
+
+def _services_error(units: List[str], status: str) -> list[dict]:
+    return [{"name": svc, "active": False, "status": status} for svc in units]
+
+def check_services(services: List[str] | None = None, timeout: float = 5) -> Dict[str, Any]:
+    """systemd ActiveState/SubState/ActiveEnterTimestamp всех сервисов одним systemctl show."""
     if services is None:
         services = DEFAULT_SERVICES
-    items = []
+    units = [s.strip() for s in services or [] if s.strip()]
     systemctl = shutil.which("systemctl")
-    for svc in services or []:
-        svc = svc.strip()
-        if not svc:
-            continue
-        if not systemctl:
-            items.append({"name": svc, "active": False, "status": "no-systemctl"})
-            continue
+    if not systemctl:
+        items = _services_error(units, "no-systemctl")
+    elif not units:
+        items = []
+    else:
         try:
-            r = subprocess.run([systemctl, "is-active", svc],
-                               stdout=subprocess.PIPE, stderr=subprocess.PIPE, text=True, timeout=5)
-            status = (r.stdout.strip() or r.stderr.strip() or "").strip()
-            items.append({"name": svc, "active": (status == "active"), "status": status})
+            r = subprocess.run(_systemctl_show_cmd(systemctl, units),
+                               stdout=subprocess.PIPE, stderr=subprocess.PIPE, text=True, timeout=timeout)
+            items = _services_items(units, r.stdout or "")
         except Exception as e:
-            items.append({"name": svc, "active": False, "status": f"error:{e}"})
+            items = _services_error(units, f"error:{e}")
+    out = {"ts": _now_ts(), "items": items}
+    _write_json("services", out)
+    return out
+
+async def check_services_async(services: List[str] | None = None, timeout: float = 5) -> Dict[str, Any]:
+    """То же, что check_services; systemctl show — asyncio-подпроцесс."""
+    if services is None:
+        services = DEFAULT_SERVICES
+    units = [s.strip() for s in services or [] if s.strip()]
+    systemctl = shutil.which("systemctl")
+    if not systemctl:
+        items = _services_error(units, "no-systemctl")
+    elif not units:
+        items = []
+    else:
+        try:
+            _, so, _ = await _run_async(_systemctl_show_cmd(systemctl, units), timeout)
+            items = _services_items(units, so)
+        except Exception as e:
+            items = _services_error(units, f"error:{e}")
     out = {"ts": _now_ts(), "items": items}
     _write_json("services", out)
     return out
 
 # ---- 3) Порты (TCP CONNECT) -----------------------------------------------------
 
+def _connect_all(targets: List[str], timeout_sec: float) -> list[dict]:
+    """
+    Неблокирующий connect ко всем целям сразу (selectors) с одним общим дедлайном:
+    20 недоступных целей стоят timeout_sec, а не 20 × timeout_sec.
+    """
+    items: list[dict] = []
+    sel = selectors.DefaultSelector()
+    deadline = time.monotonic() + timeout_sec
+    try:
+        for t in targets:
+            item = {"target": t, "open": False, "error": ""}
+            items.append(item)
+            host, port_s = t.rsplit(":", 1)
+            try:
+                family, stype, proto, _, addr = socket.getaddrinfo(host, int(port_s), type=socket.SOCK_STREAM)[0]
+                s = socket.socket(family, stype, proto)
+            except Exception as e:
+                item["error"] = str(e)
+                continue
+            s.setblocking(False)
+            err = s.connect_ex(addr)
+            if err == 0:
+                item["open"] = True
+                s.close()
+            elif err in (errno.EINPROGRESS, errno.EWOULDBLOCK, errno.EALREADY):
+                sel.register(s, selectors.EVENT_WRITE, item)
+            else:
+                item["error"] = os.strerror(err)
+                s.close()
+        while sel.get_map():
+            left = deadline - time.monotonic()
+            if left <= 0:
+                break
+            for key, _ in sel.select(left):
+                s, item = key.fileobj, key.data
+                err = s.getsockopt(socket.SOL_SOCKET, socket.SO_ERROR)
+                item["open"] = err == 0
+                item["error"] = "" if err == 0 else os.strerror(err)
+                sel.unregister(s)
+                s.close()
+        for key in list(sel.get_map().values()):
+            key.data["error"] = "timed out"
+            sel.unregister(key.fileobj)
+            key.fileobj.close()
+    finally:
+        sel.close()
+    return items
+
 def check_ports(targets: List[str] | None = None, timeout_sec: float = 1.0) -> Dict[str, Any]:
-    """targets: ["host:port", ...] — проверка TCP-connect."""
+    """targets: ["host:port", ...] — TCP-connect ко всем одновременно, общий таймаут timeout_sec."""
     if targets is None:
         targets = DEFAULT_PORTS
-    items = []
-    for t in targets or []:
-        t = t.strip()
-        if not t or ":" not in t:
-            continue
+    items = _connect_all([t.strip() for t in targets or [] if t.strip() and ":" in t], timeout_sec)
+    out = {"ts": _now_ts(), "items": items}
+    _write_json("ports", out)
+    return out
+
+async def check_ports_async(targets: List[str] | None = None, timeout_sec: float = 1.0) -> Dict[str, Any]:
+    """TCP-connect ко всем целям одновременно."""
+    if targets is None:
+        targets = DEFAULT_PORTS
+
+    async def one(t: str) -> dict:
         host, port_s = t.rsplit(":", 1)
         try:
-            port = int(port_s)
-            with socket.create_connection((host, port), timeout=timeout_sec):
-                items.append({"target": t, "open": True, "error": ""})
+            _, w = await asyncio.wait_for(asyncio.open_connection(host, int(port_s)), timeout_sec)
+            w.close()
+            return {"target": t, "open": True, "error": ""}
+        except asyncio.TimeoutError:
+            return {"target": t, "open": False, "error": "timed out"}
         except Exception as e:
-            items.append({"target": t, "open": False, "error": str(e)})
-    out = {"ts": _now_ts(), "items": items}
+            return {"target": t, "open": False, "error": str(e)}
+
+    items = await asyncio.gather(*(one(t.strip()) for t in targets or [] if t.strip() and ":" in t))
+    out = {"ts": _now_ts(), "items": list(items)}
     _write_json("ports", out)
     return out
 
 # ---- 4) JBoss deploys (через jboss-cli) ----------------------------------------
 
-def _jboss_cli_query(cli_path: str, controller: str, user: str | None, password: str | None, timeout: int = 8) -> dict:
-    """
-    Вызов jboss-cli.sh для получения статуса деплоев:
-      :read-children-resources(child-type=deployment, include-runtime=true)
-    Возвращает распарсенный JSON ответа CLI (если удалось).
-    """
+def _jboss_cli_cmd(cli_path: str, controller: str, user: str | None, password: str | None) -> Tuple[List[str], dict]:
     cmd = [cli_path, "--connect"]
     if controller:
         cmd += [f"--controller={controller}"]
@@ -202,18 +346,58 @@ def _jboss_cli_query(cli_path: str, controller: str, user: str | None, password:
     cmd += ['command=/:read-children-resources(child-type=deployment,include-runtime=true,recursive=true)']
     env = os.environ.copy()
     env["JBOSS_LOGGING_CONFIG"] = env.get("JBOSS_LOGGING_CONFIG","")
+    return cmd, env
+
+def _cli_json(txt: str) -> dict:
+    # Пытаемся вытащить JSON из текстового ответа
+    start = txt.find("{"); end = txt.rfind("}")
+    if start >= 0 and end > start:
+        return json.loads(txt[start:end+1])
+    return {}
+
+def _jboss_cli_query(cli_path: str, controller: str, user: str | None, password: str | None, timeout: int = 8) -> dict:
+    """
+    Вызов jboss-cli.sh для получения статуса деплоев:
+      :read-children-resources(child-type=deployment, include-runtime=true)
+    Возвращает распарсенный JSON ответа CLI (если удалось).
+    """
+    cmd, env = _jboss_cli_cmd(cli_path, controller, user, password)
     try:
         r = subprocess.run(cmd, stdout=subprocess.PIPE, stderr=subprocess.PIPE, text=True, timeout=timeout, env=env)
-        txt = r.stdout or r.stderr
-        # Пытаемся вытащить JSON из текстового ответа
-        start = txt.find("{"); end = txt.rfind("}")
-        if start >= 0 and end > start:
-            js = txt[start:end+1]
-            return json.loads(js)
+        return _cli_json(r.stdout or r.stderr)
     except Exception:
         pass
     return {}
 
+def _jboss_http_query(controller: str, user: str | None, password: str | None, timeout: float = 8) -> dict | None:
+    """read-children-resources(deployment) через management API; None — API недоступен."""
+    try:
+        return get_client(controller, user, password, timeout=timeout).read_deployments()
+    except JBossMgmtError:
+        return None
+
+def _jboss_result(raw: dict, controller: str, deployments_filter: List[str] | None, via: str = "cli") -> Dict[str, Any]:
+    items = []
+    ok = (raw.get("outcome") == "success")
+    result = raw.get("result") or {}
+    if ok and isinstance(result, dict):
+        for name, meta in result.items():
+            if deployments_filter and name not in deployments_filter:
+                continue
+            enabled = bool(meta.get("enabled", True))
+            status = meta.get("status") or meta.get("enabled") or "unknown"
+            items.append({"name": name, "enabled": bool(enabled), "status": str(status)})
+    out = {"ts": _now_ts(), "ok": ok, "controller": controller, "items": items,
+           "raw_outcome": raw.get("outcome", "unknown"), "via": via}
+    _write_json("jboss", out)
+    return out
+
+def _jboss_cli_missing(cli: str, controller: str) -> Dict[str, Any]:
+    out = {"ts": _now_ts(), "ok": False, "controller": controller, "items": [],
+           "raw_outcome": "cli_not_found", "error": f"jboss-cli not found: {cli}"}
+    _write_json("jboss", out)
+    return out
+
 def check_jboss_deploys(cli_path: str | None = None,
                         controller: str = DEFAULT_JBOSS_CONTROLLER,
                         user: str | None = DEFAULT_JBOSS_USER,
@@ -221,35 +405,42 @@ def check_jboss_deploys(cli_path: str | None = None,
                         deployments_filter: List[str] | None = None,
                         timeout: int = 8) -> Dict[str, Any]:
     """
-    Проверяет деплои JBoss через jboss-cli.sh.
+    Проверяет деплои JBoss через HTTP management API (или jboss-cli.sh, см. JBOSS_MGMT).
       - cli_path: путь к jboss-cli.sh (по умолчанию /u01/jboss/bin/jboss-cli.sh)
       - controller: host:port management
       - user/password: при необходимости
       - deployments_filter: если задан — показывать только указанные имена деплоев
     """
+    if JBOSS_MGMT_MODE != "cli":
+        raw = _jboss_http_query(controller, user, password, timeout)
+        if raw is not None or JBOSS_MGMT_MODE == "http":
+            return _jboss_result(raw or {"outcome": "unreachable"}, controller, deployments_filter, via="http")
     cli = cli_path or DEFAULT_JBOSS_CLI
     if not os.path.exists(cli):
-        out = {"ts": _now_ts(), "ok": False, "controller": controller, "items": [],
-               "raw_outcome": "cli_not_found", "error": f"jboss-cli not found: {cli}"}
-        _write_json("jboss", out)
-        return out
-
+        return _jboss_cli_missing(cli, controller)
     raw = _jboss_cli_query(cli, controller, user, password, timeout=timeout)
-    items = []
-    ok = (raw.get("outcome") == "success")
-    result = raw.get("result") or {}
-    if ok and isinstance(result, dict):
-        for name, meta in result.items():
-            if deployments_filter and name not in deployments_filter:
-                continue
-            enabled = bool(meta.get("enabled", True))
-            status = meta.get("status") or meta.get("enabled") or "unknown"
-            items.append({"name": name, "enabled": bool(enabled), "status": str(status)})
-
-    out = {"ts": _now_ts(), "ok": ok, "controller": controller, "items": items,
-           "raw_outcome": raw.get("outcome", "unknown")}
-    _write_json("jboss", out)
-    return out
+    return _jboss_result(raw, controller, deployments_filter)
+
+async def check_jboss_deploys_async(cli_path: str | None = None,
+                                    controller: str = DEFAULT_JBOSS_CONTROLLER,
+                                    user: str | None = DEFAULT_JBOSS_USER,
+                                    password: str | None = DEFAULT_JBOSS_PASS,
+                                    deployments_filter: List[str] | None = None,
+                                    timeout: int = 8) -> Dict[str, Any]:
+    if JBOSS_MGMT_MODE != "cli":
+        raw = await asyncio.to_thread(_jboss_http_query, controller, user, password, timeout)
+        if raw is not None or JBOSS_MGMT_MODE == "http":
+            return _jboss_result(raw or {"outcome": "unreachable"}, controller, deployments_filter, via="http")
+    cli = cli_path or DEFAULT_JBOSS_CLI
+    if not os.path.exists(cli):
+        return _jboss_cli_missing(cli, controller)
+    cmd, env = _jboss_cli_cmd(cli, controller, user, password)
+    try:
+        _, so, se = await _run_async(cmd, timeout, env=env)
+        raw = _cli_json(so or se)
+    except Exception:
+        raw = {}
+    return _jboss_result(raw, controller, deployments_filter)
 
 # ---- 5) Память и CPU ------------------------------------------------------------
 
@@ -266,61 +457,31 @@ def _meminfo() -> dict:
         pass
     return out
 
-def _cpu_times() -> dict:
-    try:
-        with open("/proc/stat","r") as f:
-            for line in f:
-                if line.startswith("cpu "):
-                    parts = line.split()
-                    nums = list(map(int, parts[1:]))
-                    return {
-                        "user": nums[0], "nice": nums[1], "system": nums[2], "idle": nums[3],
-                        "iowait": nums[4] if len(nums)>4 else 0, "irq": nums[5] if len(nums)>5 else 0,
-                        "softirq": nums[6] if len(nums)>6 else 0, "steal": nums[7] if len(nums)>7 else 0
-                    }
-    except Exception:
-        pass
-    return {}
-
-def _cpu_usage_percent(sample_sec: float = 0.25) -> float:
-    a = _cpu_times()
-    time.sleep(sample_sec)
-    b = _cpu_times()
-    if not a or not b:
-        return -1.0
-    def tot(d): return sum(d.values())
-    idle_delta = b.get("idle",0) - a.get("idle",0)
-    total_delta = tot(b) - tot(a)
-    if total_delta <= 0:
-        return 0.0
-    usage = 100.0 * (1.0 - (idle_delta / total_delta))
-    return round(usage, 2)
-
-def _top_processes(n: int = 5) -> list[dict]:
-    """Топ потребителей CPU/MEM через ps (без внешних либ)."""
-    items = []
-    try:
-        r = subprocess.run(
-            ["bash","-lc", f"ps -eo pid,comm,%cpu,%mem --sort=-%cpu | head -n $((1+{n}))"],
-            stdout=subprocess.PIPE, stderr=subprocess.PIPE, text=True, timeout=3
-        )
-        lines = (r.stdout or "").strip().splitlines()
-        for line in lines[1:]:
-            parts = line.split(None,4)
-            if len(parts) >= 4:
-                pid, comm, cpu, mem = parts[0], parts[1], parts[2], parts[3]
-                items.append({"pid": int(pid), "comm": comm, "cpu_pct": float(cpu), "mem_pct": float(mem)})
-    except Exception:
-        pass
-    return items
-
 def check_system_load() -> Dict[str, Any]:
     """
     Возвращает:
       mem: total, available, used, used_pct
-      cpu: usage_pct (на интервале ~0.25с)
-      top_procs: [{pid,comm,cpu_pct,mem_pct} ...]
+      cpu: usage_pct, window_sec (интервал с прошлого вызова или prime_system_load();
+           null — первый вызов без prime, средние с загрузки)
+      top_procs: [{pid,comm,cpu_pct,mem_pct,rss} ...]  — по CPU
+      top_rss:   то же по RSS
+      jvm: [{pid,cpu_pct,rss,samples,trend} ...]        — процессы JBoss и их тренд
+    Без ps и без sleep: дельты /proc между вызовами (proc_sampler.py). Проход по
+    /proc/<pid> на большом хосте — десятки мс, поэтому в asyncio — через поток.
     """
+    return _system_result(PROC_SAMPLER.sample(5))
+
+def prime_system_load(wait_sec: float = 0.25) -> None:
+    """Опорные показания CPU для первого check_system_load(); вызывать на старте
+    процесса (api_server, --daemon, CLI), не на пути запроса. wait_sec — пауза после,
+    чтобы первое окно не было пустым."""
+    PROC_SAMPLER.prime(wait_sec)
+
+async def check_system_load_async() -> Dict[str, Any]:
+    """То же в потоке: скан /proc не держит event loop."""
+    return await asyncio.to_thread(check_system_load)
+
+def _system_result(sample: Dict[str, Any]) -> Dict[str, Any]:
     mi = _meminfo()
     def _kB(x: str) -> int:
         try:
@@ -333,17 +494,17 @@ def check_system_load() -> Dict[str, Any]:
     used = total - avail if total>0 else 0
     used_pct = round((used/total)*100.0, 2) if total>0 else 0.0
 
-    cpu_pct = _cpu_usage_percent(0.25)
-    top = _top_processes(5)
-
     out = {
         "ts": _now_ts(),
         "mem": {"total": total, "available": avail, "used": used, "used_pct": used_pct},
-        "cpu": {"usage_pct": cpu_pct},
-        "top_procs": top,
+        "cpu": sample["cpu"],
+        "top_procs": sample["top_cpu"],
+        "top_rss": sample["top_rss"],
+        "jvm": sample["jvm"],
         "hints": [
             "Высокая память: смотри top_procs по mem_pct и dmesg (OOM-killer).",
             "Высокий CPU: проверь top_procs по cpu_pct, iowait (vmstat 1), и активности GC/JIT у JVM.",
+            "Рост jvm[].trend.rss_bytes_per_min при ровном CPU — вероятная утечка памяти в JVM.",
         ]
     }
     _write_json("system", out)
@@ -351,11 +512,6 @@ def check_system_load() -> Dict[str, Any]:
 
 # ---- CLI ------------------------------------------------------------------------
 
-def _run_and_print(name: str, fn, *args, **kwargs):
-    res = fn(*args, **kwargs)
-    print(json.dumps({name: res}, ensure_ascii=False))
-    return res
-
 def main():
     ap = argparse.ArgumentParser(description="Health checks aggregator (no external deps)")
     ap.add_argument("--all", action="store_true", help="run all checks")
@@ -364,30 +520,57 @@ def main():
     ap.add_argument("--ports", help="comma list of host:port")
     ap.add_argument("--jboss", action="store_true", help="check jboss deployments")
     ap.add_argument("--system", action="store_true", help="memory/cpu/top processes")
+    ap.add_argument("--daemon", action="store_true", help="run all checks periodically (health/*.json)")
+    ap.add_argument("--intervals", default=os.environ.get("HEALTH_INTERVALS", ""),
+                    help="daemon: name=sec,... (disk, services, ports, jboss, system)")
     args = ap.parse_args()
 
-    ran = False
+    if args.daemon:
+        try:
+            from controller.health_sampler import HealthSampler, parse_intervals
+        except ImportError:  # запуск файлом из каталога controller/
+            from health_sampler import HealthSampler, parse_intervals
+        iv = parse_intervals(args.intervals, {"disk": 60, "services": 15, "ports": 15, "jboss": 60, "system": 10})
+        jobs = {
+            "disk": (check_disk, iv["disk"]),
+            "services": (check_services, iv["services"]),
+            "ports": (check_ports, iv["ports"]),
+            "jboss": (lambda: check_jboss_deploys(deployments_filter=(DEFAULT_JBOSS_DEPLOYS or None)), iv["jboss"]),
+            "system": (check_system_load, iv["system"]),
+        }
+        prime_system_load()
+        HealthSampler(jobs, workers=len(jobs)).start()
+        try:
+            while True:
+                time.sleep(3600)
+        except KeyboardInterrupt:
+            return
+
+    # выбранные проверки идут параллельно: --all длится как самая медленная из них
+    runs = []
     if args.all or args.disk:
-        _run_and_print("disk", check_disk)
-        ran = True
+        runs.append(("disk", check_disk, (), {}))
     if args.all or args.services is not None:
         svcs = DEFAULT_SERVICES if args.services is None else [s for s in args.services.split(",") if s.strip()]
-        _run_and_print("services", check_services, svcs)
-        ran = True
+        runs.append(("services", check_services, (svcs,), {}))
     if args.all or args.ports is not None:
         ports = DEFAULT_PORTS if args.ports is None else [p for p in args.ports.split(",") if p.strip()]
-        _run_and_print("ports", check_ports, ports)
-        ran = True
+        runs.append(("ports", check_ports, (ports,), {}))
     if args.all or args.jboss:
-        _run_and_print("jboss", check_jboss_deploys,
+        runs.append(("jboss", check_jboss_deploys, (), dict(
                        cli_path=DEFAULT_JBOSS_CLI,
                        controller=DEFAULT_JBOSS_CONTROLLER,
                        user=DEFAULT_JBOSS_USER, password=DEFAULT_JBOSS_PASS,
-                       deployments_filter=(DEFAULT_JBOSS_DEPLOYS or None))
-        ran = True
+                       deployments_filter=(DEFAULT_JBOSS_DEPLOYS or None))))
     if args.all or args.system:
-        _run_and_print("system", check_system_load)
-        ran = True
+        prime_system_load()  # разовый запуск: загрузка за 0.25 с, а не средние с загрузки
+        runs.append(("system", check_system_load, (), {}))
+    ran = bool(runs)
+    if runs:
+        with ThreadPoolExecutor(max_workers=len(runs)) as pool:
+            futs = [(name, pool.submit(fn, *a, **kw)) for name, fn, a, kw in runs]
+            for name, fut in futs:
+                print(json.dumps({name: fut.result()}, ensure_ascii=False))
 
     if not ran:
         ap.print_help()
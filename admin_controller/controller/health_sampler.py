@@ -0,0 +1,169 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Фоновый планировщик проверок здоровья с кэшем последних результатов.
+
+У каждой проверки свой интервал; результаты лежат в памяти (и, как и раньше,
+в report/<HOST>/health/*.json — это делают сами функции health_checks).
+Отдача из кэша дополняется полями:
+  age_sec  — сколько секунд результату;
+  stale    — результат старше stale_factor × интервал (проверка зависла/падает);
+  last_error — если последний запуск упал (в кэше остаётся предыдущий результат).
+refresh(name) — посчитать сейчас (для ?fresh=1); одновременные refresh одной проверки
+не запускают её дважды.
+С cache_dir кэш общий для нескольких процессов (pre-fork api_server): каждый результат
+пишется в <cache_dir>/<проверка>.json (temp+rename); планировщик крутит только
+leader, остальные (leader=False) читают файлы по mtime. ?fresh=1 в любом процессе
+считает сам и тоже пишет файл.
+"""
+from __future__ import annotations
+
+import json
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+from typing import Any, Callable, Dict, Optional, Tuple
+
+Job = Tuple[Callable[[], Dict[str, Any]], float]  # (функция, интервал, с)
+
+def parse_intervals(spec: str, defaults: Dict[str, float]) -> Dict[str, float]:
+    """"disk=60,system=10" поверх defaults."""
+    out = dict(defaults)
+    for part in (spec or "").split(","):
+        if "=" in part:
+            k, v = part.split("=", 1)
+            try:
+                out[k.strip()] = float(v)
+            except ValueError:
+                pass
+    return out
+
+class HealthSampler:
+    def __init__(self, jobs: Dict[str, Job], stale_factor: float = 2.0, workers: int = 4,
+                 cache_dir: Optional[Path] = None, leader: bool = True):
+        self.jobs = dict(jobs)
+        self.stale_factor = stale_factor
+        self.cache_dir = Path(cache_dir) if cache_dir else None
+        self.leader = leader
+        if self.cache_dir:
+            self.cache_dir.mkdir(parents=True, exist_ok=True)
+        self._cache: Dict[str, Dict[str, Any]] = {}
+        self._mtime: Dict[str, float] = {}
+        self._running: Dict[str, threading.Lock] = {name: threading.Lock() for name in self.jobs}
+        self._next: Dict[str, float] = {name: 0.0 for name in self.jobs}
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._pool = ThreadPoolExecutor(max_workers=max(1, workers), thread_name_prefix="health")
+        self._thread: Optional[threading.Thread] = None
+
+    # ---- планировщик ----
+    def start(self) -> "HealthSampler":
+        if self._thread is None and self.leader:
+            self._thread = threading.Thread(target=self._loop, name="health-sampler", daemon=True)
+            self._thread.start()
+        return self
+
+    def stop(self) -> None:
+        self._stop.set()
+        self._pool.shutdown(wait=False)
+
+    def _loop(self) -> None:
+        while not self._stop.is_set():
+            now = time.time()
+            for name in self.jobs:
+                if self._next[name] <= now and not self._running[name].locked():
+                    self._next[name] = now + self.jobs[name][1]
+                    self._pool.submit(self._run, name)
+            wait = min(self._next.values()) - time.time()
+            self._stop.wait(max(0.2, min(wait, 5.0)))
+
+    def _run(self, name: str) -> Optional[Dict[str, Any]]:
+        lock = self._running[name]
+        if not lock.acquire(blocking=False):
+            # уже считается (планировщиком или другим refresh) — дождёмся его результата
+            with lock:
+                pass
+            return self.get(name, compute=False)
+        try:
+            t0 = time.time()
+            try:
+                data = self.jobs[name][0]()
+            except Exception as e:
+                with self._lock:
+                    self._cache.setdefault(name, {"ts": 0.0, "data": None})["error"] = str(e)
+                self._save(name)
+                return self.get(name, compute=False)
+            self.put(name, data, duration=time.time() - t0)
+        finally:
+            lock.release()
+        return self.get(name, compute=False)
+
+    # ---- кэш ----
+    def _file(self, name: str) -> Path:
+        return self.cache_dir / (name.strip("/").replace("/", "_") + ".json")
+
+    def _save(self, name: str) -> None:
+        if not self.cache_dir:
+            return
+        with self._lock:
+            ent = self._cache.get(name)
+        p = self._file(name)
+        tmp = p.with_name(f"{p.name}.{os.getpid()}.tmp")
+        try:
+            tmp.write_text(json.dumps(ent, ensure_ascii=False), encoding="utf-8")
+            tmp.replace(p)
+            self._mtime[name] = p.stat().st_mtime
+        except Exception:
+            pass  # кэш в памяти остаётся; другие процессы увидят следующий результат
+
+    def _load(self, name: str) -> None:
+        # результат другого процесса — только если файл изменился
+        if not self.cache_dir:
+            return
+        p = self._file(name)
+        try:
+            mtime = p.stat().st_mtime
+            if mtime == self._mtime.get(name):
+                return
+            ent = json.loads(p.read_text(encoding="utf-8"))
+        except Exception:
+            return
+        self._mtime[name] = mtime
+        with self._lock:
+            self._cache[name] = ent
+
+    def put(self, name: str, data: Dict[str, Any], duration: Optional[float] = None) -> Dict[str, Any]:
+        with self._lock:
+            self._cache[name] = {"ts": time.time(), "data": data, "duration": duration}
+        self._save(name)
+        if name in self._next:
+            self._next[name] = time.time() + self.jobs[name][1]
+        return self.get(name, compute=False)
+
+    def has(self, name: str) -> bool:
+        self._load(name)
+        with self._lock:
+            return (self._cache.get(name) or {}).get("data") is not None
+
+    def refresh(self, name: str) -> Optional[Dict[str, Any]]:
+        return self._run(name)
+
+    def get(self, name: str, compute: bool = True) -> Optional[Dict[str, Any]]:
+        """Кэшированный результат с age_sec/stale; если его ещё нет — посчитать (compute=True)."""
+        self._load(name)
+        with self._lock:
+            ent = dict(self._cache.get(name) or {})
+        if ent.get("data") is None:
+            if compute and name in self.jobs:
+                return self._run(name)
+            return {"ok": False, "error": ent.get("error", "no data yet"), "items": [], "stale": True} if ent else None
+        age = time.time() - ent["ts"]
+        interval = self.jobs[name][1] if name in self.jobs else 0.0
+        out = dict(ent["data"])
+        out["age_sec"] = round(age, 1)
+        out["stale"] = bool(interval) and age > interval * self.stale_factor
+        if ent.get("error"):
+            out["last_error"] = ent["error"]
+        return out
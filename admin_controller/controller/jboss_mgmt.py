@@ -0,0 +1,177 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Клиент HTTP management API JBoss/WildFly (порт 9990, JSON DMR) вместо jboss-cli.sh.
+
+Каждый запуск jboss-cli.sh — старт JVM (2–5 с CPU); здесь операции идут POST'ом
+JSON на http://<controller>/management по keep-alive соединению:
+  - digest-аутентификация: challenge (nonce) запоминается и переиспользуется с
+    растущим nc — повторный 401 бывает только при смене/протухании nonce;
+  - composite(): несколько операций одним запросом (ответ — step-1..N);
+  - разорванное keep-alive соединение переоткрывается один раз.
+Ответ — словарь DMR как у jboss-cli (outcome/result/failure-description), так что
+разбор результатов общий. Клиенты кэшируются на (url, user) — get_client().
+"""
+from __future__ import annotations
+
+import hashlib
+import http.client
+import json
+import os
+import re
+import threading
+from typing import Any, Dict, List, Optional, Tuple
+from urllib.parse import urlparse
+
+Address = List[Dict[str, str]]
+
+class JBossMgmtError(RuntimeError):
+    pass
+
+def _md5(s: str) -> str:
+    return hashlib.md5(s.encode("utf-8")).hexdigest()
+
+def mgmt_url(controller: str) -> str:
+    """"host:9990" или полный URL → http://host:9990/management."""
+    if "://" not in controller:
+        controller = "http://" + controller
+    u = urlparse(controller)
+    return f"{u.scheme}://{u.netloc}{u.path if u.path not in ('', '/') else '/management'}"
+
+def address(path: str) -> Address:
+    """"/host=h1/server-config=server-one" → [{"host": "h1"}, {"server-config": "server-one"}]."""
+    out = []
+    for part in (p for p in path.strip("/").split("/") if p):
+        k, v = part.split("=", 1)
+        out.append({k: v})
+    return out
+
+class JBossMgmt:
+    def __init__(self, url: str, user: Optional[str] = None, password: Optional[str] = None, timeout: float = 5.0):
+        self.url = mgmt_url(url)
+        u = urlparse(self.url)
+        self.https = u.scheme == "https"
+        self.host, self.port = u.hostname or "127.0.0.1", u.port or (443 if self.https else 9990)
+        self.path = u.path or "/management"
+        self.user, self.password, self.timeout = user, password, timeout
+        self._conn: Optional[http.client.HTTPConnection] = None
+        self._challenge: Optional[Dict[str, str]] = None
+        self._nc = 0
+        self._lock = threading.Lock()  # одно соединение — запросы по очереди
+
+    # ---- транспорт ----
+    def _connect(self) -> http.client.HTTPConnection:
+        if self._conn is None:
+            cls = http.client.HTTPSConnection if self.https else http.client.HTTPConnection
+            self._conn = cls(self.host, self.port, timeout=self.timeout)
+        return self._conn
+
+    def close(self) -> None:
+        if self._conn is not None:
+            try: self._conn.close()
+            except Exception: pass
+            self._conn = None
+
+    def _authorization(self, method: str) -> Optional[str]:
+        ch = self._challenge
+        if not ch or not self.user:
+            return None
+        self._nc += 1
+        nc, cnonce = f"{self._nc:08x}", os.urandom(8).hex()
+        ha1 = _md5(f"{self.user}:{ch.get('realm', '')}:{self.password or ''}")
+        ha2 = _md5(f"{method}:{self.path}")
+        qop = "auth" if "auth" in (ch.get("qop") or "").split(",") else None
+        if qop:
+            resp = _md5(f"{ha1}:{ch['nonce']}:{nc}:{cnonce}:{qop}:{ha2}")
+        else:
+            resp = _md5(f"{ha1}:{ch['nonce']}:{ha2}")
+        parts = [f'username="{self.user}"', f'realm="{ch.get("realm", "")}"', f'nonce="{ch["nonce"]}"',
+                 f'uri="{self.path}"', f'response="{resp}"']
+        if ch.get("opaque"):
+            parts.append(f'opaque="{ch["opaque"]}"')
+        if ch.get("algorithm"):
+            parts.append(f'algorithm={ch["algorithm"]}')
+        if qop:
+            parts += [f"qop={qop}", f"nc={nc}", f'cnonce="{cnonce}"']
+        return "Digest " + ", ".join(parts)
+
+    @staticmethod
+    def _parse_challenge(header: str) -> Optional[Dict[str, str]]:
+        if not header or not header.lower().startswith("digest"):
+            return None
+        return {k.lower(): (q if q else v) for k, _, q, v in
+                re.findall(r'(\w+)=("([^"]*)"|([^,\s]*))', header[6:])}
+
+    def _post(self, body: bytes) -> Tuple[int, bytes]:
+        headers = {"Content-Type": "application/json", "Accept": "application/json"}
+        auth = self._authorization("POST")
+        if auth:
+            headers["Authorization"] = auth
+        for attempt in (1, 2):
+            conn = self._connect()
+            try:
+                conn.request("POST", self.path, body=body, headers=headers)
+                r = conn.getresponse()
+                data = r.read()
+                if (r.getheader("Connection") or "").lower() == "close":
+                    self.close()
+                if r.status == 401:
+                    self._challenge = self._parse_challenge(r.getheader("WWW-Authenticate") or "")
+                    self._nc = 0
+                return r.status, data
+            except (http.client.HTTPException, ConnectionError, OSError) as e:
+                self.close()  # keep-alive мог закрыться сервером — одна повторная попытка
+                if attempt == 2:
+                    raise JBossMgmtError(f"{self.url}: {e}") from e
+        raise JBossMgmtError(f"{self.url}: unreachable")
+
+    # ---- операции ----
+    def execute(self, op: Dict[str, Any]) -> Dict[str, Any]:
+        """Одна DMR-операция → ответ {"outcome": ..., "result": ...}."""
+        body = json.dumps(op).encode("utf-8")
+        with self._lock:
+            status, data = self._post(body)
+            if status == 401 and self._challenge and self.user:
+                status, data = self._post(body)  # с новым nonce
+        if status == 401:
+            raise JBossMgmtError(f"{self.url}: unauthorized")
+        try:
+            return json.loads(data.decode("utf-8") or "{}")
+        except ValueError:
+            raise JBossMgmtError(f"{self.url}: HTTP {status}, non-JSON response")
+
+    def op(self, operation: str, addr: Address | str = (), **params: Any) -> Dict[str, Any]:
+        a = address(addr) if isinstance(addr, str) else list(addr)
+        return self.execute({"operation": operation, "address": a, **params})
+
+    def composite(self, steps: List[Dict[str, Any]], rollback: bool = True) -> List[Dict[str, Any]]:
+        """
+        Несколько операций одним запросом; ответы шагов в порядке steps.
+        rollback=False — сбой одного шага не откатывает остальные (независимые хосты).
+        """
+        op: Dict[str, Any] = {"operation": "composite", "address": [], "steps": steps}
+        if not rollback:
+            op["operation-headers"] = {"rollback-on-runtime-failure": False}
+        res = self.execute(op)
+        results = res.get("result") or {}
+        return [results.get(f"step-{i + 1}") or {"outcome": res.get("outcome", "failed"),
+                                                 "failure-description": res.get("failure-description")}
+                for i in range(len(steps))]
+
+    def read_deployments(self) -> Dict[str, Any]:
+        """Как CLI :read-children-resources(child-type=deployment,include-runtime=true,recursive=true)."""
+        return self.op("read-children-resources", [], **{"child-type": "deployment",
+                                                         "include-runtime": True, "recursive": True})
+
+_CLIENTS: Dict[Tuple[str, Optional[str]], JBossMgmt] = {}
+_CLIENTS_LOCK = threading.Lock()
+
+def get_client(controller: str, user: Optional[str] = None, password: Optional[str] = None,
+               timeout: float = 5.0) -> JBossMgmt:
+    """Общий клиент на (url, user): keep-alive соединение и digest nonce переживают вызовы."""
+    key = (mgmt_url(controller), user)
+    with _CLIENTS_LOCK:
+        c = _CLIENTS.get(key)
+        if c is None or c.password != password:
+            c = _CLIENTS[key] = JBossMgmt(controller, user, password, timeout)
+        return c
@@ -0,0 +1,190 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Сэмплер CPU и процессов по /proc без fork (ps) и без sleep на пути запроса.
+
+Держит в памяти прошлые показания /proc/stat и /proc/<pid>/stat; CPU считается
+по разнице между соседними вызовами sample() (их частоту задаёт вызывающий —
+health_sampler по интервалу system). Опорные показания снимает prime() на старте
+процесса (api_server, CLI) — тогда уже первый sample() даёт текущую загрузку;
+без prime() первый вызов отдаёт средние с загрузки системы и window_sec = null.
+  - cpu.usage_pct — вся система, 0..100;
+  - процессы: cpu_pct как у top (100 = одно ядро), rss, mem_pct; топ-N по CPU и
+    по RSS — heapq.nlargest за один проход по /proc;
+  - JVM (regex по cmdline, JVM_PATTERN в health_checks) — история (cpu_pct, rss) на
+    PID и тренд: наклон за окно истории в %CPU/мин и байт/мин.
+Повторный вызов чаще min_interval_sec отдаёт прошлый результат (слишком короткое
+окно даёт шумные проценты).
+"""
+from __future__ import annotations
+
+import heapq
+import os
+import re
+import threading
+import time
+from collections import deque
+from typing import Any, Deque, Dict, List, Optional, Tuple
+
+CLK_TCK = os.sysconf("SC_CLK_TCK") if hasattr(os, "sysconf") else 100
+PAGE_SIZE = os.sysconf("SC_PAGE_SIZE") if hasattr(os, "sysconf") else 4096
+NCPU = os.cpu_count() or 1
+
+def _read(path: str) -> Optional[str]:
+    try:
+        with open(path, "r", encoding="utf-8", errors="ignore") as f:
+            return f.read()
+    except OSError:
+        return None
+
+def _cpu_total() -> Tuple[int, int]:
+    """(всего jiffies, idle+iowait) из строки cpu в /proc/stat."""
+    txt = _read("/proc/stat") or ""
+    for line in txt.splitlines():
+        if line.startswith("cpu "):
+            nums = [int(x) for x in line.split()[1:]]
+            idle = nums[3] + (nums[4] if len(nums) > 4 else 0)
+            # guest/guest_nice уже учтены в user/nice
+            return sum(nums[:8]), idle
+    return 0, 0
+
+def _mem_total() -> int:
+    for line in (_read("/proc/meminfo") or "").splitlines():
+        if line.startswith("MemTotal:"):
+            return int(line.split()[1]) * 1024
+    return 0
+
+def _slope(points: List[Tuple[float, float]]) -> float:
+    """Наклон МНК (единиц/сек)."""
+    n = len(points)
+    if n < 2:
+        return 0.0
+    mt = sum(t for t, _ in points) / n
+    mv = sum(v for _, v in points) / n
+    den = sum((t - mt) ** 2 for t, _ in points)
+    return sum((t - mt) * (v - mv) for t, v in points) / den if den else 0.0
+
+class ProcSampler:
+    def __init__(self, jvm_pattern: str = "jboss", history: int = 60, min_interval_sec: float = 1.0):
+        self.jvm_re = re.compile(jvm_pattern, re.I)
+        self.history = history
+        self.min_interval_sec = min_interval_sec
+        self._prev_cpu: Tuple[int, int] = (0, 0)
+        self._prev_ts = 0.0
+        # pid -> (starttime, ticks); starttime различает переиспользованный PID
+        self._prev_proc: Dict[int, Tuple[int, int]] = {}
+        self._cmd: Dict[Tuple[int, int], str] = {}
+        self._jvm_hist: Dict[Tuple[int, int], Deque[Tuple[float, float, int]]] = {}
+        self._last: Optional[Dict[str, Any]] = None
+        self._lock = threading.Lock()
+
+    def _scan(self) -> List[Tuple[int, int, str, int, int]]:
+        """[(pid, starttime, comm, ticks, rss_bytes)] по всем процессам."""
+        out = []
+        for name in os.listdir("/proc"):
+            if not name.isdigit():
+                continue
+            st = _read(f"/proc/{name}/stat")
+            if not st:
+                continue  # процесс успел завершиться
+            r = st.rfind(")")
+            comm = st[st.find("(") + 1:r]
+            f = st[r + 2:].split()
+            # поля после comm: f[0] = поле 3 (state) → поле N = f[N-3]
+            try:
+                ticks = int(f[11]) + int(f[12])
+                out.append((int(name), int(f[19]), comm, ticks, int(f[21]) * PAGE_SIZE))
+            except (IndexError, ValueError):
+                continue
+        return out
+
+    def _cmdline(self, pid: int, start: int) -> str:
+        key = (pid, start)
+        cmd = self._cmd.get(key)
+        if cmd is None:
+            cmd = (_read(f"/proc/{pid}/cmdline") or "").replace("\0", " ").strip()
+            self._cmd[key] = cmd
+        return cmd
+
+    def prime(self, wait_sec: float = 0.0) -> None:
+        """Опорные показания для первого sample(); wait_sec — подождать после них
+        (только вне пути запроса: старт процесса, CLI)."""
+        with self._lock:
+            if self._prev_ts:
+                return
+            self._prev_cpu = _cpu_total()
+            self._prev_proc = {pid: (start, ticks) for pid, start, _, ticks, _ in self._scan()}
+            self._prev_ts = time.time()
+        if wait_sec > 0:
+            time.sleep(wait_sec)
+
+    def sample(self, top_n: int = 5) -> Dict[str, Any]:
+        with self._lock:
+            now = time.time()
+            if self._last is not None and now - self._prev_ts < self.min_interval_sec:
+                return self._last
+            total, idle = _cpu_total()
+            ptotal, pidle = self._prev_cpu
+            first = self._prev_ts == 0.0
+            dt_total = total - ptotal
+            if dt_total > 0:
+                usage = 100.0 * (1.0 - (idle - pidle) / dt_total)
+            else:
+                usage = 0.0
+            mem_total = _mem_total()
+            uptime = float((_read("/proc/uptime") or "0").split()[0] or 0)
+
+            procs = []
+            cur: Dict[int, Tuple[int, int]] = {}
+            for pid, start, comm, ticks, rss in self._scan():
+                cur[pid] = (start, ticks)
+                prev = self._prev_proc.get(pid)
+                if prev and prev[0] == start and dt_total > 0:
+                    # доля всех CPU × NCPU → 100% = одно ядро (как top)
+                    cpu = 100.0 * NCPU * (ticks - prev[1]) / dt_total
+                else:
+                    age = max(1e-3, uptime - start / CLK_TCK)
+                    cpu = 100.0 * ticks / CLK_TCK / age
+                procs.append((pid, start, comm, round(cpu, 2), rss))
+
+            # JVM: история и тренд
+            alive = set()
+            jvms = []
+            for pid, start, comm, cpu, rss in procs:
+                if comm != "java" and not self.jvm_re.search(comm):
+                    continue
+                if not self.jvm_re.search(self._cmdline(pid, start)):
+                    continue
+                key = (pid, start)
+                alive.add(key)
+                h = self._jvm_hist.setdefault(key, deque(maxlen=self.history))
+                h.append((now, cpu, rss))
+                jvms.append({
+                    "pid": pid, "comm": comm, "cpu_pct": cpu, "rss": rss,
+                    "mem_pct": round(100.0 * rss / mem_total, 2) if mem_total else 0.0,
+                    "samples": len(h), "window_sec": round(h[-1][0] - h[0][0], 1),
+                    "trend": {"cpu_pct_per_min": round(60 * _slope([(t, c) for t, c, _ in h]), 2),
+                              "rss_bytes_per_min": int(60 * _slope([(t, r) for t, _, r in h]))},
+                })
+            for key in [k for k in self._jvm_hist if k not in alive]:
+                del self._jvm_hist[key]
+            live = {(p, s) for p, (s, _) in cur.items()}
+            for key in [k for k in self._cmd if k not in live]:
+                del self._cmd[key]
+
+            def row(p):
+                pid, _, comm, cpu, rss = p
+                return {"pid": pid, "comm": comm, "cpu_pct": cpu, "rss": rss,
+                        "mem_pct": round(100.0 * rss / mem_total, 2) if mem_total else 0.0}
+
+            out = {
+                "cpu": {"usage_pct": round(usage, 2), "ncpu": NCPU,
+                        "window_sec": None if first else round(now - self._prev_ts, 2)},
+                "top_cpu": [row(p) for p in heapq.nlargest(top_n, procs, key=lambda p: p[3])],
+                "top_rss": [row(p) for p in heapq.nlargest(top_n, procs, key=lambda p: p[4])],
+                "jvm": jvms,
+                "procs": len(procs),
+            }
+            self._prev_cpu, self._prev_ts, self._prev_proc = (total, idle), now, cur
+            self._last = out
+            return out
@@ -28,14 +28,59 @@ def count_enabled(conf) -> tuple:
             enabled += 1
     return (enabled, total)
 
-def set_state(conf, server: str, action: str):
-    socket = conf["socket"]
+def load_stats(conf) -> list:
+    """Строки show stat бэкенда conf["backend"] (серверы + BACKEND) — для прогноза ёмкости."""
+    out = _run("show stat -1 6 -1", conf["socket"])
+    lines = [ln[2:] if ln.startswith("# ") else ln for ln in out.splitlines() if ln.strip()]
+    rows = list(csv.reader(lines))
+    if not rows: return []
+    headers = rows[0]
+    data = [{headers[i]: (r[i] if i < len(r) else "") for i in range(len(headers))} for r in rows[1:]]
+    return [r for r in data if r.get("pxname") == conf.get("backend")]
+
+def probe_all(conf) -> dict:
+    """{svname: enabled} серверов conf["backend"] за один show stat."""
+    res = {}
+    for row in load_stats(conf):
+        sv = row.get("svname","")
+        if sv in ("BACKEND","FRONTEND",""): continue
+        status = (row.get("status","") or "").upper()
+        admin  = (row.get("admin","")  or "").upper()
+        res[sv] = status in ("UP","OPEN") and "MAINT" not in admin
+    return res
+
+def _cmd(conf, server: str, action: str) -> str:
     backend, srv = server.split("/",1) if "/" in server else (conf["backend"], server)
     if action == "enable":
-        _run(f"enable server {backend}/{srv}", socket)
+        return f"enable server {backend}/{srv}"
     elif action == "disable":
-        _run(f"disable server {backend}/{srv}", socket)
+        return f"disable server {backend}/{srv}"
     elif action == "drain":
-        _run(f"set server {backend}/{srv} state drain", socket)
+        return f"set server {backend}/{srv} state drain"
     else:
         raise ValueError("unknown action")
+
+def set_state(conf, server: str, action: str):
+    out = _run(_cmd(conf, server, action), conf["socket"]).strip()
+    if out:
+        raise RuntimeError(out)
+
+def set_state_many(conf, items: list) -> list:
+    """
+    Все команды одной строкой через ';' (одно соединение с сокетом).
+    Успешные enable/disable/set state ничего не печатают; если ответ непустой —
+    команды идемпотентны, поэтому повторяем их по одной, чтобы привязать ошибку к серверу.
+    """
+    cmds = [_cmd(conf, s, a) for s, a in items]
+    if not cmds:
+        return []
+    if not _run("; ".join(cmds), conf["socket"]).strip():
+        return [None] * len(cmds)
+    errs = []
+    for c in cmds:
+        try:
+            out = _run(c, conf["socket"]).strip()
+            errs.append(out or None)
+        except Exception as e:
+            errs.append(str(e))
+    return errs
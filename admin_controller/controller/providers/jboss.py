@@ -5,9 +5,21 @@ count_enabled: пингуем health-URL или CLI read-attribute server-state.
 set_state: можно выключать ноду из балансера через внешние механизмы
 (например, HAProxy/nginx), либо выполнить cli-команду suspend/shutdown.
 Здесь показан CLI-скелет; адаптируйте под ваш домен/standalone.
+probe_all: одна операция с wildcard по хостам (/host=*/server-config=...) —
+один запуск jboss-cli (JVM) вместо запуска на каждый хост.
+
+Если в provider_conf задан "controller" (domain controller, host:9990 или URL) —
+всё идёт через HTTP management API (controller/jboss_mgmt.py) без jboss-cli:
+probe_all — один composite read-attribute по всем хостам, set_state_many —
+один composite со всеми start/suspend/stop. "user"/"password" — digest-аутентификация.
 """
-import subprocess
-from typing import Tuple
+import json, subprocess
+from typing import Dict, List, Tuple
+
+try:
+    from controller.jboss_mgmt import get_client
+except ImportError:  # запуск файлом из каталога controller/
+    from jboss_mgmt import get_client
 
 def _run(cmd: list) -> str:
     r = subprocess.run(cmd, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
@@ -15,7 +27,45 @@ def _run(cmd: list) -> str:
         raise RuntimeError(r.stderr.decode("utf-8","ignore"))
     return r.stdout.decode("utf-8","ignore")
 
+def _mgmt(conf):
+    return get_client(conf["controller"], conf.get("user"), conf.get("password"),
+                      timeout=float(conf.get("timeout", 10)))
+
+def _sc_addr(conf, host: str) -> list:
+    return [{"host": host}, {"server-config": conf.get("server_config","server-one")}]
+
+def _steps(conf, server: str, action: str) -> List[dict]:
+    addr = _sc_addr(conf, server)  # server: имя хоста из списка
+    if action == "enable":
+        return [{"operation": "start", "address": addr}]
+    elif action in ("disable","drain"):
+        # drain: suspend; disable: stop (упростим)
+        steps = [{"operation": "suspend", "address": addr, "timeout": 60}] if action == "drain" else []
+        return steps + [{"operation": "stop", "address": addr}]
+    raise ValueError("unknown action")
+
+def probe_all(conf) -> Dict[str, bool]:
+    hosts = conf["hosts"]
+    if conf.get("controller"):
+        steps = [{"operation": "read-attribute", "address": _sc_addr(conf, h), "name": "status"} for h in hosts]
+        return {h: r.get("outcome") == "success" and str(r.get("result","")).lower() in ("running","started")
+                for h, r in zip(hosts, _mgmt(conf).composite(steps))}
+    cli = conf.get("cli","/opt/jboss/bin/jboss-cli.sh")
+    sc = conf.get("server_config","server-one")
+    out = _run([cli,"--connect","--output-json",
+                f"/host=*/server-config={sc}:read-attribute(name=status)"])
+    res = {h: False for h in hosts}
+    for item in json.loads(out).get("result") or []:
+        addr = {k: v for a in item.get("address", []) for k, v in a.items()}
+        h = addr.get("host")
+        if h in res and item.get("outcome") == "success":
+            res[h] = str(item.get("result","")).lower() in ("running","started")
+    return res
+
 def count_enabled(conf) -> Tuple[int,int]:
+    if conf.get("controller"):
+        states = probe_all(conf)
+        return (sum(states.values()), len(states))
     # Простейшая эвристика: считаем нодой "enabled", если cli вернул server-state=running
     cli = conf.get("cli","/opt/jboss/bin/jboss-cli.sh")
     hosts = conf["hosts"]
@@ -31,6 +81,11 @@ def count_enabled(conf) -> Tuple[int,int]:
     return (enabled, len(hosts))
 
 def set_state(conf, server: str, action: str):
+    if conf.get("controller"):
+        err = set_state_many(conf, [(server, action)])[0]
+        if err:
+            raise RuntimeError(err)
+        return
     cli = conf.get("cli","/opt/jboss/bin/jboss-cli.sh")
     host = server  # server: имя хоста из списка
     if action == "enable":
@@ -42,3 +97,27 @@ def set_state(conf, server: str, action: str):
         _run([cli,"--connect",f"/host={host}/server-config=server-one:stop()"])
     else:
         raise ValueError("unknown action")
+
+def set_state_many(conf, items: list) -> list:
+    """HTTP: все операции одним composite; иначе — по одной через jboss-cli."""
+    if not conf.get("controller"):
+        errs = []
+        for server, action in items:
+            try:
+                set_state(conf, server, action); errs.append(None)
+            except Exception as e:
+                errs.append(str(e))
+        return errs
+    steps, spans = [], []
+    for server, action in items:
+        st = _steps(conf, server, action)
+        spans.append((len(steps), len(st)))
+        steps += st
+    if not steps:
+        return []
+    results = _mgmt(conf).composite(steps, rollback=False)
+    errs = []
+    for start, n in spans:
+        bad = [r for r in results[start:start + n] if r.get("outcome") != "success"]
+        errs.append(str(bad[0].get("failure-description") or "failed") if bad else None)
+    return errs
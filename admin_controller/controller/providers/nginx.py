@@ -11,7 +11,9 @@
 """
 import re, subprocess
 from pathlib import Path
-from typing import Tuple
+from typing import Dict, Tuple
+
+_SERVER_RE = re.compile(r'^\s*(#\s*)?server\s+([^;]+);\s*$', re.MULTILINE)
 
 def _reload(cmd: str):
     r = subprocess.run(cmd, shell=True)
@@ -24,6 +26,13 @@ def _read(conf_path: str) -> str:
 def _write(conf_path: str, content: str):
     Path(conf_path).write_text(content, encoding="utf-8")
 
+def probe_all(conf) -> Dict[str, bool]:
+    """{'10.0.0.11:8080': True, ...} за один разбор файла; закомментированный — False."""
+    res = {}
+    for m in _SERVER_RE.finditer(_read(conf["upstream_conf"])):
+        res[m.group(2).strip()] = not m.group(1)
+    return res
+
 def count_enabled(conf) -> Tuple[int,int]:
     text = _read(conf["upstream_conf"])
     # считаем строки "server X;" которые НЕ закомментированы
@@ -31,31 +40,53 @@ def count_enabled(conf) -> Tuple[int,int]:
     total   = enabled + len(re.findall(r'^\s*#\s*server\s+[^;]+;\s*$', text, flags=re.MULTILINE))
     return (enabled, total)
 
-def set_state(conf, server: str, action: str):
-    """
-    server передаётся как '10.0.0.11:8080' (ровно как в конфиге).
-    """
-    path = conf["upstream_conf"]; reload_cmd = conf.get("reload_cmd","nginx -s reload")
-    text = _read(path)
+def _apply(text: str, server: str, action: str) -> Tuple[str, bool]:
     # нормализуем пробелы
     srv_pattern = re.escape(server)
     enabled_line = re.compile(rf'(^\s*)server\s+{srv_pattern};\s*$', re.MULTILINE)
     disabled_line= re.compile(rf'(^\s*)#\s*server\s+{srv_pattern};\s*$', re.MULTILINE)
-    changed = False
 
     if action == "enable":
         # раскомментировать, если закомментирован
         if disabled_line.search(text):
-            text = disabled_line.sub(r"\1server " + server + ";", text, count=1)
-            changed = True
+            return disabled_line.sub(r"\1server " + server + ";", text, count=1), True
     elif action in ("disable","drain"):
         # закомментировать, если включён
         if enabled_line.search(text):
-            text = enabled_line.sub(r"\1# server " + server + ";", text, count=1)
-            changed = True
+            return enabled_line.sub(r"\1# server " + server + ";", text, count=1), True
     else:
         raise ValueError("unknown action")
+    return text, False
 
+def set_state_many(conf, items: list) -> list:
+    """
+    Все правки за один проход по файлу, затем один `nginx -t` и один reload.
+    Если проверка конфига не прошла — файл возвращается как был.
+    """
+    path = conf["upstream_conf"]; reload_cmd = conf.get("reload_cmd","nginx -s reload")
+    orig = text = _read(path)
+    errs: list = []
+    changed = False
+    for server, action in items:
+        try:
+            text, ch = _apply(text, server, action)
+            changed = changed or ch
+            errs.append(None)
+        except Exception as e:
+            errs.append(str(e))
     if changed:
         _write(path, text)
+        test_cmd = conf.get("test_cmd","nginx -t")
+        if test_cmd and subprocess.run(test_cmd, shell=True).returncode != 0:
+            _write(path, orig)
+            raise RuntimeError("nginx -t failed, upstream conf restored")
         _reload(reload_cmd)
+    return errs
+
+def set_state(conf, server: str, action: str):
+    """
+    server передаётся как '10.0.0.11:8080' (ровно как в конфиге).
+    """
+    err = set_state_many(conf, [(server, action)])[0]
+    if err:
+        raise ValueError(err)
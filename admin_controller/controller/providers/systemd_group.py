@@ -2,9 +2,11 @@
 """
 Пул как набор systemd-юнитов. enable/disable: старт/стоп конкретного юнита.
 server — имя юнита, например "svc-a.service".
+probe_all: один `systemctl show -p Id -p ActiveState u1 u2 ...` на весь пул.
 """
 import subprocess
-from typing import Tuple
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, Tuple
 
 def _run(cmd: list) -> str:
     r = subprocess.run(cmd, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
@@ -12,17 +14,22 @@ def _run(cmd: list) -> str:
         raise RuntimeError(r.stderr.decode("utf-8","ignore"))
     return r.stdout.decode("utf-8","ignore")
 
-def count_enabled(conf) -> Tuple[int,int]:
+def probe_all(conf) -> Dict[str, bool]:
     units = conf["units"]
-    enabled = 0
-    for u in units:
-        try:
-            out = _run(["systemctl","is-active",u])
-            if out.strip() in ("active","activating"):
-                enabled += 1
-        except Exception:
-            pass
-    return (enabled, len(units))
+    out = _run(["systemctl","show","-p","Id","-p","ActiveState","--",*units])
+    # блоки "Id=...\nActiveState=..." через пустую строку, в порядке аргументов
+    blocks = [b for b in out.strip().split("\n\n") if b.strip()]
+    if len(blocks) != len(units):
+        raise RuntimeError(f"systemctl show: {len(blocks)} blocks for {len(units)} units")
+    res = {}
+    for u, b in zip(units, blocks):
+        kv = dict(ln.split("=", 1) for ln in b.splitlines() if "=" in ln)
+        res[u] = kv.get("ActiveState","") in ("active","activating")
+    return res
+
+def count_enabled(conf) -> Tuple[int,int]:
+    states = probe_all(conf)
+    return (sum(states.values()), len(states))
 
 def set_state(conf, server: str, action: str):
     if server not in conf["units"]:
@@ -34,3 +41,15 @@ def set_state(conf, server: str, action: str):
         _run(["systemctl","stop",server])
     else:
         raise ValueError("unknown action")
+
+def set_state_many(conf, items: list) -> list:
+    """start/stop юнитов параллельно (conf.parallel, по умолчанию 8)."""
+    def one(it):
+        try:
+            set_state(conf, *it); return None
+        except Exception as e:
+            return str(e) or type(e).__name__
+    if not items:
+        return []
+    with ThreadPoolExecutor(max_workers=max(1, min(len(items), int(conf.get("parallel", 8))))) as ex:
+        return list(ex.map(one, items))
@@ -6,6 +6,11 @@
 - Читает правила из RULES_FILE (env) или $PC_BASE/report/rules.json
 - Общается с HAProxy Runtime через UNIX-сокет (без shell/socat)
 - Если после drain/disable останется < min_enabled — кладёт задачу в очередь deferred.csv
+  (одна строка на (backend, server, action), attempts/reason обновляются — deferred_store.py)
+- То же, если прогноз утилизации оставшихся серверов > max_util (см. capacity.py);
+  цифры прогноза пишутся в reason очереди
+- safe_toggle_many: пачка действий — один снимок stats, один план, команды
+  одной строкой в сокет под локами всех затронутых бэкендов
 - CLI:
     --action {drain,disable,enable,retry}
     --backend <name> --server <name>   (для drain/disable/enable)
@@ -16,10 +21,17 @@ ENV:
 """
 
 from __future__ import annotations
-import csv, json, os, sys, fcntl, time, tempfile, contextlib, re, socket
+import csv, json, os, sys, fcntl, time, contextlib, re, socket
 from pathlib import Path
 from typing import List, Dict, Tuple
 
+try:
+    from controller import capacity
+    from controller.deferred_store import DeferredStore
+except ImportError:  # запуск файлом из каталога controller/
+    import capacity
+    from deferred_store import DeferredStore
+
 # --- базовые пути
 PC_BASE = Path(os.environ.get("PC_BASE", "/tmp/pattern_controller"))
 BASE_DIR = PC_BASE
@@ -30,6 +42,7 @@ LOGS     = BASE_DIR / "logs"
 LOCKS_DIR  = SIGNALS / "locks"
 QUEUE_DIR  = SIGNALS / "queue"
 QUEUE_FILE = QUEUE_DIR / "deferred.csv"
+LEARNED_CAPACITY = REPORT / "capacity_learned.json"
 
 # ENV с возможностью переопределить файл правил и сокет
 HAPROXY_SOCKET = os.environ.get("HAPROXY_SOCKET", "/var/lib/haproxy/haproxy.sock")
@@ -56,8 +69,8 @@ def load_rules() -> Dict:
     """
     rules.json:
     {
-      "global":  { "min_enabled": 4 },
-      "backends": { "Jboss_client": { "min_enabled": 4 } }
+      "global":  { "min_enabled": 4, "max_util": 0.8 },
+      "backends": { "Jboss_client": { "min_enabled": 4, "capacity": { "scur": 200, "rate": 150 } } }
     }
     """
     try:
@@ -102,8 +115,10 @@ def _send_runtime(cmd: str, timeout: float = 3.0) -> str:
         except Exception: pass
 
 def get_stats() -> List[Dict[str, str]]:
-    out = _send_runtime("show stat -1 2 -1")
-    lines = [ln for ln in out.splitlines() if ln and not ln.startswith("#")]
+    # backends (2) + servers (4): строки серверов и BACKEND (очередь бэкенда)
+    out = _send_runtime("show stat -1 6 -1")
+    # заголовок CSV приходит строкой "# pxname,svname,..."
+    lines = [ln[2:] if ln.startswith("# ") else ln for ln in out.splitlines() if ln.strip()]
     if not lines:
         return []
     reader = csv.reader(lines)
@@ -119,6 +134,15 @@ def list_backend_servers(backend: str) -> List[Dict[str, str]]:
     stats = get_stats()
     return [r for r in stats if r.get("pxname") == backend and r.get("svname") not in ("BACKEND", "")]
 
+def capacity_check(backend: str, server: str, rules: Dict) -> Tuple[bool, str]:
+    """Прогноз утилизации оставшихся серверов, если снять server (и заодно обучение ёмкости)."""
+    rows = [r for r in get_stats() if r.get("pxname") == backend]
+    cconf = capacity.capacity_conf(rules, backend)
+    learned = capacity.learn(rows, backend, LEARNED_CAPACITY, cconf)
+    ok, reason, _ = capacity.project(rows, server, cconf, learned)
+    log(f"[CAPACITY] {backend}/{server}: {'ok' if ok else 'refuse'} {reason}")
+    return ok, reason
+
 def server_is_enabled(row: Dict[str, str]) -> bool:
     status = (row.get("status") or "").upper()
     admin  = (row.get("admin")  or "").upper()
@@ -160,14 +184,12 @@ def disable_server(backend: str, server: str):
     _send_runtime(f"disable server {backend}/{server}")
     log(f"[DISABLE] {backend}/{server}")
 
+def deferred_store() -> DeferredStore:
+    return DeferredStore(QUEUE_FILE, "backend")
+
 def enqueue_deferred(action: str, backend: str, server: str, reason: str):
     ensure_dirs()
-    new = not QUEUE_FILE.exists()
-    with QUEUE_FILE.open("a", encoding="utf-8", newline="") as f:
-        w = csv.writer(f, delimiter=';')
-        if new:
-            w.writerow(["ts","action","backend","server","reason"])
-        w.writerow([time.strftime("%Y-%m-%d %H:%M:%S"), action, backend, server, reason])
+    deferred_store().add(action, backend, server, reason)
     log(f"[DEFER]  {action} {backend}/{server} — {reason}")
 
 def _validate_names(backend: str, server: str):
@@ -211,6 +233,12 @@ def safe_toggle(action: str, backend: str, server: str):
             )
             return
 
+        if server_is_enabled(row):
+            ok, why = capacity_check(backend, server, rules)
+            if not ok:
+                enqueue_deferred(action, backend, server, reason=why)
+                return
+
         if action == "drain":
             drain_server(backend, server)
         elif action == "disable":
@@ -218,59 +246,128 @@ def safe_toggle(action: str, backend: str, server: str):
         else:
             raise ValueError("unknown action")
 
-def retry_deferred_once():
-    """Один проход по очереди: если активных нод стало > min_enabled — выполняем отложенные действия."""
-    if not QUEUE_FILE.exists():
-        log("[RETRY] deferred queue is empty")
-        return
-
-    rules = load_rules()
-    with QUEUE_FILE.open("r", encoding="utf-8") as f:
-        rdr = csv.DictReader(f, delimiter=';')
-        rows = list(rdr)
-
-    remaining = []
-    for r in rows:
-        action  = r.get("action","")
-        backend = r.get("backend","")
-        server  = r.get("server","")
+_CMD = {"enable": "enable server {}/{}", "drain": "set server {}/{} state drain", "disable": "disable server {}/{}"}
 
+def safe_toggle_many(items: List[Tuple[str, str, str]], min_floor: int = 0, defer: bool = True) -> List[Dict]:
+    """
+    items: [(action, backend, server), ...] → результат на каждый элемент:
+      {"action","backend","server","status": applied|deferred|rejected|error, "reason"?}
+    План строится по одному снимку stats: drain/disable идут в порядке списка, пока
+    остаётся >= min_enabled (и прогноз ёмкости в норме), остальные — в deferred.csv.
+    enable в плане не добавляет активных (сервер войдёт в трафик после health-check).
+    min_floor — внешний жёсткий минимум (MIN_ACTIVE_NODES API): ниже него — rejected, без очереди.
+    defer=False — отложенные только помечаются в результате (retry сам обновляет очередь).
+    """
+    res: List[Dict] = []
+    for action, backend, server in items:
+        r = {"action": action, "backend": backend, "server": server}
         try:
             _validate_names(backend, server)
-            with with_lock(backend):
-                min_enabled = get_min_enabled(backend, rules)
-                row = get_server_row(backend, server)
-                enabled_now, _ = count_enabled(backend)
-                if action in ("drain","disable"):
-                    would_left = enabled_now - (1 if (row and server_is_enabled(row)) else 0)
-                    if would_left < min_enabled:
-                        r["reason"] = f"would_left={would_left} < min={min_enabled}"
-                        remaining.append(r)
+            if action not in _CMD:
+                raise ValueError("bad action")
+        except ValueError as e:
+            r.update(status="error", reason=str(e))
+        res.append(r)
+    todo = [r for r in res if "status" not in r]
+    if not todo:
+        return res
+    to_defer: List[Tuple[str, str, str, str]] = []
+    rules = load_rules()
+    backends = sorted({r["backend"] for r in todo})
+    try:
+        _plan_and_apply(todo, backends, rules, min_floor, to_defer)
+    finally:
+        # отложенные сохраняем, даже если применение упало
+        if defer and to_defer:
+            ensure_dirs()
+            deferred_store().add_many(to_defer)
+            for action, be, srv, why in to_defer:
+                log(f"[DEFER]  {action} {be}/{srv} — {why}")
+    return res
+
+def _send_checked(cmd: str) -> str | None:
+    """None — команда прошла молча; иначе ответ HAProxy или текст ошибки сокета."""
+    try:
+        return _send_runtime(cmd).strip() or None
+    except Exception as e:
+        return f"{type(e).__name__}: {e}"
+
+def _plan_and_apply(todo: List[Dict], backends: List[str], rules: Dict, min_floor: int,
+                    to_defer: List[Tuple[str, str, str, str]]) -> None:
+    """План и применение для safe_toggle_many: статусы — в todo, отложенные — в to_defer."""
+    with contextlib.ExitStack() as st:
+        for be in backends:  # в одном порядке — без взаимных блокировок
+            st.enter_context(with_lock(be))
+        stats = get_stats()
+        by_be = {be: [dict(x) for x in stats if x.get("pxname") == be] for be in backends}
+        left = {be: sum(1 for x in rows if x.get("svname") not in ("BACKEND", "") and server_is_enabled(x))
+                for be, rows in by_be.items()}
+        cconf = {be: capacity.capacity_conf(rules, be) for be in backends}
+        learned = {be: capacity.learn(rows, be, LEARNED_CAPACITY, cconf[be]) for be, rows in by_be.items()}
+
+        planned = []
+        for r in todo:
+            action, be, srv = r["action"], r["backend"], r["server"]
+            if action in ("drain", "disable"):
+                row = next((x for x in by_be[be] if x.get("svname") == srv), None)
+                if row is None:
+                    r.update(status="deferred", reason="server not found in stats")
+                    to_defer.append((action, be, srv, r["reason"])); continue
+                if server_is_enabled(row):
+                    min_enabled = get_min_enabled(be, rules)
+                    if left[be] - 1 < min_floor:
+                        r.update(status="rejected", reason=f"minimum {min_floor} active nodes required")
                         continue
-                    if action == "drain":
-                        drain_server(backend, server)
-                    else:
-                        disable_server(backend, server)
+                    if left[be] - 1 < min_enabled:
+                        r.update(status="deferred", reason=f"would_left={left[be] - 1} < min={min_enabled}")
+                        to_defer.append((action, be, srv, r["reason"])); continue
+                    ok, why, _ = capacity.project(by_be[be], srv, cconf[be], learned[be])
+                    if not ok:
+                        r.update(status="deferred", reason=why)
+                        to_defer.append((action, be, srv, why)); continue
+                    # следующие решения — уже без этого сервера
+                    left[be] -= 1
+                    row["admin"] = row["status"] = "MAINT"
+            planned.append(r)
+
+        if planned:
+            cmds = [_CMD[r["action"]].format(r["backend"], r["server"]) for r in planned]
+            errs: List[str | None] = [None] * len(cmds)
+            if _send_checked("; ".join(cmds)):
+                # команды идемпотентны — повторяем по одной, чтобы понять, какая не прошла;
+                # ошибка одной команды (в т.ч. сокета) помечает только её элемент
+                errs = [_send_checked(c) for c in cmds]
+            for r, err in zip(planned, errs):
+                if err:
+                    r.update(status="error", reason=err)
                 else:
-                    enable_server(backend, server)
-        except Exception as e:
-            r["reason"] = f"error: {e}"
-            remaining.append(r)
-
-    if remaining:
-        with tempfile.NamedTemporaryFile("w", delete=False, encoding="utf-8", newline="") as tf:
-            w = csv.DictWriter(tf, fieldnames=["ts","action","backend","server","reason"], delimiter=';')
-            w.writeheader()
-            for r in remaining:
-                if "reason" not in r:
-                    r["reason"] = "still not enough enabled"
-                w.writerow(r)
-        os.replace(tf.name, QUEUE_FILE)
-        log(f"[RETRY] remaining deferred: {len(remaining)}")
-    else:
-        try: QUEUE_FILE.unlink()
-        except FileNotFoundError: pass
-        log("[RETRY] deferred queue cleared")
+                    r["status"] = "applied"
+                log(f"[BATCH {r['action'].upper()}] {r['backend']}/{r['server']} {r['status']}"
+                    + (f" — {err}" if err else ""))
+
+def retry_deferred_once():
+    """
+    Один проход по очереди: все отложенные — одним планом safe_toggle_many (снимок stats
+    и лок на бэкенд один раз), выполненные удаляются, остальные обновляются на месте;
+    строки с ошибкой применения DEFERRED_MAX_ERRORS раз подряд снимаются (deferred_store).
+    """
+    store = deferred_store()
+    queued = store.load()
+    if not queued:
+        log("[RETRY] deferred queue is empty")
+        return
+
+    # enable первыми: в плане они не добавляют активных, но и не должны ждать за drain
+    rows = sorted(queued.values(), key=lambda r: r.get("action") != "enable")
+    res = safe_toggle_many([(r.get("action",""), r.get("backend",""), r.get("server","")) for r in rows],
+                           defer=False)
+    done = [store.key(r) for r in res if r["status"] == "applied"]
+    failed = {store.key(r): (r.get("reason","") if r["status"] == "deferred" else f"error: {r.get('reason','')}")
+              for r in res if r["status"] != "applied"}
+    left, dropped = store.settle(done, failed)
+    for r in dropped:
+        log(f"[DROP]   {r.get('action')} {r.get('backend')}/{r.get('server')} after {r.get('errors')} errors — {r.get('reason')}")
+    log(f"[RETRY] applied: {len(done)}, remaining deferred: {left}" if left else "[RETRY] deferred queue cleared")
 
 if __name__ == "__main__":
     import argparse
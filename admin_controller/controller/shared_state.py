@@ -0,0 +1,306 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Состояние, общее для процессов api_server (--workers N): rate-limit, nonce HMAC (replay),
+ключи идемпотентности.
+
+Один процесс — LocalState в памяти. В pre-fork режиме LocalState держит master и
+обслуживает воркеров по unix-сокету (StateServer — однопоточный selectors-цикл: в master
+нет потоков, и fork новых воркеров безопасен); воркеры ходят через StateClient —
+постоянное соединение на поток, запрос и ответ — строка JSON. Так N воркеров видят один
+лимит на IP и один набор nonce. Если master недоступен, воркер временно работает на своей
+LocalState (защита сужается до процесса, но запросы не падают).
+Хранилище ограничено: истечение по timing wheel, rate-limit — token bucket; всё O(1)
+на запрос. Два пространства по STATE_MAX_KEYS ключей: вёдра rate-limit вытесняются по
+LRU (потеря ведра лишь обнуляет лимит IP), а nonce и ключи идемпотентности до истечения
+TTL не вытесняются никогда — вытесненный nonce открыл бы повтор подписанного запроса.
+Переполнение второго — StateFull (api_server отвечает 503).
+get_state()/set_state() — бэкенд текущего процесса (им пользуются api_server и auth).
+"""
+from __future__ import annotations
+
+import json
+import os
+import selectors
+import socket
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Dict, List, Optional, Tuple
+
+MAX_KEYS = int(os.environ.get("STATE_MAX_KEYS", "100000"))
+
+class StateFull(Exception):
+    """Нет места под nonce/ключ идемпотентности: все max_keys ещё не истекли."""
+
+class ExpiringStore:
+    """
+    Ключи с TTL за O(1): OrderedDict в порядке LRU + timing wheel (slots корзин по tick
+    секунд). Ключ лежит в корзине своего срока; advance() проходит только корзины,
+    чьё время наступило, — без просмотра всего словаря. TTL длиннее оборота колеса
+    остаётся в корзине до нужного оборота. Больше max_keys: evict=True — вытесняется
+    самый давно использованный ключ (evictions), evict=False — новый ключ не
+    принимается (StateFull, rejected). Не потокобезопасно — под локом LocalState.
+    """
+    def __init__(self, max_keys: int = MAX_KEYS, tick: float = 1.0, slots: int = 4096, evict: bool = True):
+        self.max_keys = max(1, max_keys)
+        self.evict = evict
+        self.tick, self._slots = tick, slots
+        self._data: "OrderedDict[str, List[Any]]" = OrderedDict()  # key -> [expires_at, value]
+        self._wheel: List[set] = [set() for _ in range(slots)]
+        self._cur = int(time.time() / tick)  # последний обработанный tick
+        self.evictions = 0
+        self.expired = 0
+        self.rejected = 0
+
+    def _slot(self, exp: float) -> set:
+        # следующий tick после срока: при обработке корзины ключ уже гарантированно истёк
+        return self._wheel[(int(exp / self.tick) + 1) % self._slots]
+
+    def advance(self, now: float) -> None:
+        target = int(now / self.tick)
+        self._cur = max(self._cur, target - self._slots)  # за один оборот пройдены все корзины
+        while self._cur < target:
+            self._cur += 1
+            bucket = self._wheel[self._cur % self._slots]
+            for k in [k for k in bucket if self._data[k][0] <= now]:
+                bucket.discard(k)
+                del self._data[k]
+                self.expired += 1
+
+    def get(self, key: str, now: float) -> Any:
+        ent = self._data.get(key)
+        if ent is None or ent[0] <= now:
+            return None
+        self._data.move_to_end(key)
+        return ent[1]
+
+    def put(self, key: str, expires_at: float, value: Any) -> None:
+        old = self._data.get(key)
+        if old is None and not self.evict and len(self._data) >= self.max_keys:
+            self.rejected += 1
+            raise StateFull(f"state store full ({self.max_keys} unexpired keys)")
+        if old is not None:
+            self._slot(old[0]).discard(key)
+        self._data[key] = [expires_at, value]
+        self._data.move_to_end(key)
+        self._slot(expires_at).add(key)
+        while len(self._data) > self.max_keys:
+            k, ent = self._data.popitem(last=False)
+            self._slot(ent[0]).discard(k)
+            self.evictions += 1
+
+    def __len__(self) -> int:
+        return len(self._data)
+
+class LocalState:
+    """
+    Rate-limit — в своём ExpiringStore с LRU-вытеснением; nonce и идемпотентность — в
+    отдельном, без вытеснения:
+      rate_hit — token bucket (limit токенов, пополнение limit/window в секунду); ведро
+        живёт, пока не наполнится снова, — потом оно неотличимо от нового;
+      put_if_absent — ключ с TTL; хранилище заполнено неистёкшими — StateFull.
+    Память ограничена даже при потоке уникальных IP/nonce (evictions и rejected в
+    /metrics покажут, что max_keys мал).
+    """
+    def __init__(self, max_keys: int = MAX_KEYS):
+        self._lock = threading.Lock()
+        self._rate = ExpiringStore(max_keys)
+        self._keys = ExpiringStore(max_keys, evict=False)
+
+    def rate_hit(self, key: str, limit: int, window: float) -> bool:
+        """Учесть запрос; True — лимит исчерпан (limit запросов за window секунд)."""
+        now = time.time()
+        rate = limit / window if window > 0 and limit > 0 else 0.0
+        with self._lock:
+            self._rate.advance(now)
+            ent = self._rate.get(key, now)
+            if ent is None:
+                tokens = float(limit)
+            else:
+                tokens, last = ent
+                tokens = min(float(limit), tokens + (now - last) * rate)
+            limited = tokens < 1.0
+            if not limited:
+                tokens -= 1.0
+            full_in = (limit - tokens) / rate if rate else window
+            self._rate.put(key, now + max(full_in, self._rate.tick), (tokens, now))
+            return limited
+
+    def put_if_absent(self, key: str, ttl: float, value: Any = True) -> Any:
+        """None — ключ новый (сохранён на ttl секунд); иначе — ранее сохранённое значение.
+        StateFull — места нет (ключ не сохранён)."""
+        now = time.time()
+        with self._lock:
+            self._keys.advance(now)
+            cur = self._keys.get(key, now)
+            if cur is not None:
+                return cur
+            self._keys.put(key, now + ttl, value)
+            return None
+
+    def stats(self) -> Dict[str, int]:
+        with self._lock:
+            now = time.time()
+            self._rate.advance(now)
+            self._keys.advance(now)
+            r, k = self._rate, self._keys
+            return {"keys": len(r) + len(k), "rate_keys": len(r), "replay_keys": len(k), "max_keys": k.max_keys,
+                    "evictions": r.evictions, "expired": r.expired + k.expired, "rejected": k.rejected}
+
+    def call(self, req: Dict[str, Any]) -> Any:
+        """Запрос StateClient → метод."""
+        op = req.get("op")
+        if op == "rate":
+            return self.rate_hit(req["key"], int(req["limit"]), float(req["window"]))
+        if op == "put":
+            return self.put_if_absent(req["key"], float(req["ttl"]), req.get("value", True))
+        if op == "stats":
+            return self.stats()
+        raise ValueError(f"unknown op: {op!r}")
+
+class StateServer:
+    """Unix-сокет master'а; serve_once() вызывается из его цикла между проверками воркеров."""
+    def __init__(self, path: str, state: Optional[LocalState] = None):
+        self.path = path
+        self.state = state or LocalState()
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        try:
+            os.unlink(path)
+        except FileNotFoundError:
+            pass
+        self.sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        self.sock.bind(path)
+        os.chmod(path, 0o600)
+        self.sock.listen(128)
+        self.sock.setblocking(False)
+        self.sel = selectors.DefaultSelector()
+        self.sel.register(self.sock, selectors.EVENT_READ, None)
+
+    def serve_once(self, timeout: float) -> None:
+        for key, _ in self.sel.select(timeout):
+            if key.data is None:
+                try:
+                    conn, _ = self.sock.accept()
+                except OSError:
+                    continue
+                conn.setblocking(False)
+                self.sel.register(conn, selectors.EVENT_READ, bytearray())
+                continue
+            conn, buf = key.fileobj, key.data
+            try:
+                data = conn.recv(65536)
+            except BlockingIOError:
+                continue
+            except OSError:
+                data = b""
+            if not data:
+                self._drop(conn)
+                continue
+            buf += data
+            out = b""
+            while b"\n" in buf:
+                i = buf.index(b"\n")
+                line = bytes(buf[:i])
+                del buf[:i + 1]
+                try:
+                    resp = {"r": self.state.call(json.loads(line))}
+                except StateFull as e:
+                    resp = {"full": str(e)}
+                except Exception as e:
+                    resp = {"e": str(e)}
+                out += json.dumps(resp).encode("utf-8") + b"\n"
+            if out:
+                try:
+                    conn.setblocking(True)  # ответы короткие, клиент ждёт их синхронно
+                    conn.sendall(out)
+                    conn.setblocking(False)
+                except OSError:
+                    self._drop(conn)
+
+    def _drop(self, conn: socket.socket) -> None:
+        try:
+            self.sel.unregister(conn)
+        except Exception:
+            pass
+        conn.close()
+
+    def close(self, unlink: bool = True) -> None:
+        """unlink=False — в fork'нутом воркере: закрыть унаследованные fd, сокет master'а не трогать."""
+        for key in list(self.sel.get_map().values()):
+            key.fileobj.close()
+        self.sel.close()
+        if unlink:
+            try:
+                os.unlink(self.path)
+            except FileNotFoundError:
+                pass
+
+class StateClient:
+    def __init__(self, path: str, timeout: float = 1.0, fallback: Optional[LocalState] = None):
+        self.path = path
+        self.timeout = timeout
+        self.fallback = fallback or LocalState()
+        self._local = threading.local()
+
+    def _call(self, req: Dict[str, Any]) -> Any:
+        line = json.dumps(req).encode("utf-8") + b"\n"
+        for attempt in (1, 2):
+            f = getattr(self._local, "f", None)
+            try:
+                if f is None:
+                    s = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+                    s.settimeout(self.timeout)
+                    s.connect(self.path)
+                    f = self._local.f = s.makefile("rwb")
+                    s.close()  # makefile держит свою ссылку на сокет
+                f.write(line)
+                f.flush()
+                resp = f.readline()
+                if not resp:
+                    raise ConnectionError("state server closed connection")
+                data = json.loads(resp)
+                if "full" in data:
+                    raise StateFull(data["full"])
+                if "e" in data:
+                    raise ValueError(data["e"])
+                return data["r"]
+            except (OSError, ValueError):
+                self._local.f = None
+                try:
+                    if f is not None:
+                        f.close()
+                except Exception:
+                    pass
+                if attempt == 2:
+                    raise
+        return None
+
+    def rate_hit(self, key: str, limit: int, window: float) -> bool:
+        try:
+            return bool(self._call({"op": "rate", "key": key, "limit": limit, "window": window}))
+        except Exception:
+            return self.fallback.rate_hit(key, limit, window)
+
+    def put_if_absent(self, key: str, ttl: float, value: Any = True) -> Any:
+        try:
+            return self._call({"op": "put", "key": key, "ttl": ttl, "value": value})
+        except StateFull:
+            raise  # master ответил — запасное хранилище тут не поможет
+        except Exception:
+            return self.fallback.put_if_absent(key, ttl, value)
+
+    def stats(self) -> Dict[str, int]:
+        try:
+            return self._call({"op": "stats"})
+        except Exception:
+            return self.fallback.stats()
+
+_STATE: Any = LocalState()
+
+def get_state() -> Any:
+    return _STATE
+
+def set_state(state: Any) -> None:
+    global _STATE
+    _STATE = state
@@ -0,0 +1,120 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Общий keep-alive пул HTTP-соединений мастер → агенты.
+
+Один httpx.AsyncClient на всё приложение (создаётся на startup):
+- лимиты пула и keep-alive из config.yaml (agent_http.*)
+- не больше max_per_host одновременных запросов на один агент
+- HTTP/2, если agent_http.http2 = true и установлен пакет h2
+- повтор идемпотентных GET/HEAD при сетевых ошибках и 502/503/504
+  (экспоненциальный backoff с полным джиттером)
+- счётчики для /health мастера
+"""
+import asyncio
+import random
+import time
+from typing import Any, Dict, Optional
+from urllib.parse import urlsplit
+
+import httpx
+
+IDEMPOTENT = ("GET", "HEAD", "OPTIONS")
+RETRY_STATUS = (502, 503, 504)
+
+def _h2_available() -> bool:
+    try:
+        import h2  # noqa: F401
+        return True
+    except Exception:
+        return False
+
+class AgentPool:
+    def __init__(self, cfg: Optional[Dict[str, Any]] = None):
+        cfg = cfg or {}
+        self.timeout = float(cfg.get("timeout_sec", 20))
+        self.max_per_host = max(1, int(cfg.get("max_per_host", 8)))
+        self.retries = max(0, int(cfg.get("retries", 2)))
+        self.backoff = float(cfg.get("retry_backoff_sec", 0.2))
+        self.http2 = bool(cfg.get("http2", False)) and _h2_available()
+        self.limits = httpx.Limits(
+            max_connections=int(cfg.get("max_connections", 200)),
+            max_keepalive_connections=int(cfg.get("max_keepalive", 100)),
+            keepalive_expiry=float(cfg.get("keepalive_expiry_sec", 60)),
+        )
+        self.client: Optional[httpx.AsyncClient] = None
+        self._host_sem: Dict[str, asyncio.Semaphore] = {}
+        self.m: Dict[str, Any] = {"requests": 0, "errors": 0, "retries": 0, "in_flight": 0,
+                                  "by_host": {}, "started": 0.0}
+
+    async def start(self) -> None:
+        if self.client is None:
+            self.client = httpx.AsyncClient(timeout=self.timeout, verify=False,
+                                            limits=self.limits, http2=self.http2)
+            self.m["started"] = time.time()
+
+    async def close(self) -> None:
+        if self.client is not None:
+            await self.client.aclose()
+            self.client = None
+
+    def _sem(self, host: str) -> asyncio.Semaphore:
+        sem = self._host_sem.get(host)
+        if sem is None:
+            sem = self._host_sem[host] = asyncio.Semaphore(self.max_per_host)
+        return sem
+
+    async def request(self, method: str, url: str, *, headers: Optional[Dict[str, str]] = None,
+                      json_body: Any = None, timeout: Optional[float] = None) -> httpx.Response:
+        if self.client is None:
+            await self.start()
+        assert self.client is not None
+        method = method.upper()
+        host = urlsplit(url).netloc
+        hm = self.m["by_host"].setdefault(host, {"requests": 0, "errors": 0, "retries": 0})
+        attempts = 1 + (self.retries if method in IDEMPOTENT else 0)
+        kw: Dict[str, Any] = {"headers": headers or {}}
+        if json_body is not None:
+            kw["json"] = json_body
+        if timeout is not None:
+            kw["timeout"] = timeout
+
+        for i in range(attempts):
+            if i:
+                self.m["retries"] += 1; hm["retries"] += 1
+                await asyncio.sleep(random.uniform(0, self.backoff * (2 ** (i - 1))))
+            self.m["requests"] += 1; hm["requests"] += 1
+            self.m["in_flight"] += 1
+            try:
+                async with self._sem(host):
+                    r = await self.client.request(method, url, **kw)
+            except httpx.TransportError:
+                self.m["errors"] += 1; hm["errors"] += 1
+                if i + 1 >= attempts:
+                    raise
+                continue
+            finally:
+                self.m["in_flight"] -= 1
+            if r.status_code in RETRY_STATUS and i + 1 < attempts:
+                continue
+            return r
+        raise RuntimeError("unreachable")  # pragma: no cover
+
+    def stats(self) -> Dict[str, Any]:
+        pool: Dict[str, Any] = {}
+        try:
+            # внутренности httpcore: состав пула на момент запроса
+            conns = self.client._transport._pool.connections  # type: ignore[union-attr]
+            pool = {"connections": len(conns),
+                    "idle": sum(1 for c in conns if c.is_idle()),
+                    "http2": sum(1 for c in conns if "HTTP/2" in repr(c))}
+        except Exception:
+            pass
+        return {
+            "http2": self.http2, "max_per_host": self.max_per_host,
+            "max_connections": self.limits.max_connections,
+            "requests": self.m["requests"], "errors": self.m["errors"],
+            "retries": self.m["retries"], "in_flight": self.m["in_flight"],
+            "pool": pool, "hosts": len(self.m["by_host"]),
+            "by_host": self.m["by_host"],
+        }
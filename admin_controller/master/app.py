@@ -2,15 +2,22 @@
 # -*- coding: utf-8 -*-
 import os
 import json
+import asyncio
 import time
 import secrets
-from typing import Dict, Any, Optional, Tuple
+from typing import Dict, Any, List, Optional, Tuple
 
 import httpx
 from fastapi import FastAPI, HTTPException, Depends, Request, Form
 from fastapi.responses import HTMLResponse, RedirectResponse
+from pydantic import BaseModel
 import yaml
 
+from agent_pool import AgentPool
+from rolling import RollingRestart
+from rules import RuleEngine
+from telemetry import ClusterState
+
 # ========= Paths =========
 BASE = os.path.dirname(__file__)
 CFG  = os.path.join(BASE, "config.yaml")
@@ -37,6 +44,48 @@ ACCOUNTS = CONFIG.get("auth", {}).get("accounts", [])
 # ========= App =========
 app = FastAPI(title="JBoss Controller Master")
 
+# Общий пул соединений к агентам (agent_http.* в config.yaml)
+POOL = AgentPool(CONFIG.get("agent_http") or {})
+
+# Живое состояние нод по push-телеметрии агентов (telemetry.* в config.yaml)
+LIVE = ClusterState(stale_sec=float((CONFIG.get("telemetry") or {}).get("stale_sec", 15)))
+
+# Авто-drain по правилам (rules.* в config.yaml); без секции rules не запускается
+ENGINE: Optional[RuleEngine] = None
+_ENGINE_TASK: Optional[asyncio.Task] = None
+
+# Конвейерные rolling restart'ы кластеров (rolling.* в config.yaml); создаётся на startup
+ROLLING: Optional[RollingRestart] = None
+
+async def _engine_loop(engine: RuleEngine, interval: float):
+    while True:
+        try:
+            await engine.tick()
+        except Exception:
+            pass
+        await asyncio.sleep(interval)
+
+@app.on_event("startup")
+async def _pool_start():
+    global ENGINE, _ENGINE_TASK, ROLLING
+    await POOL.start()
+    ROLLING = RollingRestart(CONFIG, call_agent, live=LIVE,
+                             state_file=(CONFIG.get("rolling") or {}).get("state_file")
+                             or os.path.join(BASE, "rolling_jobs.json"))
+    ROLLING.resume()
+    if CONFIG.get("rules"):
+        ENGINE = RuleEngine(CONFIG, INTER_TOKEN, client=POOL.client, live=LIVE)
+        _ENGINE_TASK = asyncio.create_task(
+            _engine_loop(ENGINE, float(CONFIG["rules"].get("interval_sec", 10))))
+
+@app.on_event("shutdown")
+async def _pool_close():
+    if _ENGINE_TASK:
+        _ENGINE_TASK.cancel()
+    if ROLLING is not None:
+        await ROLLING.close()
+    await POOL.close()
+
 # ========= Sessions / bans (для UI) =========
 SESSIONS: Dict[str, Dict[str, Any]] = {}     # sid -> {exp, user, role}
 SESSION_TTL_SEC = 12 * 3600                  # 12 часов
@@ -114,16 +163,20 @@ def require_root(sess: Dict[str, Any] = Depends(require_session)) -> Dict[str, A
     return sess
 
 # ========= HTTP client → agents (с X-Auth-Token) =========
-async def call_agent(url: str, method: str = "GET", json_body=None, timeout: int = 20) -> Any:
-    async with httpx.AsyncClient(timeout=timeout, verify=False) as client:
-        headers = {}
-        if INTER_TOKEN:
-            headers["X-Auth-Token"] = INTER_TOKEN
-        r = await client.request(method, url, json=json_body, headers=headers)
-        if r.status_code >= 400:
-            raise HTTPException(r.status_code, r.text)
-        ctype = (r.headers.get("content-type") or "").lower()
-        return r.json() if ctype.startswith("application/json") else r.text
+async def call_agent(url: str, method: str = "GET", json_body=None, timeout: Optional[float] = None,
+                     token: Optional[str] = None) -> Any:
+    headers = {}
+    tok = INTER_TOKEN if token is None else token
+    if tok:
+        headers["X-Auth-Token"] = tok
+    try:
+        r = await POOL.request(method, url, json_body=json_body, headers=headers, timeout=timeout)
+    except httpx.HTTPError as e:
+        raise HTTPException(502, f"agent unreachable: {type(e).__name__}: {e}")
+    if r.status_code >= 400:
+        raise HTTPException(r.status_code, r.text)
+    ctype = (r.headers.get("content-type") or "").lower()
+    return r.json() if ctype.startswith("application/json") else r.text
 
 def _find_node(cid: str, name: str) -> Dict[str, Any]:
     c = clusters().get(cid)
@@ -227,10 +280,16 @@ function render(){{
   const root=document.getElementById('app'); root.innerHTML='';
   Object.entries(CFG).forEach(([cid, c])=>{{
     const h=document.createElement('h3'); h.textContent=`Cluster: ${"{"+'cid'+"}"}`.replace("{cid}", cid); root.appendChild(h);
+    root.appendChild(btn('ROLLING RESTART', ()=>api(`/clusters/${cid}/rolling-restart`,'POST',{{}}).then(j=>alert('Job '+j.id+', batch='+j.batch)).catch(e=>alert(e))));
     const cont=document.createElement('div'); root.appendChild(cont);
     (c.nodes||[]).forEach(n=>{{
       const card=document.createElement('div'); card.className='card';
       card.innerHTML = `<b>${"{"+'name'+"}"} — backend=${"{"+'bk'+"}"} server=${"{"+'sv'+"}"}`.replace("{name}",n.name).replace("{bk}",n.haproxy_backend).replace("{sv}",n.haproxy_server)+"<br>";
+      const live=document.createElement('div'); live.className='meta live';
+      // как telemetry.agent_key: без хвостового /, нижний регистр, со схемой
+      let ak=(n.agent_base_url||'').trim().replace(/[/]+$/,'').toLowerCase(); if(ak && !ak.includes('://')) ak='http://'+ak;
+      live.dataset.agent=ak; live.dataset.key=n.haproxy_backend+'/'+n.haproxy_server;
+      card.appendChild(live);
       card.appendChild(btn('Drain', ()=>api(`/clusters/${cid}/node/${n.name}/drain`,'POST').then(()=>alert('OK')).catch(e=>alert(e))));
       card.appendChild(btn('Wait empty', ()=>api(`/clusters/${cid}/node/${n.name}/wait-empty`,'POST',{{timeout_sec:300}}).then(()=>alert('OK')).catch(e=>alert(e))));
       card.appendChild(btn('Restart JBoss', ()=>api(`/clusters/${cid}/node/${n.name}/restart`,'POST',{{}}).then(()=>alert('OK')).catch(e=>alert(e))));
@@ -243,6 +302,14 @@ function render(){{
   }});
 }}
 render();
+async function refreshLive(){{
+  let st; try {{ st = await api('/telemetry/state'); }} catch(e) {{ return; }}
+  document.querySelectorAll('.live').forEach(el=>{{
+    const a=(st.agents||{{}})[el.dataset.agent]; const row=a && a.rows[el.dataset.key];
+    el.textContent = row ? `status=${{row.status}} scur=${{row.scur}} qcur=${{row.qcur}} 5xx=${{row.hrsp_5xx}}`+(a.stale?' (stale'+(a.error?': '+a.error:'')+')':'') : '';
+  }});
+}}
+refreshLive(); setInterval(refreshLive, 5000);
 </script></body></html>
 """
 
@@ -272,6 +339,8 @@ async def xauth_rotate(token: str = Form(...), sess: Dict[str, Any] = Depends(re
     old = INTER_TOKEN
     # 1) обновляем мастер (runtime)
     INTER_TOKEN = token
+    if ENGINE is not None:
+        ENGINE.token = token
     # 2) сохраняем в YAML
     cfg = load_config()
     cfg["x_auth_token"] = token
@@ -279,18 +348,14 @@ async def xauth_rotate(token: str = Form(...), sess: Dict[str, Any] = Depends(re
         yaml.safe_dump(cfg, f, allow_unicode=True, sort_keys=False)
     CONFIG = cfg  # обновим кластеры/аккаунты, если правили
 
-    # 3) разослать агентам по старому токену
-    async with httpx.AsyncClient(timeout=15, verify=False) as client:
-        for cid, c in clusters().items():
-            for n in c.get("nodes", []):
-                base = n["agent_base_url"]
-                headers = {"X-Auth-Token": old} if old else {}
-                try:
-                    r = await client.post(f"{base}/xauth/set", headers=headers, json={"token": token, "persist": True})
-                    r.raise_for_status()
-                except Exception:
-                    # агент недоступен — пропустим
-                    pass
+    # 3) разослать агентам по старому токену (параллельно, через общий пул)
+    bases = {n["agent_base_url"] for c in clusters().values() for n in c.get("nodes", [])}
+    # агент недоступен — пропустим (return_exceptions)
+    await asyncio.gather(*[
+        call_agent(f"{base}/xauth/set", method="POST", json_body={"token": token, "persist": True},
+                   timeout=15, token=old or "")
+        for base in bases
+    ], return_exceptions=True)
 
     return RedirectResponse(url="/settings/tokens", status_code=303)
 
@@ -298,7 +363,29 @@ async def xauth_rotate(token: str = Form(...), sess: Dict[str, Any] = Depends(re
 @app.get("/health")
 async def health():
     # открытый хелсчек мастера
-    return {"status": "ok", "clusters": list(clusters().keys())}
+    out = {"status": "ok", "clusters": list(clusters().keys()), "agent_pool": POOL.stats(),
+           "telemetry": {"agents": len(LIVE.agents), "received": LIVE.received, "resyncs": LIVE.resyncs}}
+    if ENGINE is not None:
+        out["rules"] = ENGINE.stats()
+    return out
+
+# ========= Telemetry push (агенты → мастер, по X-Auth-Token) =========
+@app.post("/telemetry/push")
+async def telemetry_push(req: Request):
+    if INTER_TOKEN and req.headers.get("x-auth-token", "") != INTER_TOKEN:
+        raise HTTPException(401, "Unauthorized")
+    try:
+        msg = await req.json()
+    except Exception:
+        raise HTTPException(400, "bad json")
+    res = LIVE.apply(msg if isinstance(msg, dict) else {})
+    if not res.get("ok") and not res.get("resync"):
+        raise HTTPException(400, res.get("error") or "bad message")
+    return res
+
+@app.get("/telemetry/state")
+async def telemetry_state(sess: Dict[str, Any] = Depends(require_admin)):
+    return LIVE.snapshot()
 
 @app.get("/clusters")
 async def get_clusters(sess: Dict[str, Any] = Depends(require_admin)):
@@ -317,9 +404,7 @@ async def agents_health(cid: str, sess: Dict[str, Any] = Depends(require_admin))
     if not c:
         raise HTTPException(404, "Cluster not found")
     tasks = [call_agent(f'{n["agent_base_url"]}/health') for n in c.get("nodes", [])]
-    results = await httpx.AsyncClient.gather(*tasks, return_exceptions=True)  # type: ignore
-    # ↑ если ругнётся, замени на asyncio.gather:
-    # results = await asyncio.gather(*[call_agent(f'{n["agent_base_url"]}/health') for n in c.get("nodes", [])], return_exceptions=True)
+    results = await asyncio.gather(*tasks, return_exceptions=True)
     out = {}
     for n, res in zip(c.get("nodes", []), results):
         ok = not isinstance(res, Exception)
@@ -341,11 +426,17 @@ async def node_enable(cid: str, name: str, sess: Dict[str, Any] = Depends(requir
     )
 
 @app.post("/clusters/{cid}/node/{name}/wait-empty")
-async def node_wait_empty(cid: str, name: str, timeout_sec: int = 300, sess: Dict[str, Any] = Depends(require_admin)):
+async def node_wait_empty(cid: str, name: str, timeout_sec: int = 300, grace_sec: Optional[float] = None,
+                          hard_kill: Optional[bool] = None, sess: Dict[str, Any] = Depends(require_admin)):
     node = _find_node(cid, name)
+    body: Dict[str, Any] = {"timeout_sec": timeout_sec}
+    if grace_sec is not None:
+        body["grace_sec"] = grace_sec
+    if hard_kill is not None:
+        body["hard_kill"] = hard_kill
     return await call_agent(
         f'{node["agent_base_url"]}/node/{node["haproxy_backend"]}/{node["haproxy_server"]}/wait-empty',
-        method="POST", json_body={"timeout_sec": timeout_sec}
+        method="POST", json_body=body, timeout=timeout_sec + 15
     )
 
 @app.post("/clusters/{cid}/node/{name}/restart")
@@ -369,6 +460,42 @@ async def safe_roll(cid: str, name: str, sess: Dict[str, Any] = Depends(require_
     await call_agent(f'{base}/jboss/wait-health', method="POST", json_body={"timeout_sec": 300})
     return await call_agent(f'{base}/node/{node["haproxy_backend"]}/{node["haproxy_server"]}/enable', method="POST")
 
+class RollingReq(BaseModel):
+    nodes: Optional[List[str]] = None   # по умолчанию — весь кластер
+    batch: Optional[int] = None         # по умолчанию — из min_enabled и нагрузки
+    timeout_sec: int = 300
+    stop_on_failure: bool = True
+
+def _rolling() -> RollingRestart:
+    if ROLLING is None:
+        raise HTTPException(503, "rolling restart is not ready")
+    return ROLLING
+
+@app.post("/clusters/{cid}/rolling-restart")
+async def rolling_restart(cid: str, req: RollingReq, sess: Dict[str, Any] = Depends(require_admin)):
+    if cid not in clusters():
+        raise HTTPException(404, "Cluster not found")
+    try:
+        return await _rolling().create(cid, req.nodes, req.batch, req.timeout_sec, req.stop_on_failure)
+    except ValueError as e:
+        raise HTTPException(409, str(e))
+
+@app.get("/rolling/jobs")
+async def rolling_jobs(sess: Dict[str, Any] = Depends(require_admin)):
+    return _rolling().list_jobs()
+
+@app.get("/rolling/jobs/{jid}")
+async def rolling_job(jid: str, sess: Dict[str, Any] = Depends(require_admin)):
+    if jid not in _rolling().jobs:
+        raise HTTPException(404, "Job not found")
+    return _rolling().progress(jid)
+
+@app.post("/rolling/jobs/{jid}/cancel")
+async def rolling_cancel(jid: str, sess: Dict[str, Any] = Depends(require_admin)):
+    if jid not in _rolling().jobs:
+        raise HTTPException(404, "Job not found")
+    return _rolling().cancel(jid)
+
 @app.post("/clusters/{cid}/node/{name}/cfg-enable")
 async def node_cfg_enable(cid: str, name: str, sess: Dict[str, Any] = Depends(require_admin)):
     n = _find_node(cid, name)
@@ -0,0 +1,354 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Конвейерный rolling restart кластера (или выбранных нод).
+
+Нода проходит фазы drain → wait_empty → restart → wait_health → enable.
+Конвейер:
+- одновременно перезапускаются не больше batch нод (слоты restart)
+- пока идёт restart текущей партии, следующая (не больше batch нод) уже
+  выводится из балансировки: drain + wait_empty перекрываются с рестартом JVM
+- новую ноду берём в работу, только если в ротации останется >= min_enabled
+  UP-нод и (если задан rolling.max_scur_per_node) оставшиеся потянут текущую
+  нагрузку; состояние нод — из live-таблицы телеметрии (ClusterState), для нод
+  без свежей телеметрии — опросом агента (/haproxy/stat). Нода без данных, не UP
+  (DRAIN/MAINT) или упавшая в задаче (failed — осталась выведенной) в ротации не считается
+- batch по умолчанию считается из запаса над min_enabled и нагрузки; без запаса
+  задача с авто-партией не создаётся, а если запас не появляется дольше
+  rolling.capacity_wait_sec (по умолчанию timeout_sec задачи) — задача failed
+
+Итого время ≈ (нод / batch) × время рестарта, а не сумма всех фаз всех нод.
+Состояние задач пишется в JSON (rolling.state_file) на каждой смене фазы;
+после рестарта мастера незавершённые задачи продолжаются с записанной фазы.
+"""
+import asyncio
+import json
+import math
+import os
+import secrets
+import time
+from typing import Any, Awaitable, Callable, Dict, List, Optional
+
+from telemetry import ClusterState
+
+PHASES = ("drain", "wait_empty", "restart", "wait_health", "enable")
+# Фазы, в которых нода выведена из ротации, но ещё не заняла слот рестарта
+AHEAD = ("drain", "wait_empty")
+
+CallAgent = Callable[..., Awaitable[Any]]
+
+class RollingRestart:
+    def __init__(self, cfg: Dict[str, Any], call: CallAgent, live: Optional[ClusterState] = None,
+                 state_file: str = "rolling_jobs.json"):
+        self.cfg = cfg
+        self.call = call
+        self.live = live
+        self.state_file = state_file
+        self.jobs: Dict[str, Dict[str, Any]] = {}
+        # нода без свежей телеметрии -> (когда опрошен агент, строка show stat или None)
+        self._polled: Dict[str, tuple] = {}
+        self._tasks: Dict[str, asyncio.Task] = {}
+        self._load()
+
+    # ---- настройки ----
+    def _rc(self, key: str, default: Any) -> Any:
+        return (self.cfg.get("rolling") or {}).get(key, default)
+
+    def _cluster(self, cid: str) -> Dict[str, Any]:
+        return (self.cfg.get("clusters") or {}).get(cid) or {}
+
+    def _min_enabled(self, cid: str) -> int:
+        return int(self._cluster(cid).get("min_enabled", self._rc("min_enabled", 1)))
+
+    # ---- персистентность ----
+    def _load(self) -> None:
+        try:
+            with open(self.state_file, "r", encoding="utf-8") as f:
+                self.jobs = json.load(f).get("jobs") or {}
+        except FileNotFoundError:
+            self.jobs = {}
+        except Exception:
+            # битый файл не должен ронять мастер — откладываем в сторону
+            os.replace(self.state_file, self.state_file + ".bad")
+            self.jobs = {}
+
+    def _save(self) -> None:
+        tmp = self.state_file + ".tmp"
+        with open(tmp, "w", encoding="utf-8") as f:
+            json.dump({"jobs": self.jobs}, f, ensure_ascii=False, indent=1)
+        os.replace(tmp, self.state_file)
+
+    # ---- живое состояние кластера ----
+    def _live_row(self, n: Dict[str, Any]) -> Optional[Dict[str, str]]:
+        if self.live is None:
+            return None
+        nested = self.live.nested(n["agent_base_url"])
+        if nested is None:
+            return None
+        return (nested.get(n["haproxy_backend"]) or {}).get(n["haproxy_server"])
+
+    def _row(self, n: Dict[str, Any]) -> Optional[Dict[str, str]]:
+        row = self._live_row(n)
+        if row is not None:
+            return row
+        ts, polled = self._polled.get(n["name"], (0.0, None))
+        return polled if time.time() - ts <= float(self._rc("poll_sec", 2)) * 3 else None
+
+    async def refresh(self, cid: str) -> None:
+        """Ноды без свежей телеметрии — опросить их агентов напрямую."""
+        nodes = [n for n in self._cluster(cid).get("nodes") or [] if self._live_row(n) is None]
+
+        async def one(n: Dict[str, Any]) -> None:
+            row = None
+            try:
+                res = await self.call(f'{n["agent_base_url"]}/haproxy/stat?backend={n["haproxy_backend"]}'
+                                      f'&server={n["haproxy_server"]}&fields=status,scur', timeout=5)
+                row = ((res or {}).get("data", {}).get(n["haproxy_backend"]) or {}).get(n["haproxy_server"])
+            except Exception:
+                pass
+            self._polled[n["name"]] = (time.time(), row)
+        await asyncio.gather(*(one(n) for n in nodes))
+
+    def _serving(self, cid: str, busy: set) -> List[tuple]:
+        """[(node, scur)] UP-нод в ротации вне работы задачи. Нода без данных — не в ротации."""
+        out = []
+        for n in self._cluster(cid).get("nodes") or []:
+            if n["name"] in busy:
+                continue
+            row = self._row(n)
+            if row is not None and (row.get("status") or "").upper() == "UP":
+                out.append((n, int((row.get("scur") or "0") or "0")))
+        return out
+
+    def _can_take(self, cid: str, busy: set) -> bool:
+        serving = self._serving(cid, busy)
+        left = len(serving) - 1
+        if left < self._min_enabled(cid):
+            return False
+        cap = float(self._rc("max_scur_per_node", 0) or 0)
+        if cap > 0 and left > 0 and sum(s for _, s in serving) / left > cap:
+            return False
+        return True
+
+    def auto_batch(self, cid: str) -> int:
+        """Партия: запас UP-нод над min_enabled, урезанный по нагрузке и rolling.max_batch."""
+        serving = self._serving(cid, set())
+        spare = len(serving) - self._min_enabled(cid)
+        cap = float(self._rc("max_scur_per_node", 0) or 0)
+        if cap > 0:
+            need = math.ceil(sum(s for _, s in serving) / cap)
+            spare = min(spare, len(serving) - max(need, self._min_enabled(cid)))
+        # половина запаса: вторая половина — под ноды, выводимые заранее
+        return max(1, min(int(self._rc("max_batch", 4)), spare // 2 or spare))
+
+    # ---- задачи ----
+    async def create(self, cid: str, names: Optional[List[str]] = None, batch: Optional[int] = None,
+                     timeout_sec: int = 300, stop_on_failure: bool = True) -> Dict[str, Any]:
+        nodes = [n["name"] for n in self._cluster(cid).get("nodes") or []]
+        if names:
+            unknown = sorted(set(names) - set(nodes))
+            if unknown:
+                raise ValueError(f"unknown nodes: {', '.join(unknown)}")
+            nodes = [x for x in nodes if x in set(names)]
+        if not nodes:
+            raise ValueError("no nodes to restart")
+        for j in self.jobs.values():
+            if j["cluster"] == cid and j["status"] in ("running", "cancelling"):
+                raise ValueError(f"cluster {cid} already has running job {j['id']}")
+        if not batch:
+            await self.refresh(cid)
+            serving = len(self._serving(cid, set()))
+            if serving - 1 < self._min_enabled(cid):
+                raise ValueError(f"no spare capacity: {serving} nodes UP, min_enabled={self._min_enabled(cid)}")
+        jid = time.strftime("%Y%m%d-%H%M%S-") + secrets.token_hex(3)
+        job = {
+            "id": jid, "cluster": cid, "status": "running", "created": time.time(), "finished": 0.0,
+            "batch": max(1, int(batch)) if batch else self.auto_batch(cid),
+            "timeout_sec": int(timeout_sec), "stop_on_failure": bool(stop_on_failure), "error": "",
+            "nodes": {x: {"phase": "pending", "started": 0.0, "finished": 0.0, "error": "", "phase_sec": {}}
+                      for x in nodes},
+            "order": nodes,
+        }
+        self.jobs[jid] = job
+        self._save()
+        self._spawn(jid)
+        return self.progress(jid)
+
+    def resume(self) -> List[str]:
+        """На старте мастера: продолжить незавершённые задачи."""
+        ids = [jid for jid, j in self.jobs.items() if j["status"] in ("running", "cancelling")]
+        for jid in ids:
+            self._spawn(jid)
+        return ids
+
+    def cancel(self, jid: str) -> Dict[str, Any]:
+        job = self.jobs[jid]
+        if job["status"] == "running":
+            # новые ноды не берём, начатые доводим до enable
+            job["status"] = "cancelling"
+            self._save()
+        return self.progress(jid)
+
+    async def close(self) -> None:
+        for t in self._tasks.values():
+            t.cancel()
+        await asyncio.gather(*self._tasks.values(), return_exceptions=True)
+
+    def _spawn(self, jid: str) -> None:
+        if jid not in self._tasks or self._tasks[jid].done():
+            self._tasks[jid] = asyncio.create_task(self._run(jid))
+
+    def _node(self, cid: str, name: str) -> Dict[str, Any]:
+        for n in self._cluster(cid).get("nodes") or []:
+            if n["name"] == name:
+                return n
+        raise KeyError(name)
+
+    async def _run(self, jid: str) -> None:
+        job = self.jobs[jid]
+        cid = job["cluster"]
+        restart_slots = asyncio.Semaphore(job["batch"])
+        poll = float(self._rc("poll_sec", 2))
+        tasks: Dict[asyncio.Task, str] = {}
+        # ноды в середине конвейера (возобновление после рестарта мастера) доводим сразу
+        for name in job["order"]:
+            if job["nodes"][name]["phase"] in PHASES:
+                tasks[asyncio.create_task(self._roll_node(job, name, restart_slots))] = name
+        pending = [x for x in job["order"] if job["nodes"][x]["phase"] == "pending"]
+        cap_wait = float(self._rc("capacity_wait_sec", job["timeout_sec"]))
+        stalled_since: Optional[float] = None
+        try:
+            while True:
+                # failed-ноды остались выведенными — в запас не считаем
+                busy = {x for x, ns in job["nodes"].items() if ns["phase"] in PHASES + ("failed",)} | set(tasks.values())
+                ahead = sum(1 for x in busy if job["nodes"][x]["phase"] in AHEAD + ("pending",))
+                if pending and job["status"] == "running" and ahead < job["batch"]:
+                    await self.refresh(cid)
+                while pending and job["status"] == "running" and ahead < job["batch"]:
+                    if not self._can_take(cid, busy):
+                        break
+                    name = pending.pop(0)
+                    busy.add(name)
+                    ahead += 1
+                    tasks[asyncio.create_task(self._roll_node(job, name, restart_slots))] = name
+                if not tasks:
+                    if not pending or job["status"] != "running":
+                        break
+                    stalled_since = stalled_since or time.time()
+                    if time.time() - stalled_since > cap_wait:
+                        job["status"] = "cancelling"
+                        job["error"] = f"no spare capacity above min_enabled for {int(cap_wait)}s"
+                        self._save()
+                        break
+                    await asyncio.sleep(poll)  # ждём, пока кластер наберёт запас
+                    continue
+                stalled_since = None
+                done, _ = await asyncio.wait(set(tasks), timeout=poll, return_when=asyncio.FIRST_COMPLETED)
+                for t in done:
+                    name = tasks.pop(t)
+                    if t.exception() is not None and job["stop_on_failure"] and job["status"] == "running":
+                        job["status"] = "cancelling"
+                        job["error"] = f"stopped after failure on {name}"
+                        self._save()
+            failed = [x for x, ns in job["nodes"].items() if ns["phase"] == "failed"]
+            if failed:
+                job["status"] = "failed"
+                job["error"] = f"failed nodes: {', '.join(failed)}"
+            elif stalled_since is not None and job["error"]:
+                job["status"] = "failed"
+            elif any(ns["phase"] == "pending" for ns in job["nodes"].values()):
+                job["status"] = "cancelled"
+            else:
+                job["status"] = "done"
+            job["finished"] = time.time()
+            self._save()
+        except asyncio.CancelledError:
+            # остановка мастера: фазы уже записаны, задача продолжится после старта
+            for t in tasks:
+                t.cancel()
+            await asyncio.gather(*tasks, return_exceptions=True)
+            self._save()
+            raise
+
+    async def _roll_node(self, job: Dict[str, Any], name: str, restart_slots: asyncio.Semaphore) -> None:
+        ns = job["nodes"][name]
+        n = self._node(job["cluster"], name)
+        base = n["agent_base_url"]
+        srv = f'{base}/node/{n["haproxy_backend"]}/{n["haproxy_server"]}'
+        tmo = job["timeout_sec"]
+        wait_body: Dict[str, Any] = {"timeout_sec": tmo}
+        if self._rc("drain_grace_sec", None) is not None:
+            wait_body["grace_sec"] = float(self._rc("drain_grace_sec", 0))  # быстрый drain на агенте
+        if self._rc("drain_hard_kill", None) is not None:
+            wait_body["hard_kill"] = bool(self._rc("drain_hard_kill", False))
+        steps = {
+            "drain":       lambda: self.call(f"{srv}/drain", method="POST"),
+            "wait_empty":  lambda: self.call(f"{srv}/wait-empty", method="POST",
+                                             json_body=wait_body, timeout=tmo + 15),
+            "restart":     lambda: self.call(f"{base}/jboss/restart", method="POST",
+                                             json_body={"service": n["jboss_service"]}, timeout=tmo),
+            "wait_health": lambda: self.call(f"{base}/jboss/wait-health", method="POST",
+                                             json_body={"timeout_sec": tmo}, timeout=tmo + 15),
+            "enable":      lambda: self.call(f"{srv}/enable", method="POST"),
+        }
+        start = PHASES.index(ns["phase"]) if ns["phase"] in PHASES else 0
+        if not ns["started"]:
+            ns["started"] = time.time()
+        slot_held = False
+        try:
+            for phase in PHASES[start:]:
+                if phase == "restart" or (phase == "wait_health" and not slot_held):
+                    await restart_slots.acquire()
+                    slot_held = True
+                ns["phase"] = phase
+                self._save()
+                t0 = time.time()
+                try:
+                    await steps[phase]()
+                except asyncio.CancelledError:
+                    raise
+                except Exception as e:
+                    ns["phase"] = "failed"
+                    ns["error"] = f"{phase}: {getattr(e, 'detail', None) or e}"[:300]
+                    ns["finished"] = time.time()
+                    self._save()
+                    raise
+                ns["phase_sec"][phase] = round(time.time() - t0, 1)
+                if phase == "wait_health":
+                    restart_slots.release()
+                    slot_held = False
+            ns["phase"] = "done"
+            ns["finished"] = time.time()
+            self._save()
+        finally:
+            if slot_held:
+                restart_slots.release()
+
+    # ---- прогресс ----
+    def progress(self, jid: str) -> Dict[str, Any]:
+        job = self.jobs[jid]
+        nodes = job["nodes"]
+        counts: Dict[str, int] = {}
+        for ns in nodes.values():
+            counts[ns["phase"]] = counts.get(ns["phase"], 0) + 1
+        done = [ns for ns in nodes.values() if ns["phase"] == "done"]
+        eta = None
+        if done and job["status"] in ("running", "cancelling"):
+            avg = sum(ns["finished"] - ns["started"] for ns in done) / len(done)
+            left = sum(1 for ns in nodes.values() if ns["phase"] not in ("done", "failed"))
+            eta = round(avg * math.ceil(left / job["batch"]), 1)
+        end = job["finished"] or time.time()
+        return {
+            "id": jid, "cluster": job["cluster"], "status": job["status"], "batch": job["batch"],
+            "error": job["error"], "elapsed_sec": round(end - job["created"], 1), "eta_sec": eta,
+            "total": len(nodes), "counts": counts,
+            "nodes": [dict(name=x, **nodes[x]) for x in job["order"]],
+        }
+
+    def list_jobs(self) -> List[Dict[str, Any]]:
+        out = []
+        for jid in sorted(self.jobs, reverse=True):
+            p = self.progress(jid)
+            p.pop("nodes")
+            out.append(p)
+        return out
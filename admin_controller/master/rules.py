@@ -1,18 +1,96 @@
+import asyncio
+import random
+import time
+
 import httpx
-from typing import Dict, Any
+from typing import Dict, Any, List, Optional, Tuple
+
+from telemetry import ClusterState
+
+# Бакеты гистограммы длительности тика, сек
+TICK_BUCKETS = (0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+# Колонки /haproxy/stat, нужные движку (агент отдаёт только их)
+STAT_FIELDS = "status,scur,hrsp_5xx"
 
 class RuleEngine:
     """
     Простой rules-движок с гистерезисом:
     - Если status != UP ИЛИ hrsp_5xx > порога N тиков подряд → drain
     - Если затем status == UP И hrsp_5xx <= порога M тиков подряд → enable
+
+    Агенты опрашиваются параллельно (не больше rules.max_concurrency одновременно),
+    каждый — со своим дедлайном rules.agent_deadline_sec. Для недоступных агентов
+    работает circuit breaker: после breaker_failures ошибок подряд агент не
+    опрашивается backoff-время (экспонента от breaker_backoff_sec до
+    breaker_backoff_max_sec с джиттером), такие тики считаются «плохими».
+
+    Если передана live-таблица (ClusterState) и по агенту есть свежая
+    push-телеметрия — агент не опрашивается вовсе.
     """
-    def __init__(self, cfg: Dict[str, Any], token: str):
+    def __init__(self, cfg: Dict[str, Any], token: str, client: Optional[httpx.AsyncClient] = None,
+                 live: Optional[ClusterState] = None):
         self.cfg = cfg
         self.token = token
+        # общий клиент мастера (AgentPool.client); без него — свой на каждый тик
+        self.client = client
+        self.live = live
         # состояние по нодам: (cluster, node_name) -> dict
         self.state: Dict[tuple, Dict[str, Any]] = {}
+        # circuit breaker по агентам: agent_base_url -> {fails, open_until, last_error}
+        self.breakers: Dict[str, Dict[str, Any]] = {}
+        # последний ответ /haproxy/stat по агенту: base -> (etag, nested), для If-None-Match
+        self._stat_etag: Dict[str, Tuple[str, Dict[str, Any]]] = {}
+        # гистограмма длительности тика (кумулятивно, как в Prometheus)
+        self.tick_hist: Dict[str, Any] = {"buckets": {b: 0 for b in TICK_BUCKETS}, "count": 0, "sum": 0.0, "last": 0.0}
+
+    def _rules_num(self, key: str, default: float) -> float:
+        try:
+            return float((self.cfg.get("rules") or {}).get(key, default))
+        except (TypeError, ValueError):
+            return default
+
+    # ---- circuit breaker ----
+    def _breaker(self, base: str) -> Dict[str, Any]:
+        return self.breakers.setdefault(base, {"fails": 0, "open_until": 0.0, "last_error": ""})
+
+    def _breaker_open(self, base: str) -> bool:
+        return self._breaker(base)["open_until"] > time.time()
+
+    def _breaker_ok(self, base: str) -> None:
+        br = self._breaker(base)
+        br["fails"] = 0; br["open_until"] = 0.0; br["last_error"] = ""
 
+    def _breaker_fail(self, base: str, err: str) -> None:
+        br = self._breaker(base)
+        br["fails"] += 1
+        br["last_error"] = err[:200]
+        need = int(self._rules_num("breaker_failures", 3))
+        if br["fails"] >= need:
+            base_s = self._rules_num("breaker_backoff_sec", 10)
+            max_s = self._rules_num("breaker_backoff_max_sec", 300)
+            delay = min(max_s, base_s * (2 ** (br["fails"] - need)))
+            br["open_until"] = time.time() + delay * random.uniform(0.8, 1.2)
+
+    def _observe_tick(self, dur: float) -> None:
+        h = self.tick_hist
+        for b in TICK_BUCKETS:
+            if dur <= b:
+                h["buckets"][b] += 1
+        h["count"] += 1; h["sum"] += dur; h["last"] = dur
+
+    def stats(self) -> Dict[str, Any]:
+        h = self.tick_hist
+        return {
+            "tick_duration_seconds": {
+                "buckets": {str(b): c for b, c in h["buckets"].items()},
+                "count": h["count"], "sum": round(h["sum"], 3), "last": round(h["last"], 3),
+            },
+            # только агенты с ошибками — здоровые не засоряют вывод
+            "breakers": {base: dict(br, open=br["open_until"] > time.time())
+                         for base, br in self.breakers.items() if br["fails"]},
+        }
+
+    # ---- тик ----
     async def tick(self):
         rules = self.cfg.get("rules", {})
         if not rules:
@@ -21,34 +99,74 @@ class RuleEngine:
         thr5   = int(rules.get("hrsp_5xx_threshold", 5))
         need_b = int(rules.get("bad_intervals_required", 3))
         need_g = int(rules.get("good_intervals_required", 3))
+        conc   = max(1, int(rules.get("max_concurrency", 16)))
+        dl     = float(rules.get("agent_deadline_sec", 8))
 
         headers = {"X-Auth-Token": self.token} if self.token else {}
+        sem = asyncio.Semaphore(conc)
+        t0 = time.monotonic()
 
-        async with httpx.AsyncClient(timeout=8, verify=False) as client:
-            for cid, c in (self.cfg.get("clusters") or {}).items():
-                for n in (c.get("nodes") or []):
-                    base     = n["agent_base_url"]
-                    backend  = n["haproxy_backend"]
-                    server   = n["haproxy_server"]
-                    key      = (cid, n["name"])
-                    st       = self.state.setdefault(key, {"bad": 0, "good": 0, "drained": False})
+        nodes: List[Tuple[str, Dict[str, Any]]] = [
+            (cid, n) for cid, c in (self.cfg.get("clusters") or {}).items() for n in (c.get("nodes") or [])
+        ]
+        # один GET /haproxy/stat на агента, даже если за ним несколько нод;
+        # запрашиваем только свои backend/server и нужные колонки
+        wanted: Dict[str, Tuple[set, set]] = {}
+        for _, n in nodes:
+            bk, sv = wanted.setdefault(n["agent_base_url"], (set(), set()))
+            bk.add(n["haproxy_backend"]); sv.add(n["haproxy_server"])
+        bases = sorted(wanted)
 
-                    # Получаем nested-метрики от агента
+        own = self.client is None
+        client = httpx.AsyncClient(timeout=dl, verify=False) if own else self.client
+        try:
+            async def fetch(base: str) -> Optional[Dict[str, Any]]:
+                pushed = self.live.nested(base) if self.live is not None else None
+                if pushed is not None:
+                    self._breaker_ok(base)
+                    return pushed
+                if self._breaker_open(base):
+                    return None
+                params = {"backend": ",".join(sorted(wanted[base][0])),
+                          "server": ",".join(sorted(wanted[base][1])), "fields": STAT_FIELDS}
+                hdrs = dict(headers)
+                prev = self._stat_etag.get(base)
+                if prev:
+                    hdrs["If-None-Match"] = prev[0]
+                async with sem:
                     try:
-                        r = await client.get(f"{base}/haproxy/stat", headers=headers)
-                        r.raise_for_status()
-                        nested = (r.json() or {}).get("data", {})
-                        row = (nested.get(backend, {}) or {}).get(server)
-                    except Exception:
-                        # Агент недоступен — считаем «плохим» тиком
-                        row = None
-
-                    if not row:
-                        st["bad"] += 1
-                        st["good"] = 0
-                        await self._maybe_act(client, headers, n, st, need_b, need_g)
-                        continue
+                        r = await asyncio.wait_for(
+                            client.get(f"{base}/haproxy/stat", params=params, headers=hdrs), dl)
+                        if r.status_code == 304 and prev:
+                            nested = prev[1]
+                        else:
+                            r.raise_for_status()
+                            nested = (r.json() or {}).get("data", {})
+                            if r.headers.get("etag"):
+                                self._stat_etag[base] = (r.headers["etag"], nested)
+                    except Exception as e:
+                        # Агент недоступен — тик «плохой» для всех его нод
+                        self._breaker_fail(base, f"{type(e).__name__}: {e}")
+                        return None
+                self._breaker_ok(base)
+                return nested
+
+            stats = dict(zip(bases, await asyncio.gather(*(fetch(b) for b in bases))))
+
+            async def decide(cid: str, n: Dict[str, Any]) -> None:
+                base     = n["agent_base_url"]
+                backend  = n["haproxy_backend"]
+                server   = n["haproxy_server"]
+                key      = (cid, n["name"])
+                st       = self.state.setdefault(key, {"bad": 0, "good": 0, "drained": False})
 
+                nested = stats.get(base)
+                row = ((nested or {}).get(backend, {}) or {}).get(server)
+
+                if not row:
+                    st["bad"] += 1
+                    st["good"] = 0
+                else:
                     status   = (row.get("status") or "").upper()
                     hrsp_5xx = int((row.get("hrsp_5xx") or "0") or "0")
 
@@ -59,7 +177,21 @@ class RuleEngine:
                         st["good"] += 1
                         st["bad"]   = 0
 
-                    await self._maybe_act(client, headers, n, st, need_b, need_g)
+                if nested is None:
+                    # до агента не достучались — действовать через него бессмысленно
+                    return
+                async with sem:
+                    try:
+                        await asyncio.wait_for(self._maybe_act(client, headers, n, st, need_b, need_g), dl)
+                    except Exception as e:
+                        self._breaker_fail(base, f"{type(e).__name__}: {e}")
+
+            await asyncio.gather(*(decide(cid, n) for cid, n in nodes))
+        finally:
+            if own:
+                await client.aclose()
+
+        self._observe_tick(time.monotonic() - t0)
 
     async def _maybe_act(self, client: httpx.AsyncClient, headers: Dict[str, str],
                          n: Dict[str, Any], st: Dict[str, Any], need_b: int, need_g: int):
@@ -68,9 +200,11 @@ class RuleEngine:
         server  = n["haproxy_server"]
 
         if st["bad"] >= need_b and not st["drained"]:
-            await client.post(f"{base}/node/{backend}/{server}/drain", headers=headers)
+            r = await client.post(f"{base}/node/{backend}/{server}/drain", headers=headers)
+            r.raise_for_status()
             st["drained"] = True
 
         elif st["good"] >= need_g and st["drained"]:
-            await client.post(f"{base}/node/{backend}/{server}/enable", headers=headers)
+            r = await client.post(f"{base}/node/{backend}/{server}/enable", headers=headers)
+            r.raise_for_status()
             st["drained"] = False
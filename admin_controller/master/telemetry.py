@@ -0,0 +1,95 @@
+import time
+from typing import Dict, Any, Optional
+
+def agent_key(url: str) -> str:
+    """Ключ агента: agent_base_url из конфига и agent из push приводятся к одному виду."""
+    u = str(url or "").strip().rstrip("/").lower()
+    if u and "://" not in u:
+        u = "http://" + u
+    return u
+
+class ClusterState:
+    """
+    Живая таблица состояния нод по push-телеметрии агентов (POST /telemetry/push).
+
+    agent_key(url) -> {"seq", "ts", "recv_ts", "sample_ts", "error", "rows": {"backend/server": {поле: значение}}}
+    - full-сообщение заменяет таблицу агента целиком
+    - дельта применяется только если seq == предыдущий + 1, иначе просим resync
+    - таблица устарела (RuleEngine тогда опрашивает агента сам), если у агента ошибка
+      show stat или возраст сэмпла больше stale_sec. Возраст = (ts - sample_ts) по часам
+      агента + время с приёма по часам мастера — расхождение часов не мешает, а heartbeat
+      не «освежает» старую таблицу
+    """
+    def __init__(self, stale_sec: float = 15.0):
+        self.stale_sec = float(stale_sec)
+        self.agents: Dict[str, Dict[str, Any]] = {}
+        self.received = 0
+        self.resyncs = 0
+
+    def apply(self, msg: Dict[str, Any]) -> Dict[str, Any]:
+        agent = agent_key(msg.get("agent"))
+        if not agent:
+            return {"ok": False, "error": "agent required"}
+        try:
+            seq = int(msg.get("seq") or 0)
+            ts = float(msg.get("ts") or time.time())
+            sample_ts = float(msg.get("sample_ts") or ts)
+        except (TypeError, ValueError):
+            return {"ok": False, "error": "bad seq/ts"}
+        rows = msg.get("rows") or {}
+        removed = msg.get("removed") or []
+        if not isinstance(rows, dict) or not all(isinstance(v, dict) for v in rows.values()) \
+                or not isinstance(removed, list):
+            return {"ok": False, "error": "bad rows"}
+        self.received += 1
+        cur = self.agents.get(agent)
+        if msg.get("full"):
+            cur = self.agents[agent] = {"seq": seq, "ts": 0.0, "recv_ts": 0.0,
+                                        "rows": {k: dict(v) for k, v in rows.items()}}
+        elif cur is None or seq != cur["seq"] + 1:
+            self.resyncs += 1
+            return {"ok": False, "resync": True}
+        else:
+            for key, ch in rows.items():
+                cur["rows"].setdefault(key, {}).update(ch)
+            for key in removed:
+                cur["rows"].pop(key, None)
+            cur["seq"] = seq
+        cur["ts"] = ts
+        cur["sample_ts"] = sample_ts
+        cur["error"] = str(msg.get("error") or "")
+        cur["recv_ts"] = time.time()
+        return {"ok": True, "resync": False}
+
+    @staticmethod
+    def _age(st: Dict[str, Any], now: float) -> float:
+        return max(0.0, st["ts"] - st.get("sample_ts", st["ts"])) + (now - st["recv_ts"])
+
+    def _stale(self, st: Dict[str, Any], now: float) -> bool:
+        return bool(st.get("error")) or self._age(st, now) > self.stale_sec
+
+    def fresh(self, agent: str) -> Optional[Dict[str, Any]]:
+        st = self.agents.get(agent_key(agent))
+        if not st or self._stale(st, time.time()):
+            return None
+        return st
+
+    def nested(self, agent: str) -> Optional[Dict[str, Dict[str, Dict[str, str]]]]:
+        """В формате агентского /haproxy/stat: {backend: {server: row}}; None — данных нет или устарели."""
+        st = self.fresh(agent)
+        if st is None:
+            return None
+        out: Dict[str, Dict[str, Dict[str, str]]] = {}
+        for key, row in st["rows"].items():
+            bk, _, srv = key.partition("/")
+            out.setdefault(bk, {})[srv] = row
+        return out
+
+    def snapshot(self) -> Dict[str, Any]:
+        now = time.time()
+        return {
+            "received": self.received, "resyncs": self.resyncs,
+            "agents": {a: {"seq": st["seq"], "age_sec": round(self._age(st, now), 1),
+                           "stale": self._stale(st, now), "error": st.get("error", ""), "rows": st["rows"]}
+                       for a, st in self.agents.items()},
+        }
@@ -0,0 +1,38 @@
+# -*- coding: utf-8 -*-
+"""anomaly_detector: peer z при ошибках у всех соседей бэкенда."""
+import argparse
+import json
+import os
+import sys
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[1] / "bin"))
+
+import anomaly_detector as ad  # noqa: E402
+
+
+def _args(tmp_path: Path) -> argparse.Namespace:
+    return argparse.Namespace(
+        state=str(tmp_path / "state.json"), signal_dir=str(tmp_path / "sig"), ops_queue=str(tmp_path / "q"),
+        log_dir=str(tmp_path), alpha=0.1, z_thr=3.0, drain_conf=0.9, min_requests=20, err_floor=0.005,
+        rtime_floor_ms=10.0, act=False, max_drained=1, drained_ttl_sec=600.0, ramp=False)
+
+
+def _write(path: Path, total: int, e5: int, mtime: float) -> None:
+    rows = [{"pxname": "be", "svname": f"s{i}", "status": "UP", "hrsp_2xx": str(total - e5),
+             "hrsp_5xx": str(e5), "rtime": "50"} for i in range(3)]
+    path.write_text(json.dumps({"rows": rows}), encoding="utf-8")
+    os.utime(path, (mtime, mtime))
+
+
+def test_all_peers_erroring_does_not_abort_tick(tmp_path, monkeypatch):
+    monkeypatch.setattr(ad, "metrics_root", lambda: tmp_path)
+    monkeypatch.setattr("weight_ramp.EVENTS_DIR", tmp_path / "events")
+    det = ad.Detector(_args(tmp_path))
+    last = tmp_path / "last.json"
+    _write(last, 100, 100, 1000.0)
+    assert det.tick() == []  # первый сэмпл — только счётчики
+    _write(last, 200, 200, 1010.0)  # за интервал 100% 5xx у всех серверов
+    out = det.tick()
+    assert isinstance(out, list)
+    assert all(sig["backend"] == "be" for sig in out)